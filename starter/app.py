@@ -1,26 +1,188 @@
 import os
 from flask import (
     Flask,
+    Response,
     request,
     abort,
+    current_app,
     jsonify
     )
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from config import load_config
 from models import (
+    db,
     db_drop_and_create_all,
     setup_db,
     Collector,
     Set
     )
-from auth.auth import AuthError, requires_auth
+from auth.auth import (
+    AuthError,
+    check_permissions,
+    request_payload,
+    requires_auth
+    )
+from audit import BATCH_OPERATION, audit, changed_fields, init_audit
+from batch import BatchError, batch_cost, run_batch
+from jobs import JobError, find_job, init_jobs, job_result, submit_job
+from compression import init_compression
+from metrics import check_metrics_token, init_metrics
+from resilience import (
+    ServiceUnavailable,
+    database_unavailable,
+    init_resilience
+    )
+from coalesce import coalesce, init_coalescing
+from ratelimit import (
+    RateLimitExceeded,
+    init_rate_limiter,
+    rate_limit,
+    rate_limit_key
+    )
+from recommendations import TOP_K, recommend_sets, similar_sets
+from snapshot import init_snapshot, snapshot_listing
+from payloads import init_payloads, payload_listing
+from search import KINDS, MAX_LIMIT, init_search, search_names
+from collection_index import (
+    MAX_OPERANDS,
+    OPERATIONS,
+    collection_algebra,
+    init_collection_index
+    )
+from formats import (
+    JSON_MIMETYPE,
+    columnar_collectors,
+    columnar_sets,
+    init_formats,
+    negotiate_format
+    )
+
+
+'''
+sort_order(*popularity)
+    returns the ORDER BY of a listing from the sort query parameter, the
+    popularity order is served by the counter columns and their index
+'''
+
+
+def sort_order(*popularity):
+    sort = request.args.get('sort')
+
+    if sort is None:
+        return ()
+
+    if sort != 'popularity':
+        abort(422)
+
+    return popularity
+
+
+'''
+recommendation_limit()
+    returns the number of recommendations asked for with the limit query
+    parameter, at most the TOP_K that are stored per set
+'''
+
+
+def recommendation_limit():
+    limit = request.args.get('limit', 10, type=int)
+
+    if not 1 <= limit <= TOP_K:
+        abort(422)
+
+    return limit
+
+
+'''
+search_limit()
+    returns the number of search results asked for with the limit query
+    parameter, at most MAX_LIMIT
+'''
+
+
+def search_limit():
+    limit = request.args.get('limit', 10, type=int)
+
+    if not 1 <= limit <= MAX_LIMIT:
+        abort(422)
+
+    return limit
+
+
+'''
+collection_operands()
+    returns the collector ids listed in the collectors query parameter
+    (comma separated) followed by the collectors of the location query
+    parameter, in id order
+'''
+
+
+def collection_operands():
+    try:
+        collector_ids = [
+            int(id) for id in request.args.get('collectors', '').split(',')
+            if id.strip()]
+    except ValueError:
+        abort(422)
+
+    if 'location' in request.args:
+        location_ids = [id for id, in Collector.query.with_entities(
+            Collector.id).filter(
+                Collector.location == request.args['location']).order_by(
+                    Collector.id)]
+        collector_ids += [
+            id for id in location_ids if id not in collector_ids]
+
+    if not collector_ids or len(collector_ids) > MAX_OPERANDS:
+        abort(422)
+
+    return collector_ids
+
+
+'''
+take_token(payload, cost)
+    takes cost rate limit tokens for routes that are not wrapped in
+    rate_limit, the operations of a batch were paid for by the batch
+
+verified_payload()
+    verifies the bearer token and takes a rate limit token for routes
+    that check their permissions themselves
+'''
+
+
+def take_token(payload=None, cost=1):
+    if request.environ.get(BATCH_OPERATION):
+        return
+    current_app.extensions['rate_limiter'].check(
+        rate_limit_key(payload), cost)
+
+
+def verified_payload():
+    payload = request_payload()
+    take_token(payload)
+    return payload
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
+    load_config(app, test_config)
     setup_db(app)
+    init_metrics(app)
+    init_resilience(app, db)
+    init_audit(app)
+    init_compression(app)
+    init_rate_limiter(app)
+    init_coalescing(app)
+    init_formats(app)
+    init_collection_index(app, db)
+    init_snapshot(app)
+    init_payloads(app)
+    init_search(app, db)
+    init_jobs(app)
     CORS(app)
 
     # uncomment the following line to initialize the database
@@ -40,11 +202,23 @@ def create_app(test_config=None):
     #  ----------------------------------------------------------------
 
     @app.route('/sets', methods=['GET'])
+    @rate_limit
+    @coalesce
     def get_sets():
         if not request.method == 'GET':
             abort(405)
 
-        sets = Set.query.all()
+        order = sort_order(Set.collector_count.desc(), Set.id.desc())
+        mimetype = negotiate_format()
+        response = snapshot_listing(
+            'sets', mimetype, popular=bool(order))
+        if response is not None:
+            return response
+
+        if mimetype != JSON_MIMETYPE:
+            return columnar_sets(mimetype, order=order)
+
+        sets = Set.query.order_by(*order).all()
         formatted_sets = [set.short() for set in sets]
 
         return jsonify({
@@ -54,11 +228,27 @@ def create_app(test_config=None):
 
     @app.route('/sets-detail', methods=['GET'])
     @requires_auth('get:sets-detail')
+    @rate_limit
+    @coalesce
     def get_sets_detail(token):
         if not request.method == 'GET':
             abort(405)
 
-        sets = Set.query.all()
+        order = sort_order(Set.collector_count.desc(), Set.id.desc())
+        mimetype = negotiate_format()
+        response = snapshot_listing(
+            'sets', mimetype, detail=True, popular=bool(order))
+        if response is not None:
+            return response
+
+        if mimetype != JSON_MIMETYPE:
+            return columnar_sets(mimetype, detail=True, order=order)
+
+        response = payload_listing(db.session, 'sets', popular=bool(order))
+        if response is not None:
+            return response
+
+        sets = Set.query.order_by(*order).all()
         formatted_sets = [set.long() for set in sets]
 
         return jsonify({
@@ -71,6 +261,7 @@ def create_app(test_config=None):
 
     @app.route('/sets', methods=['POST'])
     @requires_auth('post:sets')
+    @rate_limit
     def create_set(token):
         if not request.method == 'POST':
             abort(405)
@@ -89,6 +280,8 @@ def create_app(test_config=None):
                 pieces=pieces
                 )
             set.insert()
+            audit(token, 'create', 'sets', set.id,
+                  changed_fields(data, 'name', 'year', 'pieces'))
 
             return jsonify({
                 'success': True,
@@ -104,6 +297,7 @@ def create_app(test_config=None):
 
     @app.route('/sets/<int:set_id>', methods=['PATCH'])
     @requires_auth('patch:sets')
+    @rate_limit
     def update_set(token, set_id):
         if not request.method == 'PATCH':
             abort(405)
@@ -126,6 +320,8 @@ def create_app(test_config=None):
 
         try:
             set.update()
+            audit(token, 'update', 'sets', set_id,
+                  changed_fields(data, 'name', 'year', 'pieces'))
 
             return jsonify({
                 'success': True,
@@ -141,6 +337,7 @@ def create_app(test_config=None):
 
     @app.route('/sets/<int:set_id>', methods=['DELETE'])
     @requires_auth('delete:sets')
+    @rate_limit
     def delete_set(token, set_id):
         if not request.method == 'DELETE':
             abort(405)
@@ -152,6 +349,7 @@ def create_app(test_config=None):
 
         try:
             set.delete()
+            audit(token, 'delete', 'sets', set_id)
 
             return jsonify({
                 'success': True,
@@ -162,15 +360,50 @@ def create_app(test_config=None):
             set.rollback()
             abort(422)
 
+    #  Set Recommendations
+    #  ----------------------------------------------------------------
+
+    @app.route('/sets/<int:set_id>/recommendations', methods=['GET'])
+    @rate_limit
+    @coalesce
+    def get_set_recommendations(set_id):
+        if not request.method == 'GET':
+            abort(405)
+
+        limit = recommendation_limit()
+        set = Set.query.filter(Set.id == set_id).one_or_none()
+
+        if set is None:
+            abort(404)
+
+        return jsonify({
+            'success': True,
+            'set number': set_id,
+            'recommendations': similar_sets(db.session, set_id, limit)
+            }), 200
+
     #  Collectors
     #  ----------------------------------------------------------------
 
     @app.route('/collectors', methods=['GET'])
+    @rate_limit
+    @coalesce
     def get_collector():
         if not request.method == 'GET':
             abort(405)
 
-        collectors = Collector.query.all()
+        order = sort_order(
+            Collector.set_count.desc(), Collector.id.desc())
+        mimetype = negotiate_format()
+        response = snapshot_listing(
+            'collectors', mimetype, popular=bool(order))
+        if response is not None:
+            return response
+
+        if mimetype != JSON_MIMETYPE:
+            return columnar_collectors(mimetype, order=order)
+
+        collectors = Collector.query.order_by(*order).all()
         formatted_collectors = [collector.short() for collector in collectors]
 
         return jsonify({
@@ -180,11 +413,29 @@ def create_app(test_config=None):
 
     @app.route('/collectors-detail', methods=['GET'])
     @requires_auth('get:collectors-detail')
+    @rate_limit
+    @coalesce
     def get_collectors_detail(token):
         if not request.method == 'GET':
             abort(405)
 
-        collectors = Collector.query.all()
+        order = sort_order(
+            Collector.set_count.desc(), Collector.id.desc())
+        mimetype = negotiate_format()
+        response = snapshot_listing(
+            'collectors', mimetype, detail=True, popular=bool(order))
+        if response is not None:
+            return response
+
+        if mimetype != JSON_MIMETYPE:
+            return columnar_collectors(mimetype, detail=True, order=order)
+
+        response = payload_listing(
+            db.session, 'collectors', popular=bool(order))
+        if response is not None:
+            return response
+
+        collectors = Collector.query.order_by(*order).all()
         formatted_collectors = [collector.long() for collector in collectors]
 
         return jsonify({
@@ -197,6 +448,7 @@ def create_app(test_config=None):
 
     @app.route('/collectors', methods=['POST'])
     @requires_auth('post:collectors')
+    @rate_limit
     def create_collector(token):
         if not request.method == 'POST':
             abort(405)
@@ -218,6 +470,8 @@ def create_app(test_config=None):
                 legos=legos
                 )
             collector.insert()
+            audit(token, 'create', 'collectors', collector.id,
+                  changed_fields(data, 'name', 'location', 'legos'))
 
             return jsonify({
                 'success': True,
@@ -233,6 +487,7 @@ def create_app(test_config=None):
 
     @app.route('/collectors/<int:collector_id>', methods=['PATCH'])
     @requires_auth('patch:collectors')
+    @rate_limit
     def update_collector(token, collector_id):
         if not request.method == 'PATCH':
             abort(405)
@@ -257,6 +512,8 @@ def create_app(test_config=None):
 
         try:
             collector.update()
+            audit(token, 'update', 'collectors', collector_id,
+                  changed_fields(data, 'name', 'location', 'legos'))
 
             return jsonify({
                 'success': True,
@@ -272,6 +529,7 @@ def create_app(test_config=None):
 
     @app.route('/collectors/<int:collector_id>', methods=['DELETE'])
     @requires_auth('delete:collectors')
+    @rate_limit
     def delete_collector(token, collector_id):
         if not request.method == 'DELETE':
             abort(405)
@@ -284,6 +542,7 @@ def create_app(test_config=None):
 
         try:
             collector.delete()
+            audit(token, 'delete', 'collectors', collector_id)
 
             return jsonify({
                 'success': True,
@@ -294,6 +553,187 @@ def create_app(test_config=None):
             collector.rollback()
             abort(422)
 
+    #  Collector Recommendations
+    #  ----------------------------------------------------------------
+
+    @app.route('/collectors/<int:collector_id>/recommendations',
+               methods=['GET'])
+    @requires_auth('get:collectors-detail')
+    @rate_limit
+    @coalesce
+    def get_collector_recommendations(token, collector_id):
+        if not request.method == 'GET':
+            abort(405)
+
+        limit = recommendation_limit()
+        collector = Collector.query.filter(
+            Collector.id == collector_id).one_or_none()
+
+        if collector is None:
+            abort(404)
+
+        return jsonify({
+            'success': True,
+            'id': collector_id,
+            'recommendations': recommend_sets(
+                db.session, collector_id, limit)
+            }), 200
+
+    #  Collection Set Algebra
+    #  ----------------------------------------------------------------
+
+    @app.route('/collections/<operation>', methods=['GET'])
+    @requires_auth('get:collectors-detail')
+    @rate_limit
+    @coalesce
+    def get_collection_algebra(token, operation):
+        if not request.method == 'GET':
+            abort(405)
+
+        if operation not in OPERATIONS:
+            abort(404)
+
+        collector_ids = collection_operands()
+        found = Collector.query.with_entities(Collector.id).filter(
+            Collector.id.in_(collector_ids)).count()
+
+        if found != len(set(collector_ids)):
+            abort(404)
+
+        result = collection_algebra(operation, collector_ids)
+        result.update({
+            'success': True,
+            'collectors': collector_ids
+            })
+
+        return jsonify(result), 200
+
+    #  Name Search
+    #  ----------------------------------------------------------------
+
+    @app.route('/search', methods=['GET'])
+    def search():
+        if not request.method == 'GET':
+            abort(405)
+
+        kind = request.args.get('type', 'sets')
+        query = request.args.get('q', '').strip()
+
+        if kind not in KINDS or not query:
+            abort(422)
+
+        # collector ids are only listed with the detail permission
+        if kind == 'collectors':
+            check_permissions('get:collectors-detail', verified_payload())
+        else:
+            take_token()
+
+        limit = search_limit()
+
+        return jsonify({
+            'success': True,
+            'query': query,
+            'results': search_names(db.session, kind, query, limit)
+            }), 200
+
+    #  Batch Requests
+    #  ----------------------------------------------------------------
+
+    @app.route('/batch', methods=['POST'])
+    def batch():
+        if not request.method == 'POST':
+            abort(405)
+
+        payload = request_payload()
+        data = request.get_json()
+
+        if data is None:
+            abort(422)
+
+        operations = data.get('requests')
+        take_token(payload, batch_cost(operations))
+
+        results, committed = run_batch(
+            app, payload, operations, data.get('atomic', False))
+
+        return jsonify({
+            'success': all(result['status'] < 400 for result in results),
+            'committed': committed,
+            'results': results
+            }), 200
+
+    #  Background Jobs
+    #  ----------------------------------------------------------------
+
+    @app.route('/jobs', methods=['POST'])
+    def create_job():
+        if not request.method == 'POST':
+            abort(405)
+
+        payload = verified_payload()
+
+        if request.files:
+            kind = request.form.get('kind')
+            params = {}
+        else:
+            data = request.get_json(silent=True)
+            if not isinstance(data, dict):
+                abort(422)
+            kind = data.get('kind')
+            params = {'format': data['format']} if 'format' in data else {}
+
+        job = submit_job(payload, kind, params, request.files)
+
+        return jsonify({
+            'success': True,
+            'job': job.format()
+            }), 202, {'Location': '/jobs/{}'.format(job.id)}
+
+    @app.route('/jobs/<int:job_id>', methods=['GET'])
+    def get_job(job_id):
+        if not request.method == 'GET':
+            abort(405)
+
+        job = find_job(verified_payload(), job_id)
+
+        if job is None:
+            abort(404)
+
+        return jsonify({
+            'success': True,
+            'job': job.format()
+            }), 200
+
+    @app.route('/jobs/<int:job_id>/result', methods=['GET'])
+    def get_job_result(job_id):
+        if not request.method == 'GET':
+            abort(405)
+
+        job = find_job(verified_payload(), job_id)
+        result = job_result(job_id) if job is not None else None
+
+        if result is None:
+            abort(404)
+
+        filename, mimetype, size, chunks = result
+        return Response(
+            chunks, status=200, mimetype=mimetype,
+            headers={'Content-Disposition':
+                     'attachment; filename="{}"'.format(filename),
+                     'Content-Length': str(size)})
+
+    #  Metrics
+    #  ----------------------------------------------------------------
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        if not request.method == 'GET':
+            abort(405)
+
+        check_metrics_token()
+        return Response(app.extensions['metrics'].render(), status=200,
+                        mimetype='text/plain; version=0.0.4')
+
     #  Error Handlers
     #  ----------------------------------------------------------------
 
@@ -305,6 +745,43 @@ def create_app(test_config=None):
                         "message": "unauthorized"
                         }), 401
 
+    @app.errorhandler(BatchError)
+    def batch_error(error):
+        return jsonify({
+                        "success": False,
+                        "error": 422,
+                        "message": error.message
+                        }), 422
+
+    @app.errorhandler(JobError)
+    def job_error(error):
+        return jsonify({
+                        "success": False,
+                        "error": 422,
+                        "message": error.message
+                        }), 422
+
+    @app.errorhandler(RateLimitExceeded)
+    def rate_limited(error):
+        return jsonify({
+                        "success": False,
+                        "error": 429,
+                        "message": "too many requests"
+                        }), 429, {'Retry-After': error.retry_after_seconds}
+
+    @app.errorhandler(ServiceUnavailable)
+    def service_unavailable(error):
+        return jsonify({
+                        "success": False,
+                        "error": 503,
+                        "message": error.message
+                        }), 503, {'Retry-After': error.retry_after_seconds}
+
+    @app.errorhandler(OperationalError)
+    @app.errorhandler(PoolTimeout)
+    def database_error(error):
+        return service_unavailable(database_unavailable(error))
+
     @app.errorhandler(404)
     def not_found(error):
         return jsonify({
@@ -340,7 +817,5 @@ def create_app(test_config=None):
     return app
 
 
-app = create_app()
-
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8080, debug=True)
+    create_app().run(host='0.0.0.0', port=8080, debug=True)
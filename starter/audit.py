@@ -0,0 +1,259 @@
+import atexit
+import logging
+import os
+from datetime import datetime, timezone
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread
+from flask import current_app, g, request
+from models import db, audit_log
+
+logger = logging.getLogger(__name__)
+
+'''
+Audit Log
+    who created, patched or deleted which set or collector, and who
+    imported the catalogue, kept in the audit_log table
+
+    a route calls audit() once its write is committed, the events of a
+    request are handed to the worker's AuditLog when the request ends, and
+    a background thread writes them in batches of at most AUDIT_BATCH_SIZE
+    rows, one INSERT per batch, so a write never waits for its audit row
+
+    the queue holds at most AUDIT_MAX_PENDING events, a request that finds
+    it full waits up to AUDIT_PUT_TIMEOUT seconds for room and then writes
+    its events itself, so a slow database slows the writers down instead
+    of growing the queue
+    a batch that fails is retried with a growing delay while the queue
+    fills up behind it
+
+    the queue is flushed when the worker exits, from gunicorn's worker_exit
+    hook or at interpreter exit, a worker that is killed loses the events
+    it still held
+
+    the batch route discards the events of an atomic batch that is rolled
+    back, the sub-requests of a batch leave their events to the batch
+    the import jobs run outside requests and write their event with
+    audit_now() in the transaction of the import
+
+    AUDIT_ENABLED          records the events (True)
+    AUDIT_BATCH_SIZE       events per INSERT (500)
+    AUDIT_MAX_PENDING      events the queue holds (10000)
+    AUDIT_PUT_TIMEOUT      seconds a request waits for room (1)
+    AUDIT_FLUSH_INTERVAL   seconds the writer waits for events (1)
+'''
+
+BATCH_OPERATION = 'lego.batch_operation'
+MAX_RETRY_DELAY = 30.0
+
+
+def audit(payload, action, resource, resource_id, changes=None):
+    g.setdefault('audit_events', []).append({
+        'occurred_at': datetime.now(timezone.utc),
+        'subject': payload.get('sub', ''),
+        'action': action,
+        'resource': resource,
+        'resource_id': resource_id,
+        'changes': changes
+        })
+
+
+'''
+audit_now(session, subject, action, resource, resource_id, changes)
+    writes an event in the transaction of the session rather than queueing
+    it, so it is committed or rolled back with the write it records
+'''
+
+
+def audit_now(session, subject, action, resource, resource_id,
+              changes=None):
+    if not current_app.config.get('AUDIT_ENABLED', True):
+        return
+    session.execute(audit_log.insert().values(
+        occurred_at=datetime.now(timezone.utc),
+        subject=subject,
+        action=action,
+        resource=resource,
+        resource_id=resource_id,
+        changes=changes))
+
+
+def changed_fields(data, *fields):
+    return {field: data[field] for field in fields if field in data}
+
+
+def discard_audit_events():
+    g.pop('audit_events', None)
+
+
+class AuditLog:
+    def __init__(self, app, metrics, batch_size=500, max_pending=10000,
+                 put_timeout=1.0, flush_interval=1.0):
+        self.app = app
+        self.metrics = metrics
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.put_timeout = put_timeout
+        self.flush_interval = flush_interval
+        self.queue = Queue(max_pending)
+        self.stopped = Event()
+        self.thread = None
+        self.pid = None
+        self.lock = Lock()
+
+    '''
+    start()
+        starts the writer thread of this process with an empty queue,
+        threads do not survive a fork so every worker starts its own on
+        first use
+    '''
+
+    def start(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid != os.getpid():
+                self.queue = Queue(self.max_pending)
+                self.stopped = Event()
+                self.thread = Thread(
+                    target=self.run, name='audit-log', daemon=True)
+                self.thread.start()
+                self.pid = os.getpid()
+                atexit.register(self.close)
+
+    def publish(self, events):
+        self.start()
+
+        for index, event in enumerate(events):
+            try:
+                self.queue.put(event, timeout=self.put_timeout)
+            except Full:
+                self.write_now(events[index:])
+                return
+            self.metrics.inc('audit_events_total', outcome='queued')
+
+    def write_now(self, events):
+        try:
+            self.write(events)
+            self.metrics.inc(
+                'audit_events_total', len(events), outcome='direct')
+        except Exception:
+            logger.exception('Writing %s audit events failed.', len(events))
+            self.metrics.inc(
+                'audit_events_total', len(events), outcome='dropped')
+
+    def run(self):
+        while not self.stopped.is_set():
+            events = self.take()
+            if events:
+                self.flush(events)
+
+    def take(self):
+        try:
+            events = [self.queue.get(timeout=self.flush_interval)]
+        except Empty:
+            return []
+
+        while len(events) < self.batch_size:
+            try:
+                events.append(self.queue.get_nowait())
+            except Empty:
+                break
+        return events
+
+    def flush(self, events):
+        delay = self.flush_interval
+        while True:
+            try:
+                self.write(events)
+                self.metrics.inc('audit_flushes_total')
+                return
+            except Exception:
+                logger.exception(
+                    'Writing %s audit events failed.', len(events))
+            if self.stopped.wait(delay):
+                # close() writes what the thread still holds
+                self.write_now(events)
+                return
+            delay = min(delay * 2, MAX_RETRY_DELAY)
+
+    def write(self, events):
+        with self.app.app_context():
+            engine = db.get_engine(self.app)
+        with engine.begin() as connection:
+            connection.execute(audit_log.insert().values(events))
+
+    def pending(self):
+        events = []
+        while True:
+            try:
+                events.append(self.queue.get_nowait())
+            except Empty:
+                return events
+
+    '''
+    close(timeout)
+        stops the writer thread and writes every event still queued
+    '''
+
+    def close(self, timeout=10.0):
+        if self.pid != os.getpid():
+            return
+
+        self.stopped.set()
+        self.thread.join(timeout)
+        self.pid = None
+
+        events = self.pending()
+        for start in range(0, len(events), self.batch_size):
+            self.write_now(events[start:start + self.batch_size])
+
+
+'''
+close_audit_log(app)
+    flushes the audit events of the worker, call it in gunicorn's
+    worker_exit
+'''
+
+
+def close_audit_log(app):
+    log = app.extensions.get('audit_log')
+    if log is not None:
+        log.close()
+
+
+def init_audit(app):
+    app.config.setdefault('AUDIT_ENABLED', True)
+    app.config.setdefault('AUDIT_BATCH_SIZE', 500)
+    app.config.setdefault('AUDIT_MAX_PENDING', 10000)
+    app.config.setdefault('AUDIT_PUT_TIMEOUT', 1.0)
+    app.config.setdefault('AUDIT_FLUSH_INTERVAL', 1.0)
+
+    if not app.config['AUDIT_ENABLED']:
+        return
+
+    metrics = app.extensions['metrics']
+    metrics.counter('audit_events_total',
+                    'Audit events, by how they were written.')
+    metrics.counter('audit_flushes_total',
+                    'Batches written by the audit thread.')
+    metrics.gauge('audit_queue_depth', 'Audit events waiting in the queue.')
+
+    log = AuditLog(
+        app, metrics,
+        batch_size=int(app.config['AUDIT_BATCH_SIZE']),
+        max_pending=int(app.config['AUDIT_MAX_PENDING']),
+        put_timeout=float(app.config['AUDIT_PUT_TIMEOUT']),
+        flush_interval=float(app.config['AUDIT_FLUSH_INTERVAL']))
+    app.extensions['audit_log'] = log
+
+    @app.teardown_request
+    def publish_audit_events(error=None):
+        if request.environ.get(BATCH_OPERATION):
+            return
+        events = g.pop('audit_events', None)
+        if events:
+            log.publish(events)
+
+    metrics.collector(
+        lambda metrics: metrics.set(
+            'audit_queue_depth', log.queue.qsize()))
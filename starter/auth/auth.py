@@ -1,14 +1,15 @@
-import os
 import json
-from flask import request, _request_ctx_stack
+import time
+from flask import current_app, request, _request_ctx_stack
 from functools import wraps
 from jose import jwt
 from urllib.request import urlopen
 
+# JWKS documents by URL, as (fetched at, jwks)
+JWKS_CACHE = {}
+JWKS_CACHE_TTL = 600
+JWKS_MIN_REFRESH_INTERVAL = 60
 
-AUTH0_DOMAIN = os.environ['AUTH0_DOMAIN']
-ALGORITHMS = os.environ['ALGORITHMS']
-API_AUDIENCE = os.environ['API_AUDIENCE']
 
 # AuthError Exception
 '''
@@ -64,27 +65,66 @@ def check_permissions(permission, payload):
     return True
 
 
-def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+'''
+get_jwks(refresh)
+    returns the signing keys of the tenant, fetched from AUTH0_JWKS_URL
+    (the tenant's .well-known/jwks.json unless configured) and cached for
+    JWKS_CACHE_TTL seconds
+    refresh fetches them again, at most once every
+    JWKS_MIN_REFRESH_INTERVAL seconds, to pick up rotated keys
+'''
+
+
+def get_jwks(refresh=False):
+    url = current_app.config.get('AUTH0_JWKS_URL') or \
+        'https://{}/.well-known/jwks.json'.format(
+            current_app.config['AUTH0_DOMAIN'])
+    cached = JWKS_CACHE.get(url)
+    now = time.time()
+
+    if cached is not None:
+        age = now - cached[0]
+        if age < JWKS_CACHE_TTL and \
+                not (refresh and age >= JWKS_MIN_REFRESH_INTERVAL):
+            return cached[1]
+
+    jsonurl = urlopen(url)
     jwks = json.loads(jsonurl.read())
-    unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
+    JWKS_CACHE[url] = (now, jwks)
+    return jwks
 
-    if 'kid' not in unverified_header:
-        raise AuthError({
-            'code': 'invalid_header',
-            'description': 'Authorization malformed.'
-        }, 401)
 
+def find_rsa_key(jwks, kid):
     for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
+        if key['kid'] == kid:
+            return {
                 'kty': key['kty'],
                 'kid': key['kid'],
                 'use': key['use'],
                 'n': key['n'],
                 'e': key['e']
             }
+    return {}
+
+
+def verify_decode_jwt(token):
+    AUTH0_DOMAIN = current_app.config['AUTH0_DOMAIN']
+    ALGORITHMS = current_app.config['ALGORITHMS']
+    API_AUDIENCE = current_app.config['API_AUDIENCE']
+
+    unverified_header = jwt.get_unverified_header(token)
+
+    if 'kid' not in unverified_header:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Authorization malformed.'
+        }, 401)
+
+    rsa_key = find_rsa_key(get_jwks(), unverified_header['kid'])
+    if not rsa_key:
+        rsa_key = find_rsa_key(
+            get_jwks(refresh=True), unverified_header['kid'])
+
     if rsa_key:
         try:
             payload = jwt.decode(
@@ -119,14 +159,62 @@ def verify_decode_jwt(token):
             }, 400)
 
 
+'''
+request_payload()
+    verifies the bearer token of the request once and returns its payload,
+    later calls in the same request reuse the payload or raise the same
+    AuthError without verifying again
+'''
+
+
+def request_payload():
+    # kept on the request context, g can outlive the request
+    context = _request_ctx_stack.top
+    if not hasattr(context, 'auth_result'):
+        try:
+            context.auth_result = verify_decode_jwt(get_token_auth_header())
+        except AuthError as e:
+            context.auth_result = e
+
+    if isinstance(context.auth_result, AuthError):
+        raise context.auth_result
+    return context.auth_result
+
+
+'''
+authenticated_payload()
+    the verified payload of the request, or None when it has no valid
+    token
+'''
+
+
+def authenticated_payload():
+    if 'Authorization' not in request.headers:
+        return None
+    try:
+        return request_payload()
+    except Exception:
+        return None
+
+
+'''
+requires_auth(permission)
+    verifies the bearer token and checks the permission before calling
+    the route with the JWT payload
+    the permission is kept on the wrapper so callers that already hold a
+    verified payload (e.g. the batch endpoint) can check it themselves and
+    call the undecorated route through __wrapped__
+'''
+
+
 def requires_auth(permission=''):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
+            payload = request_payload()
             check_permissions(permission, payload)
             return f(payload, *args, **kwargs)
 
+        wrapper.permission = permission
         return wrapper
     return requires_auth_decorator
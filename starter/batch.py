@@ -0,0 +1,171 @@
+from flask import json, request
+from werkzeug.exceptions import HTTPException, InternalServerError
+from audit import BATCH_OPERATION, discard_audit_events
+from auth.auth import AuthError, check_permissions
+from models import db
+
+MAX_BATCH_SIZE = 100
+
+'''
+Batch Requests
+    runs a list of sub-requests against the routes registered on the app
+    with a JWT payload that was verified once for the whole batch
+
+    every sub-request is an object like
+        {"method": "PATCH", "path": "/sets/10295", "body": {"year": "2021"}}
+'''
+
+
+class BatchError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+
+'''
+batch_cost(operations)
+    the rate limit tokens a batch takes, one per operation, its operations
+    are not charged again when they run
+'''
+
+
+def batch_cost(operations):
+    if isinstance(operations, list):
+        return max(1, min(len(operations), MAX_BATCH_SIZE))
+    return 1
+
+
+'''
+run_batch(app, payload, operations, atomic)
+    executes the operations in order and returns (results, committed)
+    with atomic=False every operation commits or fails on its own
+    with atomic=True the whole batch runs in a savepoint and every
+    operation in a savepoint of its own, so the commit inside a route only
+    releases that savepoint, and the first failure rolls back the batch
+    the audit events of the operations are published with the batch
+    request, those of a rolled back atomic batch are dropped
+'''
+
+
+def run_batch(app, payload, operations, atomic=False):
+    if not isinstance(operations, list) or not operations:
+        raise BatchError('requests must be a non-empty list.')
+
+    if len(operations) > MAX_BATCH_SIZE:
+        raise BatchError(
+            'a batch can contain at most {} requests.'.format(MAX_BATCH_SIZE))
+
+    session = db.session()
+    batch = session.begin_nested() if atomic else None
+    results = []
+
+    for index, operation in enumerate(operations):
+        if atomic:
+            session.begin_nested()
+
+        status, body = run_operation(app, payload, operation)
+        results.append({
+            'index': index,
+            'status': status,
+            'body': body
+            })
+
+        if status >= 400:
+            if atomic:
+                unwind(session, batch, commit=False)
+                discard_audit_events()
+                return results, False
+            session.rollback()
+
+    if atomic:
+        try:
+            unwind(session, batch, commit=True)
+            session.commit()
+        except Exception:
+            discard_audit_events()
+            raise
+
+    return results, True
+
+
+def run_operation(app, payload, operation):
+    if not isinstance(operation, dict) or 'path' not in operation:
+        return 422, {
+            'success': False,
+            'error': 422,
+            'message': 'unprocessable'
+            }
+
+    method = str(operation.get('method', 'GET')).upper()
+    headers = {'Authorization': request.headers.get('Authorization', '')}
+    # the json argument pushes an app context to serialize the body, and
+    # popping it removes the session of the batch
+    body = operation.get('body')
+    data = json.dumps(body) if body is not None else None
+
+    with app.test_request_context(
+            operation['path'],
+            method=method,
+            data=data,
+            content_type='application/json',
+            headers=headers,
+            environ_base={BATCH_OPERATION: True,
+                          'REMOTE_ADDR': request.remote_addr}):
+        try:
+            response = app.make_response(dispatch(app, payload))
+        except (HTTPException, AuthError, BatchError) as e:
+            response = app.make_response(app.handle_user_exception(e))
+        except Exception:
+            app.logger.exception('batch operation %s %s failed',
+                                 method, operation['path'])
+            response = app.make_response(
+                app.handle_http_exception(InternalServerError()))
+
+        return response.status_code, response.get_json()
+
+
+'''
+dispatch(app, payload)
+    calls the view matched for the current sub-request
+    routes guarded by requires_auth have their permission checked against
+    the batch payload and are called without verifying the token again
+    routes wrapped in rate_limit are called underneath it, the batch took
+    a token for every operation
+'''
+
+
+def dispatch(app, payload):
+    if request.routing_exception is not None:
+        raise request.routing_exception
+
+    endpoint = request.url_rule.endpoint
+    if endpoint == 'batch':
+        raise BatchError('batches cannot be nested.')
+
+    view = app.view_functions[endpoint]
+    permission = getattr(view, 'permission', None)
+
+    if permission is None:
+        return unlimited(view)(**request.view_args)
+
+    check_permissions(permission, payload)
+    return unlimited(view.__wrapped__)(payload, **request.view_args)
+
+
+def unlimited(view):
+    if getattr(view, 'rate_limited', False):
+        return view.__wrapped__
+    return view
+
+
+'''
+unwind(session, transaction, commit)
+    commits or rolls back the savepoints left open by the operations (read
+    only routes never commit theirs) and then the batch savepoint itself
+'''
+
+
+def unwind(session, transaction, commit):
+    end = session.commit if commit else session.rollback
+    while session.transaction is not transaction:
+        end()
+    end()
@@ -0,0 +1,143 @@
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from sqlalchemy import create_engine, text  # noqa: E402
+
+from collection_index import ALL_LINKS  # noqa: E402
+from counters import REPAIR_COLLECTOR_COUNTERS  # noqa: E402
+from recommendations import (  # noqa: E402
+    COLLECTOR_RECOMMENDATIONS,
+    REFRESH_QUEUED
+    )
+
+'''
+Collection Benchmark
+    times the queries that read and write the collection table, to compare
+    the plain and the hash partitioned layouts on the same data:
+
+    owners      the collectors of a set, the reverse lookup of Set.long()
+    collection  the sets of a collector, the lookup of Collector.long()
+    recommend   the recommendations of a collector
+    pieces      an UPDATE of the pieces of a set, whose trigger joins the
+                collection by set
+    link        an INSERT and a DELETE of a link with all their triggers
+    load        reading every link in collector order, as the collection
+                index does
+    refresh     refreshing the recommendations of 500 queued sets
+    repair      recomputing the counters of every collector
+
+    the writes run in transactions that are rolled back
+
+    usage: python benchmarks/collection.py --runs 200
+        (DATABASE_URL or --database-url selects the database)
+'''
+
+LOOKUPS = [
+    ('owners', 'SELECT collector_id FROM collection WHERE set_id = :set_id'),
+    ('collection',
+     'SELECT set_id FROM collection WHERE collector_id = :collector_id'),
+    ('recommend', COLLECTOR_RECOMMENDATIONS),
+    ('pieces', 'UPDATE sets SET pieces = pieces + 1 WHERE id = :set_id'),
+    ('link', '''
+INSERT INTO collection (collector_id, set_id)
+VALUES (:collector_id, :set_id) ON CONFLICT DO NOTHING;
+DELETE FROM collection
+WHERE collector_id = :collector_id AND set_id = :set_id
+''')
+    ]
+
+QUEUE_SETS = '''
+INSERT INTO recommendation_queue (set_id)
+SELECT unnest(CAST(:set_ids AS integer[])) ON CONFLICT DO NOTHING
+'''
+
+
+def timed(connection, statement, params):
+    transaction = connection.begin()
+    try:
+        started = time.perf_counter()
+        result = connection.execute(text(statement), params)
+        if result.returns_rows:
+            result.fetchall()
+        return time.perf_counter() - started
+    finally:
+        transaction.rollback()
+
+
+def lookups(connection, runs, seed):
+    rng = random.Random(seed)
+    set_ids = [id for id, in connection.execute('SELECT id FROM sets')]
+    collector_ids = [
+        id for id, in connection.execute('SELECT id FROM collectors')]
+
+    samples = {name: [] for name, _ in LOOKUPS}
+    for _ in range(runs):
+        params = {'set_id': rng.choice(set_ids),
+                  'collector_id': rng.choice(collector_ids),
+                  'limit': 10}
+        for name, statement in LOOKUPS:
+            samples[name].append(timed(connection, statement, params))
+    return samples, set_ids
+
+
+def full_scans(connection, set_ids, seed):
+    rng = random.Random(seed)
+    samples = {}
+
+    started = time.perf_counter()
+    result = connection.execution_options(
+        stream_results=True).execute(text(ALL_LINKS))
+    for _ in result:
+        pass
+    samples['load'] = [time.perf_counter() - started]
+
+    transaction = connection.begin()
+    try:
+        connection.execute(text(QUEUE_SETS),
+                           set_ids=rng.sample(set_ids, 500))
+        started = time.perf_counter()
+        connection.execute(text(REFRESH_QUEUED), batch_size=500,
+                           max_collection=1000, min_support=1, top_k=20)
+        samples['refresh'] = [time.perf_counter() - started]
+    finally:
+        transaction.rollback()
+
+    samples['repair'] = [timed(connection, REPAIR_COLLECTOR_COUNTERS, {})]
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Time the queries on the collection table.')
+    parser.add_argument('--database-url',
+                        default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--runs', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    with engine.connect() as connection:
+        partitioned = connection.execute(
+            "SELECT relkind = 'p' FROM pg_class "
+            "WHERE oid = 'collection'::regclass").scalar()
+        samples, set_ids = lookups(connection, args.runs, args.seed)
+        samples.update(full_scans(connection, set_ids, args.seed))
+
+    print('collection is {}'.format(
+        'hash partitioned' if partitioned else 'a plain table'))
+    print('{:<12} {:>10} {:>10}'.format('query', 'median ms', 'max ms'))
+    for name, values in samples.items():
+        values = [value * 1000 for value in values]
+        print('{:<12} {:>10.2f} {:>10.2f}'.format(
+            name, statistics.median(values), max(values)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import argparse
+import os
+import random
+import statistics
+import string
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from datagen import FIRST_NAMES, SUBJECTS, THEMES  # noqa: E402
+from search import KINDS, TrigramIndex  # noqa: E402
+
+'''
+Search Benchmark
+    times TrigramIndex.search() on names built like a real catalogue,
+    from a few words repeated across most of them: a theme, a subject, an
+    optional model word out of a few thousand and a common suffix, so the
+    trigrams of the common words have postings of hundreds of thousands of
+    names
+    a tenth of the names are collectors, a first name and a surname
+
+    the queries cover common words, typos of common words, rare words and
+    queries without results
+
+    usage: python benchmarks/search.py --names 1000000 --runs 20
+'''
+
+SUFFIXES = ['Set', 'Pack', 'Kit', 'Collection', 'Edition']
+
+QUERIES = [
+    'Police Station',
+    'Star Wars Set',
+    'City',
+    'Polise',
+    'Medeival Blaksmith',
+    'Ninjago Dragon Pack',
+    'Harry Potter Castle Collection',
+    'Technic Porsche 911',
+    'Ringo',
+    'Zzyzx Quux'
+    ]
+
+
+def model_words(rng, count):
+    return [''.join(rng.choice(string.ascii_lowercase)
+                    for _ in range(rng.randint(4, 9))).title()
+            for _ in range(count)]
+
+
+def catalogue(count, seed):
+    rng = random.Random(seed)
+    models = model_words(rng, 5000)
+    surnames = model_words(rng, 2000)
+
+    sets = count - count // 10
+    for id in range(1, sets + 1):
+        words = [rng.choice(THEMES), rng.choice(SUBJECTS)]
+        if rng.random() < 0.5:
+            words.append(rng.choice(models))
+        if rng.random() < 0.3:
+            words.append(rng.choice(SUFFIXES))
+        yield KINDS.index('sets'), id, ' '.join(words)
+
+    for id in range(1, count - sets + 1):
+        yield (KINDS.index('collectors'), id, '{} {}'.format(
+            rng.choice(FIRST_NAMES), rng.choice(surnames)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Time the in-memory name search.')
+    parser.add_argument('--names', type=int, default=1000000)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    index = TrigramIndex(catalogue(args.names, args.seed))
+    print('indexed {} names in {:.1f}s'.format(
+        args.names, time.perf_counter() - started))
+
+    print('{:<32} {:<10} {:>10} {:>10} {:>8}'.format(
+        'query', 'kind', 'median ms', 'max ms', 'results'))
+    for kind in range(len(KINDS)):
+        for query in QUERIES:
+            samples = []
+            for _ in range(args.runs):
+                started = time.perf_counter()
+                found = index.search(kind, query)
+                samples.append((time.perf_counter() - started) * 1000)
+            print('{:<32} {:<10} {:>10.2f} {:>10.2f} {:>8}'.format(
+                query, KINDS[kind], statistics.median(samples),
+                max(samples), len(found)))
+
+
+if __name__ == '__main__':
+    main()
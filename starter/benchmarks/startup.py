@@ -0,0 +1,64 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+'''
+Worker Boot Benchmark
+    measures, in fresh interpreters, what a gunicorn worker pays before it
+    can serve its first request:
+
+    import     importing the app module
+    create     calling create_app()
+    first      the first GET /sets through the test client, which opens the
+               first database connection
+
+    with preload_app the master pays import and create once and every
+    forked worker only pays first
+
+    usage: python benchmarks/startup.py --runs 10
+'''
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STARTER = os.path.dirname(HERE)
+
+PROBE = '''
+import time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app()
+created = time.perf_counter()
+application.test_client().get('/sets')
+served = time.perf_counter()
+print(imported - start, created - imported, served - created)
+'''
+
+
+def measure(runs):
+    samples = []
+    for _ in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, '-c', PROBE], cwd=STARTER)
+        samples.append([float(value) for value in output.split()])
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure the boot cost of a worker.')
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    samples = measure(args.runs)
+
+    print('{:<8} {:>10} {:>10}'.format('phase', 'median ms', 'max ms'))
+    for index, phase in enumerate(['import', 'create', 'first']):
+        values = [sample[index] * 1000 for sample in samples]
+        print('{:<8} {:>10.1f} {:>10.1f}'.format(
+            phase, statistics.median(values), max(values)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+from array import array
+from bisect import bisect_left
+
+'''
+Bitmap
+    an immutable, compressed set of non-negative integers in the layout of
+    roaring bitmaps: values are grouped by their high 16 bits and the low
+    16 bits of every group are kept in the smaller of two containers
+
+    array container    a sorted array('H'), 2 bytes per value, used up to
+                       ARRAY_LIMIT values
+    bitmap container   a Python int used as a 65536 bit set (8 KB at
+                       most), for denser groups
+
+    &, | and - combine two bitmaps group by group, bitmap containers with
+    integer operations and array containers with set operations, so no
+    Python code runs per value of a dense group
+'''
+
+ARRAY_LIMIT = 4096
+CONTAINER_BYTES = 8192
+
+# the positions of the bits set in every byte value
+BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1)
+             for value in range(256)]
+
+
+def popcount(bits):
+    return bin(bits).count('1')
+
+
+def to_bits(container):
+    if isinstance(container, int):
+        return container
+    buffer = bytearray(CONTAINER_BYTES)
+    for low in container:
+        buffer[low >> 3] |= 1 << (low & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def iter_bits(bits):
+    data = bits.to_bytes(CONTAINER_BYTES, 'little')
+    for index, byte in enumerate(data):
+        if byte:
+            for bit in BYTE_BITS[byte]:
+                yield index << 3 | bit
+
+
+def to_lows(container):
+    if isinstance(container, int):
+        return set(iter_bits(container))
+    return set(container)
+
+
+'''
+container(values)
+    returns the container for a group, or None for an empty group
+    values is either a set of low bits or an int bit set
+'''
+
+
+def container(values):
+    if isinstance(values, int):
+        if not values:
+            return None
+        if popcount(values) > ARRAY_LIMIT:
+            return values
+        return array('H', iter_bits(values))
+
+    if not values:
+        return None
+    if len(values) > ARRAY_LIMIT:
+        return to_bits(values)
+    return array('H', sorted(values))
+
+
+def container_len(container):
+    if isinstance(container, int):
+        return popcount(container)
+    return len(container)
+
+
+def intersect(a, b):
+    if isinstance(a, int) or isinstance(b, int):
+        return container(to_bits(a) & to_bits(b))
+    return container(set(a).intersection(b))
+
+
+def unite(a, b):
+    if isinstance(a, int) or isinstance(b, int):
+        return container(to_bits(a) | to_bits(b))
+    return container(set(a).union(b))
+
+
+def subtract(a, b):
+    if isinstance(a, int):
+        return container(a & ~to_bits(b))
+    return container(set(a).difference(to_lows(b)))
+
+
+class Bitmap:
+    __slots__ = ('containers',)
+
+    def __init__(self, values=()):
+        groups = {}
+        for value in values:
+            groups.setdefault(value >> 16, set()).add(value & 0xFFFF)
+
+        self.containers = {}
+        for high, lows in groups.items():
+            self.containers[high] = container(lows)
+
+    @classmethod
+    def from_containers(cls, containers):
+        bitmap = cls()
+        bitmap.containers = {
+            high: value for high, value in containers.items()
+            if value is not None}
+        return bitmap
+
+    def __len__(self):
+        return sum(container_len(value)
+                   for value in self.containers.values())
+
+    def __bool__(self):
+        return bool(self.containers)
+
+    def __iter__(self):
+        for high in sorted(self.containers):
+            value = self.containers[high]
+            lows = iter_bits(value) if isinstance(value, int) else value
+            for low in lows:
+                yield high << 16 | low
+
+    def __contains__(self, value):
+        group = self.containers.get(value >> 16)
+        if group is None:
+            return False
+        low = value & 0xFFFF
+        if isinstance(group, int):
+            return bool(group >> low & 1)
+        index = bisect_left(group, low)
+        return index < len(group) and group[index] == low
+
+    def __eq__(self, other):
+        if not isinstance(other, Bitmap):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __and__(self, other):
+        return Bitmap.from_containers({
+            high: intersect(value, other.containers[high])
+            for high, value in self.containers.items()
+            if high in other.containers})
+
+    def __or__(self, other):
+        containers = dict(self.containers)
+        for high, value in other.containers.items():
+            if high in containers:
+                containers[high] = unite(containers[high], value)
+            else:
+                containers[high] = value
+        return Bitmap.from_containers(containers)
+
+    def __sub__(self, other):
+        return Bitmap.from_containers({
+            high: subtract(value, other.containers[high])
+            if high in other.containers else value
+            for high, value in self.containers.items()})
+
+    def __repr__(self):
+        return 'Bitmap({})'.format(list(self))
+
+    @property
+    def nbytes(self):
+        return sum(
+            (value.bit_length() + 7) // 8 if isinstance(value, int)
+            else value.itemsize * len(value)
+            for value in self.containers.values())
@@ -0,0 +1,311 @@
+import csv
+import io
+import json
+import time
+from itertools import islice
+from models import db
+
+'''
+Catalogue Import
+    streams a file of sets and a file of collections into temporary
+    staging tables with COPY FROM STDIN, chunk by chunk, and merges each
+    staging table into its target with a single upsert
+
+    files are read as NDJSON when they end in .ndjson or .jsonl and as CSV
+    with a header row otherwise
+
+    sets          id, name, year, pieces
+    collections   collector_id, name, location, set_id
+                  one row per set owned, set_id may be empty for a
+                  collector without sets
+
+    memory use depends on the chunk size only, never on the file size
+    when the same id appears more than once, the last row wins
+'''
+
+DEFAULT_CHUNK_SIZE = 50000
+
+SET_FIELDS = ('id', 'name', 'year', 'pieces')
+COLLECTION_FIELDS = ('collector_id', 'name', 'location', 'set_id')
+
+STAGING_TABLES = '''
+CREATE TEMPORARY TABLE import_sets (
+    line bigint,
+    id integer,
+    name text,
+    year text,
+    pieces integer
+) ON COMMIT DROP;
+CREATE TEMPORARY TABLE import_collection (
+    line bigint,
+    collector_id integer,
+    name text,
+    location text,
+    set_id integer
+) ON COMMIT DROP;
+'''
+
+MERGE_SETS = '''
+INSERT INTO sets (id, name, year, pieces)
+SELECT DISTINCT ON (id) id, name, year, pieces
+FROM import_sets
+ORDER BY id, line DESC
+ON CONFLICT (id) DO UPDATE
+SET name = EXCLUDED.name,
+    year = EXCLUDED.year,
+    pieces = EXCLUDED.pieces
+'''
+
+MERGE_COLLECTORS = '''
+INSERT INTO collectors (id, name, location)
+SELECT DISTINCT ON (collector_id) collector_id, name, location
+FROM import_collection
+ORDER BY collector_id, line DESC
+ON CONFLICT (id) DO UPDATE
+SET name = EXCLUDED.name,
+    location = EXCLUDED.location
+'''
+
+RESET_COLLECTOR_SEQUENCE = '''
+SELECT setval(
+    pg_get_serial_sequence('collectors', 'id'),
+    coalesce(max(id), 1),
+    max(id) IS NOT NULL)
+FROM collectors
+'''
+
+UNKNOWN_SETS = '''
+SELECT i.line, i.collector_id, i.set_id
+FROM import_collection i
+LEFT JOIN sets s ON s.id = i.set_id
+WHERE i.set_id IS NOT NULL AND s.id IS NULL
+'''
+
+MERGE_COLLECTION = '''
+INSERT INTO collection (collector_id, set_id)
+SELECT DISTINCT i.collector_id, i.set_id
+FROM import_collection i
+JOIN sets s ON s.id = i.set_id
+ON CONFLICT DO NOTHING
+'''
+
+
+class ImportReport:
+    def __init__(self):
+        self.read = 0
+        self.staged = 0
+        self.rejected = 0
+        self.merged = {}
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.read / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        merged = ', '.join(
+            '{} {}'.format(count, table)
+            for table, count in self.merged.items())
+        return ('read {} rows, rejected {}, merged {} in {:.1f}s '
+                '({:.0f} rows/s)').format(
+                    self.read, self.rejected, merged or 'nothing',
+                    self.elapsed, self.rows_per_second)
+
+
+'''
+read_records(path)
+    yields one dict per row of a CSV file, or the text of every line of an
+    NDJSON file, decoded by stage() so that a malformed line is rejected
+    like any invalid row
+'''
+
+
+def read_records(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith(('.ndjson', '.jsonl')):
+            for line in f:
+                if line.strip():
+                    yield line.rstrip('\r\n')
+        else:
+            yield from csv.DictReader(f)
+
+
+def to_int(value, required=True):
+    if value is None or value == '':
+        if required:
+            raise ValueError('missing value')
+        return None
+    return int(value)
+
+
+def to_text(value):
+    if value is None or str(value).strip() == '':
+        raise ValueError('missing value')
+    return str(value)
+
+
+def parse_set(record):
+    return (
+        to_int(record.get('id')),
+        to_text(record.get('name')),
+        to_text(record.get('year')),
+        to_int(record.get('pieces'))
+        )
+
+
+def parse_collection(record):
+    return (
+        to_int(record.get('collector_id')),
+        to_text(record.get('name')),
+        to_text(record.get('location')),
+        to_int(record.get('set_id'), required=False)
+        )
+
+
+'''
+stage(records, parse, report, rejects, source)
+    validates the records and yields the valid ones as tuples starting with
+    their line number, invalid ones are counted and written to rejects
+    records given as text are NDJSON lines, a line that is not JSON is
+    written to rejects as it was read
+'''
+
+
+def stage(records, parse, report, rejects=None, source=''):
+    for line, record in enumerate(records, start=1):
+        report.read += 1
+        try:
+            if isinstance(record, str):
+                record = json.loads(record)
+            row = parse(record)
+        except (AttributeError, TypeError, ValueError) as e:
+            report.rejected += 1
+            if rejects is not None:
+                rejects.writerow([
+                    source, line, str(e),
+                    record if isinstance(record, str)
+                    else json.dumps(record)])
+            continue
+        report.staged += 1
+        yield (line,) + row
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def copy_rows(cursor, table, columns, rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert(
+        'COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(
+            table, ', '.join(columns)),
+        buffer)
+
+
+'''
+reject_unknown_sets(connection, report, rejects)
+    counts the collection rows that point to a set that does not exist
+    a named (server side) cursor keeps the rows out of memory
+'''
+
+
+def reject_unknown_sets(connection, report, rejects=None, source=''):
+    cursor = connection.cursor(name='unknown_sets')
+    cursor.itersize = DEFAULT_CHUNK_SIZE
+    cursor.execute(UNKNOWN_SETS)
+
+    for line, collector_id, set_id in cursor:
+        report.rejected += 1
+        if rejects is not None:
+            rejects.writerow([source, line, 'unknown set {}'.format(set_id),
+                              json.dumps({'collector_id': collector_id,
+                                          'set_id': set_id})])
+    cursor.close()
+
+
+'''
+import_catalogue(sets_path, collections_path, chunk_size, rejects_path,
+                 progress, names, session)
+    runs the whole import in one transaction and returns an ImportReport
+    names maps 'sets' and 'collections' to the file names written in the
+    rejects, the paths by default
+    given a session, the import runs in its transaction and the caller
+    commits, otherwise on a connection of its own that is committed
+'''
+
+
+def import_catalogue(sets_path=None, collections_path=None,
+                     chunk_size=DEFAULT_CHUNK_SIZE, rejects_path=None,
+                     progress=None, names=None, session=None):
+    report = ImportReport()
+    rejects_file = None
+    rejects = None
+    names = dict({'sets': sets_path, 'collections': collections_path},
+                 **(names or {}))
+
+    if rejects_path is not None:
+        rejects_file = open(rejects_path, 'w', newline='', encoding='utf-8')
+        rejects = csv.writer(rejects_file)
+        rejects.writerow(['file', 'line', 'reason', 'record'])
+
+    if session is not None:
+        connection = session.connection().connection
+    else:
+        connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(STAGING_TABLES)
+
+        if sets_path is not None:
+            for chunk in chunked(stage(read_records(sets_path), parse_set,
+                                       report, rejects, names['sets']),
+                                 chunk_size):
+                copy_rows(cursor, 'import_sets',
+                          ('line',) + SET_FIELDS, chunk)
+                if progress is not None:
+                    progress(report)
+
+        if collections_path is not None:
+            for chunk in chunked(stage(read_records(collections_path),
+                                       parse_collection, report, rejects,
+                                       names['collections']),
+                                 chunk_size):
+                copy_rows(cursor, 'import_collection',
+                          ('line',) + COLLECTION_FIELDS, chunk)
+                if progress is not None:
+                    progress(report)
+
+        cursor.execute(MERGE_SETS)
+        report.merged['sets'] = cursor.rowcount
+        cursor.execute(MERGE_COLLECTORS)
+        report.merged['collectors'] = cursor.rowcount
+        cursor.execute(RESET_COLLECTOR_SEQUENCE)
+        reject_unknown_sets(connection, report, rejects,
+                            names['collections'])
+        cursor.execute(MERGE_COLLECTION)
+        report.merged['collection'] = cursor.rowcount
+
+        if session is None:
+            connection.commit()
+    except Exception:
+        if session is None:
+            connection.rollback()
+        raise
+    finally:
+        if session is None:
+            connection.close()
+        if rejects_file is not None:
+            rejects_file.close()
+
+    return report
@@ -0,0 +1,106 @@
+from functools import wraps
+from threading import Event, Lock
+from flask import current_app, request, Response
+
+'''
+Request Coalescing
+    concurrent identical GET requests handled by the same worker share one
+    run of the route: the first request (the leader) queries and
+    serializes, the others wait for it and reuse the serialized bytes
+
+    works with thread and greenlet (gevent/eventlet) workers, the waiting
+    is done with threading primitives that those libraries patch
+    gunicorn's default sync worker handles one request at a time, so it
+    never has two requests to coalesce, run it with --threads or a gthread
+    or gevent worker class to benefit
+'''
+
+
+class Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = Event()
+        self.result = None
+        self.error = None
+
+
+'''
+SingleFlight
+    runs fn once per key for all the callers that arrive while it is in
+    flight, do() returns (result, shared)
+'''
+
+
+class SingleFlight:
+    def __init__(self):
+        self.calls = {}
+        self.lock = Lock()
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+
+        return call.result, False
+
+
+def init_coalescing(app):
+    app.config.setdefault('COALESCE_ENABLED', True)
+    app.extensions['single_flight'] = SingleFlight()
+
+
+'''
+@coalesce
+    coalesces a GET route, place it directly above the route function
+    requests are identical when they hit the same endpoint with the same
+    path, query string and Accept header, permissions are checked by
+    requires_auth before the request gets here
+'''
+
+
+def coalesce(f):
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        if not current_app.config['COALESCE_ENABLED'] \
+                or request.method != 'GET':
+            return f(*args, **kwargs)
+
+        def render():
+            response = current_app.make_response(f(*args, **kwargs))
+            if response.is_streamed or response.direct_passthrough:
+                return response
+            return (response.get_data(), response.status_code,
+                    list(response.headers.items()))
+
+        key = (request.endpoint, request.full_path,
+               request.headers.get('Accept', ''))
+        result, shared = current_app.extensions['single_flight'].do(
+            key, render)
+
+        if isinstance(result, Response):
+            # a streamed body can only be consumed once
+            return f(*args, **kwargs) if shared else result
+
+        data, status, headers = result
+        return Response(data, status=status, headers=headers)
+
+    return wrapper
@@ -0,0 +1,238 @@
+from itertools import combinations, groupby
+from operator import itemgetter
+from threading import Lock
+from time import monotonic
+from flask import current_app
+from bitmap import Bitmap
+
+'''
+Collection Index
+    every worker keeps the sets of every collector as a Bitmap, so
+    intersections, unions, differences and overlaps of collections are
+    computed in memory instead of by diffing '/collectors-detail'
+
+    the index is loaded from the collection table on first use and kept in
+    sync through collection_changes: a trigger on collection logs the
+    collectors whose links changed, with the id of the writing
+    transaction, and the index reloads those collectors
+
+    a sync reads the changes of every transaction that was still running at
+    the previous sync, so a transaction that commits late is never missed,
+    and reloading a collector twice does no harm
+
+    COLLECTION_INDEX_SYNC_INTERVAL   seconds between two syncs (1)
+    COLLECTION_INDEX_RETENTION       seconds the changes are kept (3600), a
+                                     worker that did not sync for half of
+                                     it reloads the whole index
+'''
+
+CHANGE_TRIGGERS = '''
+CREATE OR REPLACE FUNCTION log_collection_changes() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO collection_changes (collector_id)
+        SELECT DISTINCT collector_id FROM new_links;
+    END IF;
+
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        INSERT INTO collection_changes (collector_id)
+        SELECT DISTINCT collector_id FROM old_links;
+    END IF;
+
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER collection_changes_insert
+AFTER INSERT ON collection
+REFERENCING NEW TABLE AS new_links
+FOR EACH STATEMENT EXECUTE FUNCTION log_collection_changes();
+
+CREATE TRIGGER collection_changes_delete
+AFTER DELETE ON collection
+REFERENCING OLD TABLE AS old_links
+FOR EACH STATEMENT EXECUTE FUNCTION log_collection_changes();
+
+CREATE TRIGGER collection_changes_update
+AFTER UPDATE ON collection
+REFERENCING OLD TABLE AS old_links NEW TABLE AS new_links
+FOR EACH STATEMENT EXECUTE FUNCTION log_collection_changes();
+'''
+
+SNAPSHOT_XMIN = '''
+SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint
+'''
+
+CHANGED_COLLECTORS = '''
+SELECT DISTINCT collector_id FROM collection_changes WHERE xid >= :xmin
+'''
+
+PRUNE_CHANGES = '''
+DELETE FROM collection_changes
+WHERE changed_at < now() - make_interval(secs => :retention)
+'''
+
+ALL_LINKS = '''
+SELECT collector_id, set_id FROM collection ORDER BY collector_id
+'''
+
+COLLECTOR_LINKS = '''
+SELECT collector_id, set_id FROM collection
+WHERE collector_id = ANY(:collector_ids)
+ORDER BY collector_id
+'''
+
+OPERATIONS = ('intersection', 'union', 'difference', 'overlap')
+MAX_OPERANDS = 100
+
+
+def bitmaps(rows):
+    return {
+        collector_id: Bitmap(set_id for _, set_id in links)
+        for collector_id, links in groupby(rows, key=itemgetter(0))}
+
+
+class CollectionIndex:
+    def __init__(self, db, sync_interval=1.0, retention=3600.0):
+        self.db = db
+        self.sync_interval = sync_interval
+        self.retention = retention
+        self.collections = None
+        self.xmin = None
+        self.synced_at = None
+        self.pruned_at = None
+        self.lock = Lock()
+
+    def reset(self):
+        with self.lock:
+            self.collections = None
+
+    def load(self):
+        session = self.db.session
+        xmin = session.execute(SNAPSHOT_XMIN).scalar()
+        result = session.connection().execution_options(
+            stream_results=True).execute(self.db.text(ALL_LINKS))
+        collections = bitmaps(result)
+
+        self.collections = collections
+        self.xmin = xmin
+        self.synced_at = monotonic()
+
+    def sync(self):
+        session = self.db.session
+        xmin = session.execute(SNAPSHOT_XMIN).scalar()
+        changed = [row[0] for row in session.execute(
+            CHANGED_COLLECTORS, {'xmin': self.xmin})]
+
+        if changed:
+            reloaded = bitmaps(session.execute(
+                COLLECTOR_LINKS, {'collector_ids': changed}))
+            # replacing single items keeps the dict valid for readers
+            for collector_id in changed:
+                if collector_id in reloaded:
+                    self.collections[collector_id] = reloaded[collector_id]
+                else:
+                    self.collections.pop(collector_id, None)
+
+        self.xmin = xmin
+        self.synced_at = monotonic()
+
+    def prune(self):
+        with self.db.engine.begin() as connection:
+            connection.execute(
+                self.db.text(PRUNE_CHANGES), retention=self.retention)
+        self.pruned_at = monotonic()
+
+    '''
+    current()
+        returns the collections by collector id, synced at most
+        sync_interval seconds ago
+        only one thread syncs at a time, the others read the collections
+        of the previous sync meanwhile
+    '''
+
+    def current(self):
+        now = monotonic()
+        stale = self.collections is None or \
+            now - self.synced_at >= self.sync_interval
+
+        if stale and self.lock.acquire(blocking=self.collections is None):
+            try:
+                if self.collections is None or \
+                        now - self.synced_at >= self.retention / 2:
+                    self.load()
+                elif now - self.synced_at >= self.sync_interval:
+                    self.sync()
+
+                if self.pruned_at is None or \
+                        now - self.pruned_at >= self.retention / 2:
+                    self.prune()
+            finally:
+                self.lock.release()
+
+        return self.collections
+
+
+def init_collection_index(app, db):
+    app.config.setdefault('COLLECTION_INDEX_SYNC_INTERVAL', 1.0)
+    app.config.setdefault('COLLECTION_INDEX_RETENTION', 3600.0)
+
+    app.extensions['collection_index'] = CollectionIndex(
+        db,
+        float(app.config['COLLECTION_INDEX_SYNC_INTERVAL']),
+        float(app.config['COLLECTION_INDEX_RETENTION']))
+
+
+'''
+warm_collection_index(app)
+    loads the index before the workers are forked from a preloaded app,
+    so they start with it
+'''
+
+
+def warm_collection_index(app):
+    with app.app_context():
+        app.extensions['collection_index'].current()
+        app.extensions['collection_index'].db.session.remove()
+
+
+'''
+collection_algebra(operation, collector_ids)
+    intersection   sets owned by every collector
+    union          sets owned by any collector
+    difference     sets owned by the first collector and none of the others
+    overlap        number of sets owned by both, for every pair
+'''
+
+
+def collection_algebra(operation, collector_ids):
+    collections = current_app.extensions['collection_index'].current()
+    operands = [collections.get(id, Bitmap()) for id in collector_ids]
+
+    if operation == 'overlap':
+        return {
+            'overlap': [{
+                'collectors': [collector_ids[a], collector_ids[b]],
+                'count': len(operands[a] & operands[b])
+                } for a, b in combinations(range(len(operands)), 2)]
+            }
+
+    if operation == 'intersection':
+        operands.sort(key=len)
+
+    result = operands[0]
+    for operand in operands[1:]:
+        if operation == 'intersection':
+            if not result:
+                break
+            result = result & operand
+        elif operation == 'union':
+            result = result | operand
+        else:
+            result = result - operand
+
+    return {
+        'sets': list(result),
+        'count': len(result)
+        }
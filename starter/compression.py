@@ -0,0 +1,135 @@
+import hashlib
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+'''
+Response Compression and Conditional GET
+    negotiates gzip (and brotli when the brotli package is installed) from
+    Accept-Encoding, adds a strong ETag to successful GET responses and
+    answers matching If-None-Match requests with 304
+
+    the ETag is a digest of the uncompressed body with the content coding
+    appended, so every representation of a resource gets its own validator
+    the responses are marked Cache-Control: no-cache, so clients check the
+    ETag with the server before reusing them, and carry no Last-Modified,
+    as no worker knows when a listing last changed
+'''
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/vnd.lego.columnar+json',
+    'application/x-msgpack',
+    'text/csv',
+    'text/html',
+    'text/plain'
+    }
+
+
+def init_compression(app):
+    app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+    app.config.setdefault('COMPRESS_LEVEL', 6)
+    app.config.setdefault('COMPRESS_MIMETYPES', COMPRESSIBLE_MIMETYPES)
+
+    @app.after_request
+    def compress_response(response):
+        if response.status_code != 200 \
+                or 'Content-Encoding' in response.headers \
+                or response.mimetype not in app.config['COMPRESS_MIMETYPES']:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate_encoding()
+        level = app.config['COMPRESS_LEVEL']
+
+        if response.is_streamed or response.direct_passthrough:
+            if encoding is not None:
+                response.response = compress_stream(
+                    response.response, encoding, level)
+                response.direct_passthrough = False
+                response.headers['Content-Encoding'] = encoding
+                response.headers.pop('Content-Length', None)
+            return response
+
+        data = response.get_data()
+
+        if len(data) < app.config['COMPRESS_MIN_SIZE']:
+            encoding = None
+
+        if request.method in ('GET', 'HEAD'):
+            digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+            etag = digest if encoding is None else digest + '-' + encoding
+            response.set_etag(etag)
+            response.cache_control.no_cache = True
+
+            if request.if_none_match.contains_weak(etag):
+                response.status_code = 304
+                response.set_data(b'')
+                response.headers.pop('Content-Length', None)
+                return response
+
+        if encoding is not None:
+            response.set_data(compress(data, encoding, level))
+            response.headers['Content-Encoding'] = encoding
+
+        return response
+
+
+'''
+negotiate_encoding()
+    returns the preferred content coding the client accepts, or None
+'''
+
+
+def negotiate_encoding():
+    available = ['br', 'gzip'] if brotli is not None else ['gzip']
+    encoding = request.accept_encodings.best_match(available)
+
+    if encoding is None or request.accept_encodings[encoding] == 0:
+        return None
+    return encoding
+
+
+def compress(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=min(level, 11))
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+'''
+compress_stream(chunks, encoding, level)
+    compresses a streamed body chunk by chunk
+    every chunk is flushed so clients still receive data as it is produced
+'''
+
+
+def compress_stream(chunks, encoding, level):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=min(level, 11))
+    else:
+        compressor = zlib.compressobj(
+            level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+
+        if encoding == 'br':
+            data = compressor.process(chunk) + compressor.flush()
+        else:
+            data = compressor.compress(chunk) \
+                + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+        if data:
+            yield data
+
+    if encoding == 'br':
+        yield compressor.finish()
+    else:
+        yield compressor.flush()
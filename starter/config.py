@@ -0,0 +1,32 @@
+import os
+
+'''
+load_config(app, test_config)
+    reads the settings from the environment when the app is created, never
+    at import time, so importing the modules has no side effects
+    values in test_config win over the environment
+'''
+
+ENVIRONMENT_SETTINGS = {
+    'SQLALCHEMY_DATABASE_URI': 'DATABASE_URL',
+    'AUTH0_DOMAIN': 'AUTH0_DOMAIN',
+    'ALGORITHMS': 'ALGORITHMS',
+    'API_AUDIENCE': 'API_AUDIENCE',
+    'AUTH0_JWKS_URL': 'AUTH0_JWKS_URL',
+    'RATELIMIT_ENABLED': 'RATELIMIT_ENABLED',
+    'RATELIMIT_RATE': 'RATELIMIT_RATE',
+    'RATELIMIT_BURST': 'RATELIMIT_BURST',
+    'RATELIMIT_STORAGE_URL': 'RATELIMIT_STORAGE_URL',
+    'TRUSTED_PROXY_HOPS': 'TRUSTED_PROXY_HOPS',
+    'METRICS_DIR': 'METRICS_DIR',
+    'METRICS_TOKEN': 'METRICS_TOKEN',
+    'MATERIALIZED_PAYLOADS': 'MATERIALIZED_PAYLOADS'
+    }
+
+
+def load_config(app, test_config=None):
+    for setting, variable in ENVIRONMENT_SETTINGS.items():
+        if variable in os.environ:
+            app.config[setting] = os.environ[variable]
+
+    app.config.from_mapping(test_config or {})
@@ -0,0 +1,146 @@
+'''
+Collection Counters
+    sets.collector_count, collectors.set_count and collectors.total_pieces
+    are kept up to date by Postgres triggers in the same transaction as the
+    change to the collection table, so reading them never touches the
+    collection table
+
+    the triggers run once per statement and read the changed rows from
+    transition tables, a COPY or multi-row INSERT of a million links runs
+    one aggregate UPDATE per table instead of a million single-row ones
+
+    collection   INSERT, DELETE, UPDATE   adjust the counters of the sets
+                                          and collectors of the changed
+                                          links
+    sets         UPDATE                   adjusts total_pieces of the
+                                          owners of a set whose pieces
+                                          changed
+
+    repair_counters() recomputes every counter from the collection table,
+    for data written while the triggers were disabled (for instance with
+    session_replication_role = replica)
+'''
+
+COUNTER_TRIGGERS = '''
+CREATE OR REPLACE FUNCTION count_collection_changes() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE sets s
+        SET collector_count = s.collector_count + n.links
+        FROM (SELECT set_id, count(*) AS links
+              FROM new_links GROUP BY set_id) n
+        WHERE s.id = n.set_id;
+
+        UPDATE collectors c
+        SET set_count = c.set_count + n.links,
+            total_pieces = c.total_pieces + n.pieces
+        FROM (SELECT l.collector_id, count(*) AS links,
+                     sum(s.pieces) AS pieces
+              FROM new_links l JOIN sets s ON s.id = l.set_id
+              GROUP BY l.collector_id) n
+        WHERE c.id = n.collector_id;
+    END IF;
+
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE sets s
+        SET collector_count = s.collector_count - o.links
+        FROM (SELECT set_id, count(*) AS links
+              FROM old_links GROUP BY set_id) o
+        WHERE s.id = o.set_id;
+
+        UPDATE collectors c
+        SET set_count = c.set_count - o.links,
+            total_pieces = c.total_pieces - o.pieces
+        FROM (SELECT l.collector_id, count(*) AS links,
+                     sum(s.pieces) AS pieces
+              FROM old_links l JOIN sets s ON s.id = l.set_id
+              GROUP BY l.collector_id) o
+        WHERE c.id = o.collector_id;
+    END IF;
+
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER collection_counters_insert
+AFTER INSERT ON collection
+REFERENCING NEW TABLE AS new_links
+FOR EACH STATEMENT EXECUTE FUNCTION count_collection_changes();
+
+CREATE TRIGGER collection_counters_delete
+AFTER DELETE ON collection
+REFERENCING OLD TABLE AS old_links
+FOR EACH STATEMENT EXECUTE FUNCTION count_collection_changes();
+
+CREATE TRIGGER collection_counters_update
+AFTER UPDATE ON collection
+REFERENCING OLD TABLE AS old_links NEW TABLE AS new_links
+FOR EACH STATEMENT EXECUTE FUNCTION count_collection_changes();
+
+CREATE OR REPLACE FUNCTION count_set_pieces_changes() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    -- the counter updates above run nested and never change pieces
+    IF pg_trigger_depth() > 1 THEN
+        RETURN NULL;
+    END IF;
+
+    UPDATE collectors c
+    SET total_pieces = c.total_pieces + d.pieces
+    FROM (SELECT l.collector_id, sum(n.pieces - o.pieces) AS pieces
+          FROM new_sets n
+          JOIN old_sets o ON o.id = n.id
+          JOIN collection l ON l.set_id = n.id
+          WHERE n.pieces <> o.pieces
+          GROUP BY l.collector_id) d
+    WHERE c.id = d.collector_id;
+
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER sets_pieces_counters
+AFTER UPDATE ON sets
+REFERENCING OLD TABLE AS old_sets NEW TABLE AS new_sets
+FOR EACH STATEMENT EXECUTE FUNCTION count_set_pieces_changes();
+'''
+
+REPAIR_SET_COUNTERS = '''
+UPDATE sets s
+SET collector_count = coalesce(n.links, 0)
+FROM sets t
+LEFT JOIN (SELECT set_id, count(*) AS links
+           FROM collection GROUP BY set_id) n ON n.set_id = t.id
+WHERE s.id = t.id
+AND s.collector_count <> coalesce(n.links, 0)
+'''
+
+REPAIR_COLLECTOR_COUNTERS = '''
+UPDATE collectors c
+SET set_count = coalesce(n.links, 0),
+    total_pieces = coalesce(n.pieces, 0)
+FROM collectors t
+LEFT JOIN (SELECT l.collector_id, count(*) AS links,
+                  sum(s.pieces) AS pieces
+           FROM collection l JOIN sets s ON s.id = l.set_id
+           GROUP BY l.collector_id) n ON n.collector_id = t.id
+WHERE c.id = t.id
+AND (c.set_count <> coalesce(n.links, 0)
+     OR c.total_pieces <> coalesce(n.pieces, 0))
+'''
+
+
+'''
+repair_counters(session)
+    recomputes every counter with one UPDATE per table and returns the
+    number of rows that were wrong, by table
+    the caller commits
+'''
+
+
+def repair_counters(session):
+    return {
+        'sets': session.execute(REPAIR_SET_COUNTERS).rowcount,
+        'collectors': session.execute(REPAIR_COLLECTOR_COUNTERS).rowcount
+        }
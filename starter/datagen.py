@@ -0,0 +1,158 @@
+import random
+import time
+from catalogue import (
+    DEFAULT_CHUNK_SIZE,
+    RESET_COLLECTOR_SEQUENCE,
+    chunked,
+    copy_rows
+    )
+from models import db
+from payloads import DISABLE_PAYLOADS, PAYLOADS_INSTALLED, REBUILD_PAYLOADS
+
+'''
+Synthetic Data
+    generates sets, collectors and collection links for scale testing and
+    writes them with COPY, in chunks, so 10^7 links need no more memory
+    than a chunk
+
+    the same seed always gives the same data
+    collection sizes follow a Pareto distribution (most collectors own a
+    handful of sets, a few own thousands) and some sets are far more
+    popular than others: the set at position i of n is picked with
+    probability proportional to (i / n) ** (1 / popularity - 1)
+
+    new rows get ids above the current maximum, so the generator can be run
+    against a database that already has data
+
+    the payloads of payloads.py, when installed, are rebuilt once at the
+    end instead of after every chunk
+'''
+
+THEMES = [
+    'City', 'Technic', 'Creator', 'Star Wars', 'Ninjago', 'Friends',
+    'Ideas', 'Architecture', 'Castle', 'Space', 'Harry Potter', 'Speed'
+    ]
+
+SUBJECTS = [
+    'Police Station', 'Fire Truck', 'Medieval Blacksmith', 'Porsche 911',
+    'Tuk Tuk', 'Lighthouse', 'Space Shuttle', 'Treehouse', 'Castle',
+    'Pirate Ship', 'Train Station', 'Race Car', 'Dragon', 'Bakery'
+    ]
+
+FIRST_NAMES = [
+    'Paul', 'John', 'George', 'Ringo', 'Murat', 'Ada', 'Grace', 'Linus',
+    'Alan', 'Barbara', 'Edsger', 'Margaret', 'Ken', 'Dennis'
+    ]
+
+LOCATIONS = [
+    'Liverpool', 'Fremont', 'Billund', 'London', 'Istanbul', 'Tokyo',
+    'Berlin', 'New York', 'Sydney', 'Toronto'
+    ]
+
+
+class Generator:
+    def __init__(self, seed=0, alpha=1.2, popularity=3.0):
+        self.seed = seed
+        self.alpha = alpha
+        self.popularity = popularity
+
+    def sets(self, first_id, count):
+        rng = random.Random('sets-{}'.format(self.seed))
+        for id in range(first_id, first_id + count):
+            yield (
+                id,
+                '{} {}'.format(rng.choice(THEMES), rng.choice(SUBJECTS)),
+                str(rng.randint(1958, 2024)),
+                max(1, int(rng.lognormvariate(6, 1)))
+                )
+
+    def collectors(self, first_id, count):
+        rng = random.Random('collectors-{}'.format(self.seed))
+        for id in range(first_id, first_id + count):
+            yield (
+                id,
+                '{} {}'.format(rng.choice(FIRST_NAMES), id),
+                rng.choice(LOCATIONS)
+                )
+
+    '''
+    collection(collector_ids, set_ids)
+        yields (collector_id, set_id) links, the set ids are an id range
+    '''
+
+    def collection(self, collector_ids, set_ids):
+        rng = random.Random('collection-{}'.format(self.seed))
+        first_set, total = set_ids.start, len(set_ids)
+        if not total:
+            return
+
+        for collector_id in collector_ids:
+            size = min(total, int(rng.paretovariate(self.alpha)))
+            for position in self.pick(rng, total, size):
+                yield collector_id, first_set + position
+
+    def pick(self, rng, total, size):
+        if size * 2 > total:
+            return rng.sample(range(total), size)
+
+        picked = set()
+        while len(picked) < size:
+            picked.add(int(total * rng.random() ** self.popularity))
+        return picked
+
+
+def next_id(cursor, table):
+    cursor.execute('SELECT coalesce(max(id), 0) + 1 FROM {}'.format(table))
+    return cursor.fetchone()[0]
+
+
+'''
+generate_data(sets, collectors, seed, alpha, popularity, chunk_size)
+    writes the generated rows in one transaction and returns the counts
+    and the elapsed time
+'''
+
+
+def generate_data(sets, collectors, seed=0, alpha=1.2, popularity=3.0,
+                  chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    generator = Generator(seed, alpha, popularity)
+    started = time.perf_counter()
+    counts = {'sets': 0, 'collectors': 0, 'collection': 0}
+
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(DISABLE_PAYLOADS)
+        first_set = next_id(cursor, 'sets')
+        first_collector = next_id(cursor, 'collectors')
+        set_ids = range(first_set, first_set + sets)
+        collector_ids = range(first_collector, first_collector + collectors)
+
+        batches = [
+            ('sets', ('id', 'name', 'year', 'pieces'),
+             generator.sets(first_set, sets)),
+            ('collectors', ('id', 'name', 'location'),
+             generator.collectors(first_collector, collectors)),
+            ('collection', ('collector_id', 'set_id'),
+             generator.collection(collector_ids, set_ids))
+            ]
+
+        for table, columns, rows in batches:
+            for chunk in chunked(rows, chunk_size):
+                copy_rows(cursor, table, columns, chunk)
+                counts[table] += len(chunk)
+                if progress is not None:
+                    progress(table, counts[table])
+
+        cursor.execute(PAYLOADS_INSTALLED)
+        if cursor.fetchone()[0]:
+            cursor.execute(REBUILD_PAYLOADS)
+        cursor.execute(RESET_COLLECTOR_SEQUENCE)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+    return counts, time.perf_counter() - started
@@ -0,0 +1,157 @@
+import json
+from flask import request, Response
+from sqlalchemy import select
+from models import db, collection, Collector, Set
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+'''
+Columnar Listings
+    machine clients can ask for a listing in a columnar layout through the
+    Accept header: the column names are sent once and every column is a
+    parallel array of values, built straight from the query result tuples
+    without creating a dict per row
+
+    application/vnd.lego.columnar+json    columnar JSON
+    application/x-msgpack                 columnar MessagePack, only offered
+                                          when the msgpack package is
+                                          installed
+'''
+
+JSON_MIMETYPE = 'application/json'
+COLUMNAR_MIMETYPE = 'application/vnd.lego.columnar+json'
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+
+sets_table = Set.__table__
+collectors_table = Collector.__table__
+
+SET_COLUMNS = [
+    ('set number', sets_table.c.id),
+    ('name', sets_table.c.name),
+    ('release year', sets_table.c.year),
+    ('number of pieces', sets_table.c.pieces),
+    ('number of collectors', sets_table.c.collector_count)
+    ]
+
+COLLECTOR_COLUMNS = [
+    ('name', collectors_table.c.name),
+    ('location', collectors_table.c.location),
+    ('number of sets', collectors_table.c.set_count),
+    ('total pieces', collectors_table.c.total_pieces)
+    ]
+
+COLLECTOR_DETAIL_COLUMNS = [
+    ('id', collectors_table.c.id)
+    ] + COLLECTOR_COLUMNS
+
+NEGOTIATED_ENDPOINTS = {
+    'get_sets',
+    'get_sets_detail',
+    'get_collector',
+    'get_collectors_detail'
+    }
+
+
+def init_formats(app):
+    @app.after_request
+    def vary_on_accept(response):
+        if request.endpoint in NEGOTIATED_ENDPOINTS:
+            response.vary.add('Accept')
+        return response
+
+
+'''
+negotiate_format()
+    returns the listing media type preferred by the client
+    plain JSON wins ties so browsers and */* clients are unaffected
+'''
+
+
+def negotiate_format():
+    offered = [JSON_MIMETYPE, COLUMNAR_MIMETYPE]
+    if msgpack is not None:
+        offered.append(MSGPACK_MIMETYPE)
+
+    return request.accept_mimetypes.best_match(
+        offered, default=JSON_MIMETYPE)
+
+
+def columnar_sets(mimetype, detail=False, order=()):
+    names, values = query_columns(SET_COLUMNS, order)
+
+    if detail:
+        owners = group_pairs(select([
+            collection.c.set_id,
+            collectors_table.c.name
+            ]).select_from(collection.join(
+                collectors_table,
+                collectors_table.c.id == collection.c.collector_id)))
+        names.append('collectors')
+        values.append([owners.get(id, []) for id in values[0]])
+
+    return columnar_response(mimetype, 'sets', names, values)
+
+
+def columnar_collectors(mimetype, detail=False, order=()):
+    if not detail:
+        names, values = query_columns(COLLECTOR_COLUMNS, order)
+        return columnar_response(mimetype, 'collectors', names, values)
+
+    names, values = query_columns(COLLECTOR_DETAIL_COLUMNS, order)
+    legos = group_pairs(select([
+        collection.c.collector_id,
+        collection.c.set_id
+        ]))
+    names.append('sets collected')
+    values.append([legos.get(id, []) for id in values[0]])
+
+    return columnar_response(mimetype, 'collectors', names, values)
+
+
+'''
+query_columns(columns, order)
+    runs one SELECT for the given (name, column) pairs and transposes the
+    result rows into one list per column
+'''
+
+
+def query_columns(columns, order=()):
+    rows = db.session.execute(
+        select([column for _, column in columns]).order_by(*order)
+        ).fetchall()
+
+    names = [name for name, _ in columns]
+    if rows:
+        values = [list(column) for column in zip(*rows)]
+    else:
+        values = [[] for _ in columns]
+
+    return names, values
+
+
+def group_pairs(query):
+    groups = {}
+    for key, value in db.session.execute(query):
+        groups.setdefault(key, []).append(value)
+    return groups
+
+
+def columnar_response(mimetype, key, names, values):
+    body = {
+        'success': True,
+        key: {
+            'columns': names,
+            'values': values,
+            'count': len(values[0]) if values else 0
+            }
+        }
+
+    if mimetype == MSGPACK_MIMETYPE:
+        data = msgpack.packb(body, use_bin_type=True)
+    else:
+        data = json.dumps(body, separators=(',', ':'))
+
+    return Response(data, status=200, mimetype=mimetype)
@@ -0,0 +1,43 @@
+from audit import close_audit_log
+from collection_index import warm_collection_index
+from metrics import share_metrics
+from models import dispose_engine
+from resilience import watch_listeners
+from search import warm_search
+from snapshot import warm_snapshot
+
+'''
+Gunicorn Settings
+    the app is imported and created once in the master and then forked,
+    so workers boot without importing or configuring anything themselves
+    connections opened by the master must not be shared with the workers,
+    every worker drops the inherited pool right after the fork
+    the collection index, the catalogue snapshot and the search index are
+    loaded once in the master too
+    every worker hands its listening sockets to the load shedder, which
+    reads the depth of their accept queue
+    a worker that exits writes the audit events it still holds
+    the workers keep their counters and histograms in files of their own
+    in METRICS_DIR, which every scrape adds up
+'''
+
+preload_app = True
+
+
+def on_starting(server):
+    share_metrics(server.app.wsgi())
+
+
+def when_ready(server):
+    warm_collection_index(server.app.wsgi())
+    warm_snapshot(server.app.wsgi())
+    warm_search(server.app.wsgi())
+
+
+def post_fork(server, worker):
+    dispose_engine(server.app.wsgi())
+    watch_listeners(server.app.wsgi(), worker.sockets)
+
+
+def worker_exit(server, worker):
+    close_audit_log(server.app.wsgi())
@@ -0,0 +1,578 @@
+import csv
+import json
+import logging
+import os
+import signal
+import tempfile
+import time
+from multiprocessing import get_context
+from threading import Event, Thread
+from sqlalchemy import text
+from audit import audit_now
+from auth.auth import check_permissions
+from catalogue import COLLECTION_FIELDS, SET_FIELDS, import_catalogue
+from models import db, dispose_engine, Job
+
+logger = logging.getLogger(__name__)
+
+'''
+Background Jobs
+    exports and bulk imports run outside the web workers: a request queues
+    a job in the jobs table and returns its id right away, a pool of
+    worker processes (python manage.py run_jobs) runs the queued jobs and
+    the client polls GET '/jobs/{id}' for the status and progress and
+    downloads the result from GET '/jobs/{id}/result'
+
+    the queue is the jobs table itself, no broker is needed: a worker
+    claims the oldest queued job with FOR UPDATE SKIP LOCKED, so
+    concurrent workers never take the same one, and writes a heartbeat
+    while it runs it
+    a job whose heartbeat is older than JOBS_TIMEOUT seconds lost its
+    worker and is queued again, at most JOBS_MAX_ATTEMPTS times in all
+
+    export-sets          the sets, in the import format (CSV or NDJSON),
+                         needs get:sets-detail
+    export-collections   the collections, in the import format, needs
+                         get:collectors-detail
+    import-catalogue     import_catalogue() of the uploaded files, the
+                         result is the rejected rows, needs post:sets and
+                         post:collectors
+
+    the uploads and the results are stored in rows of FILE_CHUNK_SIZE
+    bytes, written and read one chunk at a time, so neither a web worker
+    nor a job worker holds a whole file in memory and a file is not
+    limited to the 1 GB of a bytea value, a result is streamed to the
+    client chunk by chunk
+
+    JOBS_PROCESSES            worker processes of run_jobs (2)
+    JOBS_POLL_INTERVAL        seconds an idle worker waits (1)
+    JOBS_HEARTBEAT_INTERVAL   seconds between two heartbeats (5)
+    JOBS_TIMEOUT              seconds without a heartbeat before a job is
+                              queued again (60)
+    JOBS_MAX_ATTEMPTS         runs of a job before it fails (3)
+    JOBS_RETENTION            seconds finished jobs are kept (604800)
+'''
+
+JOB_PERMISSIONS = {
+    'export-sets': ('get:sets-detail',),
+    'export-collections': ('get:collectors-detail',),
+    'import-catalogue': ('post:sets', 'post:collectors')
+    }
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', '.csv'),
+    'ndjson': ('application/x-ndjson', '.ndjson')
+    }
+
+IMPORT_FILES = ('sets', 'collections')
+IMPORT_SUFFIXES = ('.csv', '.ndjson', '.jsonl')
+
+EXPORT_CHUNK_SIZE = 50000
+FILE_CHUNK_SIZE = 1 << 20
+
+EXPORT_SETS = '''
+SELECT id, name, year, pieces FROM sets ORDER BY id
+'''
+
+EXPORT_COLLECTIONS = '''
+SELECT c.id, c.name, c.location, l.set_id
+FROM collectors c
+LEFT JOIN collection l ON l.collector_id = c.id
+ORDER BY c.id, l.set_id
+'''
+
+FAIL_LOST_JOBS = '''
+UPDATE jobs
+SET status = 'failed',
+    error = 'The worker running the job was lost.',
+    finished_at = now()
+WHERE status = 'running'
+AND heartbeat_at < now() - make_interval(secs => :timeout)
+AND attempts >= :max_attempts
+'''
+
+CLAIM_JOB = '''
+UPDATE jobs
+SET status = 'running',
+    attempts = attempts + 1,
+    progress = 0,
+    started_at = now(),
+    heartbeat_at = now()
+WHERE id = (
+    SELECT id FROM jobs
+    WHERE status = 'queued'
+    OR (status = 'running'
+        AND heartbeat_at < now() - make_interval(secs => :timeout))
+    ORDER BY id
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED)
+RETURNING id
+'''
+
+HEARTBEAT = '''
+UPDATE jobs SET heartbeat_at = now(), progress = :progress
+WHERE id = :id AND status = 'running'
+'''
+
+INSERT_FILE = '''
+INSERT INTO job_files (job_id, name, filename, mimetype)
+VALUES (:job_id, :name, :filename, :mimetype)
+'''
+
+INSERT_FILE_CHUNK = '''
+INSERT INTO job_file_chunks (job_id, name, seq, data)
+VALUES (:job_id, :name, :seq, :data)
+'''
+
+SELECT_FILE_CHUNK = '''
+SELECT data FROM job_file_chunks
+WHERE job_id = :job_id AND name = :name AND seq = :seq
+'''
+
+SELECT_RESULT = '''
+SELECT f.filename, f.mimetype, coalesce(sum(octet_length(c.data)), 0)
+FROM job_files f
+LEFT JOIN job_file_chunks c ON c.job_id = f.job_id AND c.name = f.name
+WHERE f.job_id = :job_id AND f.name = 'result'
+GROUP BY f.filename, f.mimetype
+'''
+
+DELETE_INPUTS = '''
+DELETE FROM job_files WHERE job_id = :job_id AND name <> 'result'
+'''
+
+PRUNE_JOBS = '''
+DELETE FROM jobs
+WHERE finished_at < now() - make_interval(secs => :retention)
+'''
+
+
+class JobError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+
+'''
+Heartbeat
+    a thread that records, on a connection of its own, that the job is
+    still running and how many rows it has processed
+'''
+
+
+class Heartbeat(Thread):
+    def __init__(self, engine, job_id, interval):
+        super().__init__(name='job-heartbeat', daemon=True)
+        self.engine = engine
+        self.job_id = job_id
+        self.interval = interval
+        self.progress = 0
+        self.stopped = Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                with self.engine.begin() as connection:
+                    connection.execute(text(HEARTBEAT), id=self.job_id,
+                                       progress=self.progress)
+            except Exception:
+                logger.exception('The heartbeat of job %s failed.',
+                                 self.job_id)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+'''
+write_file(session, job_id, name, filename, mimetype, f)
+    stores the content of the file object in chunks of FILE_CHUNK_SIZE
+    bytes, read one at a time
+'''
+
+
+def write_file(session, job_id, name, filename, mimetype, f):
+    session.execute(INSERT_FILE, {
+        'job_id': job_id,
+        'name': name,
+        'filename': filename,
+        'mimetype': mimetype
+        })
+
+    seq = 0
+    while True:
+        data = f.read(FILE_CHUNK_SIZE)
+        if not data:
+            break
+        session.execute(INSERT_FILE_CHUNK, {
+            'job_id': job_id,
+            'name': name,
+            'seq': seq,
+            'data': data
+            })
+        seq += 1
+
+
+'''
+file_chunks(bind, job_id, name)
+    yields the chunks of a stored file, each read on a connection of its
+    own from the engine (or connection) bind, so a slow reader holds no
+    connection between two chunks
+'''
+
+
+def file_chunks(bind, job_id, name):
+    seq = 0
+    while True:
+        with bind.connect() as connection:
+            data = connection.execute(text(SELECT_FILE_CHUNK), {
+                'job_id': job_id,
+                'name': name,
+                'seq': seq
+                }).scalar()
+        if data is None:
+            return
+        yield bytes(data)
+        seq += 1
+
+
+'''
+export_rows(query, header, format, heartbeat, path)
+    streams the rows of the query from a server side cursor into a CSV
+    or NDJSON file
+'''
+
+
+def export_rows(query, header, format, heartbeat, path):
+    cursor = db.session.connection().connection.cursor(name='job_export')
+    cursor.itersize = EXPORT_CHUNK_SIZE
+    cursor.execute(query)
+
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f) if format == 'csv' else None
+        if writer is not None:
+            writer.writerow(header)
+
+        while True:
+            rows = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+            if not rows:
+                break
+            if writer is not None:
+                writer.writerows(rows)
+            else:
+                f.writelines(
+                    json.dumps(dict(zip(header, row))) + '\n'
+                    for row in rows)
+            heartbeat.progress += len(rows)
+        cursor.close()
+
+
+'''
+a job runner is called with the job, its heartbeat and a temporary
+directory, and returns the result of the job and its output file as
+(filename, mimetype, path in the directory)
+'''
+
+
+def export_job(query, header, name):
+    def run(job, heartbeat, directory):
+        format = job.params['format']
+        mimetype, suffix = EXPORT_FORMATS[format]
+        path = os.path.join(directory, name + suffix)
+        export_rows(query, header, format, heartbeat, path)
+        return {'rows': heartbeat.progress}, (name + suffix, mimetype, path)
+
+    return run
+
+
+'''
+run_import(job, heartbeat, directory)
+    imports the uploaded files in the transaction that finishes the job,
+    the rejects name the files as they were uploaded
+    the import is audited as an import of the job by its owner, with the
+    rows merged into every table as changes
+'''
+
+
+def run_import(job, heartbeat, directory):
+    bind = db.session.get_bind()
+    names = dict(db.session.execute(
+        text('SELECT name, filename FROM job_files WHERE job_id = :job_id'),
+        {'job_id': job.id}).fetchall())
+    paths = {}
+    for name, suffix in job.params['files'].items():
+        paths[name] = os.path.join(directory, name + suffix)
+        with open(paths[name], 'wb') as f:
+            for data in file_chunks(bind, job.id, name):
+                f.write(data)
+    rejects_path = os.path.join(directory, 'rejects.csv')
+
+    def progress(report):
+        heartbeat.progress = report.read
+
+    report = import_catalogue(
+        paths.get('sets'), paths.get('collections'),
+        rejects_path=rejects_path, progress=progress, names=names,
+        session=db.session)
+    heartbeat.progress = report.read
+    audit_now(db.session, job.owner, 'import', 'jobs', job.id,
+              report.merged)
+
+    result = {
+        'read': report.read,
+        'rejected': report.rejected,
+        'merged': report.merged
+        }
+    return result, ('rejects.csv', 'text/csv', rejects_path)
+
+
+JOB_RUNNERS = {
+    'export-sets': export_job(EXPORT_SETS, SET_FIELDS, 'sets'),
+    'export-collections': export_job(
+        EXPORT_COLLECTIONS, COLLECTION_FIELDS, 'collections'),
+    'import-catalogue': run_import
+    }
+
+
+'''
+submit_job(payload, kind, params, files)
+    checks the permissions of the kind against the JWT payload and queues
+    a job owned by the subject of the token, files maps the import inputs
+    to uploaded files
+'''
+
+
+def submit_job(payload, kind, params=None, files=None):
+    if kind not in JOB_PERMISSIONS:
+        raise JobError('unknown job kind.')
+
+    for permission in JOB_PERMISSIONS[kind]:
+        check_permissions(permission, payload)
+
+    params = dict(params or {})
+    inputs = []
+
+    if kind == 'import-catalogue':
+        params = {'files': {}}
+        for name in IMPORT_FILES:
+            upload = (files or {}).get(name)
+            if upload is None:
+                continue
+            suffix = os.path.splitext(upload.filename or '')[1].lower()
+            if suffix not in IMPORT_SUFFIXES:
+                raise JobError('{} must be a .csv, .ndjson or .jsonl '
+                               'file.'.format(name))
+            params['files'][name] = suffix
+            inputs.append((name, upload.filename,
+                           upload.mimetype or 'application/octet-stream',
+                           upload.stream))
+        if not inputs:
+            raise JobError('upload a sets or a collections file.')
+    else:
+        params.setdefault('format', 'csv')
+        if params['format'] not in EXPORT_FORMATS:
+            raise JobError('format must be csv or ndjson.')
+        params = {'format': params['format']}
+
+    job = Job(kind=kind, owner=payload.get('sub', ''), params=params)
+    db.session.add(job)
+    db.session.flush()
+    for name, filename, mimetype, stream in inputs:
+        write_file(db.session, job.id, name, filename, mimetype, stream)
+    db.session.commit()
+
+    return job
+
+
+'''
+find_job(payload, job_id)
+    returns the job if it belongs to the subject of the token and the
+    token still holds the permissions of its kind, None otherwise
+'''
+
+
+def find_job(payload, job_id):
+    job = Job.query.filter(Job.id == job_id).one_or_none()
+
+    if job is None or job.owner != payload.get('sub'):
+        return None
+
+    for permission in JOB_PERMISSIONS[job.kind]:
+        check_permissions(permission, payload)
+
+    return job
+
+
+'''
+job_result(job_id)
+    returns the filename, the mimetype, the size and an iterator over the
+    chunks of the result of the job, or None when it has none
+'''
+
+
+def job_result(job_id):
+    row = db.session.execute(SELECT_RESULT, {'job_id': job_id}).first()
+    if row is None:
+        return None
+
+    filename, mimetype, size = row
+    return filename, mimetype, size, file_chunks(
+        db.session.get_bind(), job_id, 'result')
+
+
+class JobQueue:
+    def __init__(self, app, poll_interval=1.0, heartbeat_interval=5.0,
+                 timeout=60.0, max_attempts=3, retention=604800.0):
+        self.app = app
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.retention = retention
+
+    def claim(self):
+        db.session.execute(FAIL_LOST_JOBS, {
+            'timeout': self.timeout,
+            'max_attempts': self.max_attempts
+            })
+        job_id = db.session.execute(
+            CLAIM_JOB, {'timeout': self.timeout}).scalar()
+        db.session.commit()
+
+        if job_id is None:
+            return None
+        return Job.query.get(job_id)
+
+    '''
+    run_next()
+        claims and runs the oldest queued job, returns its id or None
+        when the queue is empty
+    '''
+
+    def run_next(self):
+        job = self.claim()
+        if job is None:
+            return None
+
+        heartbeat = Heartbeat(db.get_engine(self.app), job.id,
+                              self.heartbeat_interval)
+        heartbeat.start()
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                try:
+                    result, output = JOB_RUNNERS[job.kind](
+                        job, heartbeat, directory)
+                except Exception as e:
+                    logger.exception('Job %s failed.', job.id)
+                    db.session.rollback()
+                    self.finish(job, heartbeat, 'failed', error=str(e))
+                else:
+                    self.finish(job, heartbeat, 'succeeded', result, output)
+        finally:
+            heartbeat.stop()
+
+        return job.id
+
+    def finish(self, job, heartbeat, status, result=None, output=None,
+               error=None):
+        db.session.execute(DELETE_INPUTS, {'job_id': job.id})
+        if output is not None:
+            filename, mimetype, path = output
+            with open(path, 'rb') as f:
+                write_file(db.session, job.id, 'result', filename, mimetype,
+                           f)
+
+        job.status = status
+        job.result = result
+        job.error = error
+        job.progress = heartbeat.progress
+        job.finished_at = db.func.clock_timestamp()
+        db.session.commit()
+
+    def prune(self):
+        count = db.session.execute(
+            PRUNE_JOBS, {'retention': self.retention}).rowcount
+        db.session.commit()
+        return count
+
+    '''
+    work(stopped)
+        runs jobs until the stopped event is set, a job that is running
+        is finished first
+    '''
+
+    def work(self, stopped):
+        pruned_at = None
+        with self.app.app_context():
+            while not stopped.is_set():
+                try:
+                    if pruned_at is None or \
+                            time.monotonic() - pruned_at >= 3600:
+                        self.prune()
+                        pruned_at = time.monotonic()
+                    job_id = self.run_next()
+                except Exception:
+                    logger.exception('Running the job queue failed.')
+                    db.session.rollback()
+                    job_id = None
+                finally:
+                    db.session.remove()
+
+                if job_id is None:
+                    stopped.wait(self.poll_interval)
+
+
+def init_jobs(app):
+    app.config.setdefault('JOBS_PROCESSES', 2)
+    app.config.setdefault('JOBS_POLL_INTERVAL', 1.0)
+    app.config.setdefault('JOBS_HEARTBEAT_INTERVAL', 5.0)
+    app.config.setdefault('JOBS_TIMEOUT', 60.0)
+    app.config.setdefault('JOBS_MAX_ATTEMPTS', 3)
+    app.config.setdefault('JOBS_RETENTION', 604800.0)
+
+    app.extensions['job_queue'] = JobQueue(
+        app,
+        float(app.config['JOBS_POLL_INTERVAL']),
+        float(app.config['JOBS_HEARTBEAT_INTERVAL']),
+        float(app.config['JOBS_TIMEOUT']),
+        int(app.config['JOBS_MAX_ATTEMPTS']),
+        float(app.config['JOBS_RETENTION']))
+
+
+def worker_process(app):
+    stopped = Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stopped.set())
+    dispose_engine(app)
+    app.extensions['job_queue'].work(stopped)
+
+
+'''
+run_workers(app, processes)
+    forks the worker processes and restarts any that exits, until the
+    pool receives SIGTERM or SIGINT and passes it on to them
+'''
+
+
+def run_workers(app, processes=None):
+    processes = processes or int(app.config['JOBS_PROCESSES'])
+    context = get_context('fork')
+    stopped = Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stopped.set())
+
+    # the workers must not share the connections of the pool process
+    dispose_engine(app)
+    workers = []
+    while not stopped.is_set():
+        workers = [worker for worker in workers if worker.is_alive()]
+        while len(workers) < processes:
+            worker = context.Process(
+                target=worker_process, args=(app,), name='job-worker')
+            worker.start()
+            workers.append(worker)
+        stopped.wait(1.0)
+
+    for worker in workers:
+        worker.terminate()
+    for worker in workers:
+        worker.join()
@@ -1,14 +1,128 @@
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 
-from app import app
+from app import create_app
+import catalogue
+import counters
+import datagen
+import jobs
+import payloads
+import recommendations
 from models import db
 
+app = create_app()
 migrate = Migrate(app, db)
 manager = Manager(app)
 
 manager.add_command('db', MigrateCommand)
 
 
+@manager.option('-s', '--sets', dest='sets', default=None,
+                help='CSV or NDJSON file of sets')
+@manager.option('-c', '--collections', dest='collections', default=None,
+                help='CSV or NDJSON file of collections')
+@manager.option('--chunk-size', dest='chunk_size', type=int,
+                default=catalogue.DEFAULT_CHUNK_SIZE)
+@manager.option('--rejects', dest='rejects', default=None,
+                help='CSV file to write the rejected rows to')
+def import_catalogue(sets, collections, chunk_size, rejects):
+    """Bulk import the set catalogue and collections"""
+    report = catalogue.import_catalogue(
+        sets, collections, chunk_size, rejects,
+        progress=lambda report: print(
+            'staged {} rows ({:.0f} rows/s)'.format(
+                report.staged, report.rows_per_second)))
+    print(report)
+
+
+@manager.option('--sets', dest='sets', type=int, default=10000)
+@manager.option('--collectors', dest='collectors', type=int, default=1000)
+@manager.option('--seed', dest='seed', type=int, default=0)
+@manager.option('--alpha', dest='alpha', type=float, default=1.2,
+                help='Pareto shape of the collection sizes')
+@manager.option('--popularity', dest='popularity', type=float, default=3.0,
+                help='skew of set popularity, 1 is uniform')
+@manager.option('--chunk-size', dest='chunk_size', type=int,
+                default=catalogue.DEFAULT_CHUNK_SIZE)
+def generate_data(sets, collectors, seed, alpha, popularity, chunk_size):
+    """Generate synthetic sets, collectors and collections"""
+    counts, elapsed = datagen.generate_data(
+        sets, collectors, seed, alpha, popularity, chunk_size,
+        progress=lambda table, count: print(
+            'wrote {} {}'.format(count, table)))
+    print('generated {} in {:.1f}s'.format(
+        ', '.join('{} {}'.format(count, table)
+                  for table, count in counts.items()),
+        elapsed))
+
+
+@manager.command
+def repair_counters():
+    """Recompute the collection counters of every set and collector"""
+    repaired = counters.repair_counters(db.session)
+    db.session.commit()
+    print('repaired {} sets, {} collectors'.format(
+        repaired['sets'], repaired['collectors']))
+
+
+@manager.command
+def rebuild_payloads():
+    """Rewrite the detail payload of every set and collector"""
+    rebuilt = payloads.rebuild_payloads(db.session)
+    db.session.commit()
+    print('rebuilt the payloads' if rebuilt else
+          'the payloads are turned off, run sync_payloads first')
+
+
+@manager.command
+def sync_payloads():
+    """Create or drop the payload triggers to follow MATERIALIZED_PAYLOADS"""
+    enabled = app.config['MATERIALIZED_PAYLOADS']
+    changed = payloads.sync_payloads(db.session, enabled)
+    db.session.commit()
+    print('payloads {}{}'.format(
+        'turned ' if changed else 'already ', 'on' if enabled else 'off'))
+
+
+@manager.option('--top-k', dest='top_k', type=int,
+                default=recommendations.TOP_K)
+@manager.option('--max-collection', dest='max_collection', type=int,
+                default=recommendations.MAX_COLLECTION,
+                help='leave out collectors owning more sets')
+@manager.option('--min-support', dest='min_support', type=int,
+                default=recommendations.MIN_SUPPORT,
+                help='least number of shared owners')
+@manager.option('--block-size', dest='block_size', type=int,
+                default=recommendations.BLOCK_SIZE)
+def rebuild_recommendations(top_k, max_collection, min_support, block_size):
+    """Recompute the recommendations of every set"""
+    count, elapsed = recommendations.rebuild_recommendations(
+        db.engine, top_k, max_collection, min_support, block_size,
+        progress=print)
+    print('rebuilt {} sets in {:.1f}s'.format(count, elapsed))
+
+
+@manager.option('--top-k', dest='top_k', type=int,
+                default=recommendations.TOP_K)
+@manager.option('--max-collection', dest='max_collection', type=int,
+                default=recommendations.MAX_COLLECTION,
+                help='leave out collectors owning more sets')
+@manager.option('--min-support', dest='min_support', type=int,
+                default=recommendations.MIN_SUPPORT,
+                help='least number of shared owners')
+def refresh_recommendations(top_k, max_collection, min_support):
+    """Recompute the recommendations of the sets whose owners changed"""
+    count = recommendations.refresh_recommendations(
+        db.session, top_k, max_collection, min_support)
+    print('refreshed {} sets'.format(count))
+
+
+@manager.option('-p', '--processes', dest='processes', type=int,
+                default=None, help='worker processes (JOBS_PROCESSES)')
+def run_jobs(processes):
+    """Run the background jobs with a pool of worker processes"""
+    jobs.run_workers(app, processes)
+
+
 if __name__ == '__main__':
     manager.run()
@@ -0,0 +1,383 @@
+import hmac
+import json
+import mmap
+import os
+import tempfile
+from bisect import bisect_left
+from collections import OrderedDict
+from glob import glob
+from struct import pack_into, unpack_from
+from threading import Lock
+from time import perf_counter
+from flask import current_app, g, request
+from auth.auth import AuthError, get_token_auth_header
+
+'''
+Metrics
+    counters, histograms and gauges, rendered in the Prometheus text
+    format by GET '/metrics'
+
+    every family is declared once with counter(), histogram() or gauge(),
+    samples are keyed by their labels
+    collectors registered with collector() run right before rendering, to
+    refresh gauges that are cheaper to read than to track
+    every request is counted in http_requests_total by endpoint, method
+    and status, and timed in http_request_duration_seconds by endpoint
+    and method
+
+    once share_metrics() was called in the gunicorn master, every worker
+    keeps its counters and histograms in a memory mapped file of its own
+    in METRICS_DIR, an increment updates a double in place, and a scrape
+    adds up the files of every worker, including the workers that exited
+    gauges describe the worker that answers the scrape
+
+    a scrape sends METRICS_TOKEN as a bearer token, while none is
+    configured GET '/metrics' refuses every request
+
+    METRICS_DIR     directory of the worker files (a new temporary directory)
+    METRICS_TOKEN   the token of the scraper (None)
+'''
+
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+INITIAL_FILE_SIZE = 1 << 16
+HEADER = 8
+
+
+class Metrics:
+    def __init__(self):
+        self.families = OrderedDict()
+        self.buckets = {}
+        self.gauges = {}
+        self.collectors = []
+        self.directory = None
+        self.store = MemoryValues()
+        self.pid = os.getpid()
+        self.lock = Lock()
+
+    def counter(self, name, help):
+        self.declare(name, 'counter', help)
+
+    def gauge(self, name, help):
+        self.declare(name, 'gauge', help)
+        with self.lock:
+            self.gauges.setdefault(name, {})
+
+    def histogram(self, name, help, buckets=DURATION_BUCKETS):
+        self.declare(name, 'histogram', help)
+        self.buckets[name] = tuple(buckets)
+
+    def declare(self, name, kind, help):
+        with self.lock:
+            self.families.setdefault(name, (kind, help))
+
+    def collector(self, collect):
+        self.collectors.append(collect)
+
+    '''
+    share(directory)
+        writes the counters and histograms of this process and of every
+        process forked from now on to a file of its own in the directory,
+        after deleting the files of an earlier run
+    '''
+
+    def share(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for path in glob(os.path.join(directory, '*.db')):
+            os.remove(path)
+
+        store = self.values()
+        with self.lock:
+            self.directory = directory
+            self.store = self.open_values()
+            for key, value in store.items():
+                self.store.inc(key, value)
+
+    def open_values(self):
+        if self.directory is None:
+            return MemoryValues()
+        return MmapValues(os.path.join(
+            self.directory, '{}.db'.format(os.getpid())))
+
+    def values(self):
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.lock = Lock()
+                    if self.directory is not None:
+                        self.store = self.open_values()
+                    self.pid = os.getpid()
+        return self.store
+
+    def inc(self, name, amount=1, **labels):
+        store = self.values()
+        with self.lock:
+            store.inc((name, label_key(labels)), amount)
+
+    def observe(self, name, value, **labels):
+        buckets = self.buckets[name]
+        index = bisect_left(buckets, value)
+        bucket = format_bound(buckets[index]) \
+            if index < len(buckets) else '+Inf'
+        key = label_key(labels)
+        store = self.values()
+        with self.lock:
+            store.inc((name + '_bucket', key + (('le', bucket),)), 1)
+            store.inc((name + '_sum', key), value)
+            store.inc((name + '_count', key), 1)
+
+    def set(self, name, value, **labels):
+        key = label_key(labels)
+        self.values()
+        with self.lock:
+            self.gauges[name][key] = value
+
+    '''
+    value(name, labels)
+        the value of a gauge, or of a counter in this process
+    '''
+
+    def value(self, name, **labels):
+        key = label_key(labels)
+        store = self.values()
+        with self.lock:
+            if name in self.gauges:
+                return self.gauges[name].get(key, 0)
+            return store.value((name, key))
+
+    def collect(self):
+        if self.directory is None:
+            store = self.values()
+            with self.lock:
+                return dict(store.items())
+
+        samples = {}
+        for path in glob(os.path.join(self.directory, '*.db')):
+            with open(path, 'rb') as f:
+                data = f.read()
+            for key, value, _ in read_entries(data):
+                samples[key] = samples.get(key, 0) + value
+        return samples
+
+    def render(self):
+        for collect in self.collectors:
+            collect(self)
+
+        samples = self.collect()
+        lines = []
+        with self.lock:
+            for name, (kind, help) in self.families.items():
+                lines.append('# HELP {} {}'.format(name, help))
+                lines.append('# TYPE {} {}'.format(name, kind))
+                if kind == 'gauge':
+                    values = self.gauges[name]
+                elif kind == 'counter':
+                    values = {labels: value
+                              for (sample, labels), value in samples.items()
+                              if sample == name}
+                else:
+                    lines.extend(
+                        histogram_lines(name, self.buckets[name], samples))
+                    continue
+                for labels, value in sorted(values.items()):
+                    lines.append('{}{} {}'.format(
+                        name, format_labels(labels), format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+'''
+histogram_lines(name, buckets, samples)
+    the cumulative buckets, the sum and the count of every label set of
+    the histogram, the samples keep the count of every bucket by itself
+'''
+
+
+def histogram_lines(name, buckets, samples):
+    series = {}
+    for (sample, labels), value in samples.items():
+        if sample == name + '_bucket':
+            le = dict(labels)['le']
+            labels = tuple(label for label in labels if label[0] != 'le')
+            series.setdefault(labels, {})[le] = value
+        elif sample in (name + '_sum', name + '_count'):
+            series.setdefault(labels, {})
+
+    lines = []
+    bounds = [format_bound(bound) for bound in buckets] + ['+Inf']
+    for labels in sorted(series):
+        count = 0
+        for bound in bounds:
+            count += series[labels].get(bound, 0)
+            lines.append('{}_bucket{} {}'.format(
+                name, format_labels(labels + (('le', bound),)),
+                format_value(count)))
+        for suffix in ('_sum', '_count'):
+            lines.append('{}{}{} {}'.format(
+                name, suffix, format_labels(labels),
+                format_value(samples.get((name + suffix, labels), 0))))
+    return lines
+
+
+class MemoryValues(dict):
+    def inc(self, key, amount):
+        self[key] = self.get(key, 0) + amount
+
+    def value(self, key):
+        return self.get(key, 0)
+
+
+'''
+MmapValues(path)
+    the counters of one process in a memory mapped file: the number of
+    bytes used, then every sample as the length of its key, the key as
+    JSON padded to 8 bytes and the value as a double
+    a sample is written before the number of bytes used is raised, so a
+    scrape reading the file meanwhile never sees half a sample
+'''
+
+
+class MmapValues:
+    def __init__(self, path):
+        self.file = open(path, 'a+b')
+        size = os.fstat(self.file.fileno()).st_size
+        if size == 0:
+            size = INITIAL_FILE_SIZE
+            self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.size = size
+        self.used = unpack_from('q', self.map, 0)[0] or HEADER
+        self.offsets = {
+            key: offset for key, _, offset in read_entries(self.map)}
+
+    def inc(self, key, amount):
+        offset = self.offsets.get(key)
+        if offset is None:
+            offset = self.add(key)
+        value = unpack_from('d', self.map, offset)[0]
+        pack_into('d', self.map, offset, value + amount)
+
+    def value(self, key):
+        offset = self.offsets.get(key)
+        if offset is None:
+            return 0
+        return unpack_from('d', self.map, offset)[0]
+
+    def items(self):
+        for key, offset in self.offsets.items():
+            yield key, unpack_from('d', self.map, offset)[0]
+
+    def add(self, key):
+        encoded = json.dumps([key[0], key[1]]).encode()
+        padded = len(encoded) + (-(4 + len(encoded)) % 8)
+        entry_size = 4 + padded + 8
+
+        while self.used + entry_size > self.size:
+            self.size *= 2
+            self.file.truncate(self.size)
+            self.map = mmap.mmap(self.file.fileno(), self.size)
+
+        pack_into('i{}sd'.format(padded), self.map, self.used,
+                  len(encoded), encoded, 0.0)
+        offset = self.used + 4 + padded
+        self.used += entry_size
+        pack_into('q', self.map, 0, self.used)
+        self.offsets[key] = offset
+        return offset
+
+
+def read_entries(data):
+    used = unpack_from('q', data, 0)[0] if len(data) >= HEADER else 0
+    position = HEADER
+    while position < used:
+        length = unpack_from('i', data, position)[0]
+        padded = length + (-(4 + length) % 8)
+        name, labels = json.loads(bytes(
+            data[position + 4:position + 4 + length]))
+        offset = position + 4 + padded
+        yield (name, tuple(tuple(label) for label in labels)), \
+            unpack_from('d', data, offset)[0], offset
+        position = offset + 8
+
+
+def label_key(labels):
+    return tuple(sorted(
+        (key, '' if value is None else str(value))
+        for key, value in labels.items()))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(key, value.replace('\\', '\\\\').replace(
+            '"', '\\"').replace('\n', '\\n'))
+        for key, value in labels) + '}'
+
+
+def format_bound(bound):
+    return repr(float(bound))
+
+
+def format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+'''
+share_metrics(app)
+    makes the workers forked from the preloaded app share their counters
+    and histograms, call it in the gunicorn master before the fork
+'''
+
+
+def share_metrics(app):
+    directory = app.config['METRICS_DIR'] or \
+        tempfile.mkdtemp(prefix='lego-metrics-')
+    app.extensions['metrics'].share(directory)
+
+
+'''
+check_metrics_token()
+    raises AuthError unless the request carries METRICS_TOKEN as a bearer
+    token
+'''
+
+
+def check_metrics_token():
+    expected = current_app.config['METRICS_TOKEN']
+    token = get_token_auth_header()
+    if not expected or not hmac.compare_digest(
+            token.encode(), expected.encode()):
+        raise AuthError({
+            'code': 'invalid_token',
+            'description': 'Metrics token is not valid.'
+        }, 401)
+
+
+def init_metrics(app):
+    app.config.setdefault('METRICS_DIR', None)
+    app.config.setdefault('METRICS_TOKEN', None)
+
+    metrics = Metrics()
+    metrics.counter('http_requests_total',
+                    'Requests answered, by endpoint, method and status.')
+    metrics.histogram('http_request_duration_seconds',
+                      'Time to answer a request, by endpoint and method.')
+    app.extensions['metrics'] = metrics
+
+    @app.before_request
+    def start_timer():
+        g.request_started = perf_counter()
+
+    @app.after_request
+    def count_request(response):
+        metrics.inc('http_requests_total', endpoint=request.endpoint,
+                    method=request.method, status=response.status_code)
+        started = g.pop('request_started', None)
+        if started is not None:
+            metrics.observe('http_request_duration_seconds',
+                            perf_counter() - started,
+                            endpoint=request.endpoint, method=request.method)
+        return response
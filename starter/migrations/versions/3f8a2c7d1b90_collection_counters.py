@@ -0,0 +1,155 @@
+"""collection counters
+
+Revision ID: 3f8a2c7d1b90
+Revises: 6c1f0a9d2e4b
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f8a2c7d1b90'
+down_revision = '6c1f0a9d2e4b'
+branch_labels = None
+depends_on = None
+
+# a copy of counters.py at this revision, later revisions change the
+# triggers with their own copy
+COUNTER_TRIGGERS = '''
+CREATE OR REPLACE FUNCTION count_collection_changes() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE sets s
+        SET collector_count = s.collector_count + n.links
+        FROM (SELECT set_id, count(*) AS links
+              FROM new_links GROUP BY set_id) n
+        WHERE s.id = n.set_id;
+
+        UPDATE collectors c
+        SET set_count = c.set_count + n.links,
+            total_pieces = c.total_pieces + n.pieces
+        FROM (SELECT l.collector_id, count(*) AS links,
+                     sum(s.pieces) AS pieces
+              FROM new_links l JOIN sets s ON s.id = l.set_id
+              GROUP BY l.collector_id) n
+        WHERE c.id = n.collector_id;
+    END IF;
+
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE sets s
+        SET collector_count = s.collector_count - o.links
+        FROM (SELECT set_id, count(*) AS links
+              FROM old_links GROUP BY set_id) o
+        WHERE s.id = o.set_id;
+
+        UPDATE collectors c
+        SET set_count = c.set_count - o.links,
+            total_pieces = c.total_pieces - o.pieces
+        FROM (SELECT l.collector_id, count(*) AS links,
+                     sum(s.pieces) AS pieces
+              FROM old_links l JOIN sets s ON s.id = l.set_id
+              GROUP BY l.collector_id) o
+        WHERE c.id = o.collector_id;
+    END IF;
+
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER collection_counters_insert
+AFTER INSERT ON collection
+REFERENCING NEW TABLE AS new_links
+FOR EACH STATEMENT EXECUTE FUNCTION count_collection_changes();
+
+CREATE TRIGGER collection_counters_delete
+AFTER DELETE ON collection
+REFERENCING OLD TABLE AS old_links
+FOR EACH STATEMENT EXECUTE FUNCTION count_collection_changes();
+
+CREATE TRIGGER collection_counters_update
+AFTER UPDATE ON collection
+REFERENCING OLD TABLE AS old_links NEW TABLE AS new_links
+FOR EACH STATEMENT EXECUTE FUNCTION count_collection_changes();
+
+CREATE OR REPLACE FUNCTION count_set_pieces_changes() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    -- the counter updates above run nested and never change pieces
+    IF pg_trigger_depth() > 1 THEN
+        RETURN NULL;
+    END IF;
+
+    UPDATE collectors c
+    SET total_pieces = c.total_pieces + d.pieces
+    FROM (SELECT l.collector_id, sum(n.pieces - o.pieces) AS pieces
+          FROM new_sets n
+          JOIN old_sets o ON o.id = n.id
+          JOIN collection l ON l.set_id = n.id
+          WHERE n.pieces <> o.pieces
+          GROUP BY l.collector_id) d
+    WHERE c.id = d.collector_id;
+
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER sets_pieces_counters
+AFTER UPDATE ON sets
+REFERENCING OLD TABLE AS old_sets NEW TABLE AS new_sets
+FOR EACH STATEMENT EXECUTE FUNCTION count_set_pieces_changes();
+'''
+
+BACKFILL_COUNTERS = '''
+UPDATE sets s
+SET collector_count = n.links
+FROM (SELECT set_id, count(*) AS links
+      FROM collection GROUP BY set_id) n
+WHERE s.id = n.set_id;
+
+UPDATE collectors c
+SET set_count = n.links,
+    total_pieces = n.pieces
+FROM (SELECT l.collector_id, count(*) AS links, sum(s.pieces) AS pieces
+      FROM collection l JOIN sets s ON s.id = l.set_id
+      GROUP BY l.collector_id) n
+WHERE c.id = n.collector_id;
+'''
+
+
+def upgrade():
+    op.add_column('sets', sa.Column(
+        'collector_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('collectors', sa.Column(
+        'set_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('collectors', sa.Column(
+        'total_pieces', sa.BigInteger(), server_default='0',
+        nullable=False))
+
+    op.execute(BACKFILL_COUNTERS)
+    op.execute(COUNTER_TRIGGERS)
+
+    op.create_index(
+        'ix_sets_popularity', 'sets', ['collector_count', 'id'])
+    op.create_index(
+        'ix_collectors_popularity', 'collectors', ['set_count', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_collectors_popularity', table_name='collectors')
+    op.drop_index('ix_sets_popularity', table_name='sets')
+
+    op.execute('''
+DROP TRIGGER sets_pieces_counters ON sets;
+DROP TRIGGER collection_counters_update ON collection;
+DROP TRIGGER collection_counters_delete ON collection;
+DROP TRIGGER collection_counters_insert ON collection;
+DROP FUNCTION count_set_pieces_changes();
+DROP FUNCTION count_collection_changes();
+''')
+
+    op.drop_column('collectors', 'total_pieces')
+    op.drop_column('collectors', 'set_count')
+    op.drop_column('sets', 'collector_count')
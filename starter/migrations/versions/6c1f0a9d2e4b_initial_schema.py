@@ -0,0 +1,48 @@
+"""initial schema
+
+Revision ID: 6c1f0a9d2e4b
+Revises:
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6c1f0a9d2e4b'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'sets',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('year', sa.String(), nullable=False),
+        sa.Column('pieces', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table(
+        'collectors',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('location', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table(
+        'collection',
+        sa.Column('collector_id', sa.Integer(), nullable=False),
+        sa.Column('set_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['collector_id'], ['collectors.id'], ),
+        sa.ForeignKeyConstraint(['set_id'], ['sets.id'], ),
+        sa.PrimaryKeyConstraint('collector_id', 'set_id')
+    )
+
+
+def downgrade():
+    op.drop_table('collection')
+    op.drop_table('collectors')
+    op.drop_table('sets')
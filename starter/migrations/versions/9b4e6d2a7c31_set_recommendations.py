@@ -0,0 +1,84 @@
+"""set recommendations
+
+Revision ID: 9b4e6d2a7c31
+Revises: 3f8a2c7d1b90
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '9b4e6d2a7c31'
+down_revision = '3f8a2c7d1b90'
+branch_labels = None
+depends_on = None
+
+# a copy of recommendations.py at this revision
+QUEUE_TRIGGERS = '''
+CREATE OR REPLACE FUNCTION queue_recommendations() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO recommendation_queue (set_id)
+        SELECT DISTINCT set_id FROM new_links
+        ON CONFLICT DO NOTHING;
+    END IF;
+
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        INSERT INTO recommendation_queue (set_id)
+        SELECT DISTINCT set_id FROM old_links
+        ON CONFLICT DO NOTHING;
+    END IF;
+
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER collection_recommendations_insert
+AFTER INSERT ON collection
+REFERENCING NEW TABLE AS new_links
+FOR EACH STATEMENT EXECUTE FUNCTION queue_recommendations();
+
+CREATE TRIGGER collection_recommendations_delete
+AFTER DELETE ON collection
+REFERENCING OLD TABLE AS old_links
+FOR EACH STATEMENT EXECUTE FUNCTION queue_recommendations();
+
+CREATE TRIGGER collection_recommendations_update
+AFTER UPDATE ON collection
+REFERENCING OLD TABLE AS old_links NEW TABLE AS new_links
+FOR EACH STATEMENT EXECUTE FUNCTION queue_recommendations();
+'''
+
+
+def upgrade():
+    op.create_table(
+        'set_recommendations',
+        sa.Column('set_id', sa.Integer(), nullable=False),
+        sa.Column('related_ids', postgresql.ARRAY(sa.Integer()),
+                  nullable=False),
+        sa.Column('scores', postgresql.ARRAY(sa.REAL()), nullable=False),
+        sa.ForeignKeyConstraint(['set_id'], ['sets.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('set_id')
+    )
+    op.create_table(
+        'recommendation_queue',
+        sa.Column('set_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['set_id'], ['sets.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('set_id')
+    )
+    op.execute(QUEUE_TRIGGERS)
+
+
+def downgrade():
+    op.execute('''
+DROP TRIGGER collection_recommendations_update ON collection;
+DROP TRIGGER collection_recommendations_delete ON collection;
+DROP TRIGGER collection_recommendations_insert ON collection;
+DROP FUNCTION queue_recommendations();
+''')
+    op.drop_table('recommendation_queue')
+    op.drop_table('set_recommendations')
@@ -0,0 +1,72 @@
+"""queue co-owned sets
+
+Revision ID: a3c5e7f9b1d2
+Revises: e5a7c9b1d3f6
+Create Date: 2026-10-21 10:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c5e7f9b1d2'
+down_revision = 'e5a7c9b1d3f6'
+branch_labels = None
+depends_on = None
+
+# a copy of recommendations.py at this revision, the triggers are kept
+QUEUE_FUNCTION = '''
+CREATE OR REPLACE FUNCTION queue_recommendations() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO recommendation_queue (set_id)
+        SELECT set_id FROM new_links
+        UNION
+        SELECT l.set_id FROM collection l
+        WHERE l.collector_id IN (SELECT collector_id FROM new_links)
+        ON CONFLICT DO NOTHING;
+    END IF;
+
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        INSERT INTO recommendation_queue (set_id)
+        SELECT set_id FROM old_links
+        UNION
+        SELECT l.set_id FROM collection l
+        WHERE l.collector_id IN (SELECT collector_id FROM old_links)
+        ON CONFLICT DO NOTHING;
+    END IF;
+
+    RETURN NULL;
+END
+$$;
+'''
+
+PREVIOUS_QUEUE_FUNCTION = '''
+CREATE OR REPLACE FUNCTION queue_recommendations() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO recommendation_queue (set_id)
+        SELECT DISTINCT set_id FROM new_links
+        ON CONFLICT DO NOTHING;
+    END IF;
+
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        INSERT INTO recommendation_queue (set_id)
+        SELECT DISTINCT set_id FROM old_links
+        ON CONFLICT DO NOTHING;
+    END IF;
+
+    RETURN NULL;
+END
+$$;
+'''
+
+
+def upgrade():
+    op.execute(QUEUE_FUNCTION)
+
+
+def downgrade():
+    op.execute(PREVIOUS_QUEUE_FUNCTION)
@@ -0,0 +1,279 @@
+"""partition collection
+
+Revision ID: a7c9e1f3b5d8
+Revises: f4c6a8e0b2d5
+Create Date: 2026-10-19 22:00:00.000000
+
+"""
+import time
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c9e1f3b5d8'
+down_revision = 'f4c6a8e0b2d5'
+branch_labels = None
+depends_on = None
+
+'''
+the links move to the new table while the app keeps writing:
+
+1. collection_moving is created next to collection, with a trigger on
+   collection that mirrors every later write into it
+2. the links are copied in batches of about BATCH_ROWS, one transaction
+   per batch, a batch locks its rows FOR KEY SHARE so a concurrent DELETE
+   waits for it and its mirrored DELETE sees the copied row
+3. the reverse lookup index of the partitions is built concurrently
+4. collection is dropped and collection_moving takes its name and its
+   triggers, in one short transaction that waits at most LOCK_TIMEOUT for
+   its lock and is retried up to SWAP_ATTEMPTS times
+
+collection is locked before anything else in steps 1 and 4: the writers
+lock it before sets and collectors, which the foreign keys lock
+every step is committed on its own, a failed run is started over from
+scratch, whichever layout collection has, and collection is analyzed at
+the end
+the downgrade moves the links back to a plain table the same way
+'''
+
+PARTITIONS = 16
+BATCH_ROWS = 50000
+LOCK_TIMEOUT = '10s'
+SWAP_ATTEMPTS = 10
+
+PLAIN_TABLE = '''
+CREATE TABLE collection_moving (
+    collector_id integer NOT NULL,
+    set_id integer NOT NULL,
+    CONSTRAINT collection_moving_pkey PRIMARY KEY (collector_id, set_id),
+    CONSTRAINT collection_collector_id_fkey FOREIGN KEY (collector_id)
+        REFERENCES collectors (id),
+    CONSTRAINT collection_set_id_fkey FOREIGN KEY (set_id)
+        REFERENCES sets (id)
+)
+'''
+
+PARTITIONED_TABLE = PLAIN_TABLE + ' PARTITION BY HASH (collector_id);\n' + \
+    ''.join('CREATE TABLE collection_p{0} PARTITION OF collection_moving '
+            'FOR VALUES WITH (MODULUS {1}, REMAINDER {0});\n'.format(
+                remainder, PARTITIONS)
+            for remainder in range(PARTITIONS))
+
+MIRROR_TRIGGERS = '''
+CREATE OR REPLACE FUNCTION mirror_collection() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        TRUNCATE collection_moving;
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        DELETE FROM collection_moving m
+        USING old_links o
+        WHERE m.collector_id = o.collector_id AND m.set_id = o.set_id;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO collection_moving (collector_id, set_id)
+        SELECT collector_id, set_id FROM new_links
+        ON CONFLICT DO NOTHING;
+    END IF;
+
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER collection_mirror_insert
+AFTER INSERT ON collection
+REFERENCING NEW TABLE AS new_links
+FOR EACH STATEMENT EXECUTE FUNCTION mirror_collection();
+
+CREATE TRIGGER collection_mirror_delete
+AFTER DELETE ON collection
+REFERENCING OLD TABLE AS old_links
+FOR EACH STATEMENT EXECUTE FUNCTION mirror_collection();
+
+CREATE TRIGGER collection_mirror_update
+AFTER UPDATE ON collection
+REFERENCING OLD TABLE AS old_links NEW TABLE AS new_links
+FOR EACH STATEMENT EXECUTE FUNCTION mirror_collection();
+
+CREATE TRIGGER collection_mirror_truncate
+AFTER TRUNCATE ON collection
+FOR EACH STATEMENT EXECUTE FUNCTION mirror_collection();
+'''
+
+DROP_MOVING = '''
+LOCK TABLE collection IN SHARE ROW EXCLUSIVE MODE;
+DROP TRIGGER IF EXISTS collection_mirror_insert ON collection;
+DROP TRIGGER IF EXISTS collection_mirror_delete ON collection;
+DROP TRIGGER IF EXISTS collection_mirror_update ON collection;
+DROP TRIGGER IF EXISTS collection_mirror_truncate ON collection;
+DROP FUNCTION IF EXISTS mirror_collection();
+DROP TABLE IF EXISTS collection_moving;
+'''
+
+COPY_BOUNDS = '''
+SELECT min(collector_id), max(collector_id) + 1 FROM collection
+'''
+
+NEXT_BOUNDARY = '''
+SELECT collector_id FROM collection
+WHERE collector_id >= :first
+ORDER BY collector_id
+OFFSET :rows LIMIT 1
+'''
+
+COPY_BATCH = '''
+INSERT INTO collection_moving (collector_id, set_id)
+SELECT collector_id, set_id FROM collection
+WHERE collector_id >= :first AND collector_id < :stop
+FOR KEY SHARE
+ON CONFLICT DO NOTHING
+'''
+
+REVERSE_INDEX = 'ix_collection_set_id_collector_id'
+
+# a copy of the collection triggers of counters.py, recommendations.py,
+# collection_index.py and models.py at this revision, their functions are
+# left in place by the swap
+COLLECTION_TRIGGERS = '''
+CREATE TRIGGER collection_counters_insert
+AFTER INSERT ON collection
+REFERENCING NEW TABLE AS new_links
+FOR EACH STATEMENT EXECUTE FUNCTION count_collection_changes();
+
+CREATE TRIGGER collection_counters_delete
+AFTER DELETE ON collection
+REFERENCING OLD TABLE AS old_links
+FOR EACH STATEMENT EXECUTE FUNCTION count_collection_changes();
+
+CREATE TRIGGER collection_counters_update
+AFTER UPDATE ON collection
+REFERENCING OLD TABLE AS old_links NEW TABLE AS new_links
+FOR EACH STATEMENT EXECUTE FUNCTION count_collection_changes();
+
+CREATE TRIGGER collection_recommendations_insert
+AFTER INSERT ON collection
+REFERENCING NEW TABLE AS new_links
+FOR EACH STATEMENT EXECUTE FUNCTION queue_recommendations();
+
+CREATE TRIGGER collection_recommendations_delete
+AFTER DELETE ON collection
+REFERENCING OLD TABLE AS old_links
+FOR EACH STATEMENT EXECUTE FUNCTION queue_recommendations();
+
+CREATE TRIGGER collection_recommendations_update
+AFTER UPDATE ON collection
+REFERENCING OLD TABLE AS old_links NEW TABLE AS new_links
+FOR EACH STATEMENT EXECUTE FUNCTION queue_recommendations();
+
+CREATE TRIGGER collection_changes_insert
+AFTER INSERT ON collection
+REFERENCING NEW TABLE AS new_links
+FOR EACH STATEMENT EXECUTE FUNCTION log_collection_changes();
+
+CREATE TRIGGER collection_changes_delete
+AFTER DELETE ON collection
+REFERENCING OLD TABLE AS old_links
+FOR EACH STATEMENT EXECUTE FUNCTION log_collection_changes();
+
+CREATE TRIGGER collection_changes_update
+AFTER UPDATE ON collection
+REFERENCING OLD TABLE AS old_links NEW TABLE AS new_links
+FOR EACH STATEMENT EXECUTE FUNCTION log_collection_changes();
+
+CREATE TRIGGER collection_catalogue_changes
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON collection
+FOR EACH STATEMENT EXECUTE FUNCTION log_catalogue_changes();
+'''
+
+SWAP = '''
+SET LOCAL lock_timeout = '{}';
+LOCK TABLE collection IN ACCESS EXCLUSIVE MODE;
+DROP TABLE collection;
+DROP FUNCTION mirror_collection();
+ALTER TABLE collection_moving RENAME TO collection;
+ALTER INDEX collection_moving_pkey RENAME TO collection_pkey;
+'''.format(LOCK_TIMEOUT) + COLLECTION_TRIGGERS
+
+
+def copy_links(connection):
+    first, last = connection.execute(COPY_BOUNDS).first()
+
+    while first is not None:
+        stop = connection.execute(
+            sa.text(NEXT_BOUNDARY), first=first, rows=BATCH_ROWS).scalar()
+        connection.execute(
+            sa.text(COPY_BATCH), first=first,
+            stop=last if stop is None else stop)
+        first = stop
+
+
+def build_reverse_index(connection):
+    connection.execute(
+        'CREATE INDEX {} ON ONLY collection_moving '
+        '(set_id, collector_id)'.format(REVERSE_INDEX))
+
+    for remainder in range(PARTITIONS):
+        partition = 'collection_p{}'.format(remainder)
+        index = '{}_set_id_collector_id_idx'.format(partition)
+        connection.execute(
+            'CREATE INDEX CONCURRENTLY {} ON {} (set_id, collector_id)'.format(
+                index, partition))
+        connection.execute('ALTER INDEX {} ATTACH PARTITION {}'.format(
+            REVERSE_INDEX, index))
+
+
+'''
+move_links(table)
+    replaces collection with a copy created by the table DDL, online
+'''
+
+
+def move_links(table, partitioned):
+    op.execute(DROP_MOVING)
+    op.execute(table)
+    op.execute(MIRROR_TRIGGERS)
+
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        copy_links(connection)
+        if partitioned:
+            build_reverse_index(connection)
+        swap(connection)
+        # autovacuum never analyzes a partitioned table itself
+        connection.execute('ANALYZE collection')
+
+
+'''
+swap(connection)
+    runs SWAP in its own transaction, again after a lock timeout or a
+    deadlock with the writers
+'''
+
+
+def swap(connection):
+    for attempt in range(SWAP_ATTEMPTS):
+        connection.execute('BEGIN')
+        try:
+            connection.execute(SWAP)
+        except sa.exc.OperationalError:
+            connection.execute('ROLLBACK')
+            time.sleep(attempt + 1)
+            continue
+        connection.execute('COMMIT')
+        return
+
+    raise RuntimeError(
+        'collection stayed locked, run the migration again later.')
+
+
+def upgrade():
+    move_links(PARTITIONED_TABLE, partitioned=True)
+
+
+def downgrade():
+    move_links(PLAIN_TABLE, partitioned=False)
@@ -0,0 +1,38 @@
+"""audit log
+
+Revision ID: c1e3a5b7d9f2
+Revises: a7c9e1f3b5d8
+Create Date: 2026-10-19 23:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c1e3a5b7d9f2'
+down_revision = 'a7c9e1f3b5d8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'audit_log',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('occurred_at', sa.DateTime(timezone=True),
+                  nullable=False),
+        sa.Column('subject', sa.String(), nullable=False),
+        sa.Column('action', sa.String(), nullable=False),
+        sa.Column('resource', sa.String(), nullable=False),
+        sa.Column('resource_id', sa.Integer(), nullable=False),
+        sa.Column('changes', sa.JSON(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_audit_log_resource', 'audit_log',
+                    ['resource', 'resource_id'])
+
+
+def downgrade():
+    op.drop_index('ix_audit_log_resource', table_name='audit_log')
+    op.drop_table('audit_log')
@@ -0,0 +1,77 @@
+"""collection changes
+
+Revision ID: c5d1e8f2a470
+Revises: 9b4e6d2a7c31
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5d1e8f2a470'
+down_revision = '9b4e6d2a7c31'
+branch_labels = None
+depends_on = None
+
+# a copy of collection_index.py at this revision
+CHANGE_TRIGGERS = '''
+CREATE OR REPLACE FUNCTION log_collection_changes() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO collection_changes (collector_id)
+        SELECT DISTINCT collector_id FROM new_links;
+    END IF;
+
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        INSERT INTO collection_changes (collector_id)
+        SELECT DISTINCT collector_id FROM old_links;
+    END IF;
+
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER collection_changes_insert
+AFTER INSERT ON collection
+REFERENCING NEW TABLE AS new_links
+FOR EACH STATEMENT EXECUTE FUNCTION log_collection_changes();
+
+CREATE TRIGGER collection_changes_delete
+AFTER DELETE ON collection
+REFERENCING OLD TABLE AS old_links
+FOR EACH STATEMENT EXECUTE FUNCTION log_collection_changes();
+
+CREATE TRIGGER collection_changes_update
+AFTER UPDATE ON collection
+REFERENCING OLD TABLE AS old_links NEW TABLE AS new_links
+FOR EACH STATEMENT EXECUTE FUNCTION log_collection_changes();
+'''
+
+
+def upgrade():
+    op.create_table(
+        'collection_changes',
+        sa.Column('collector_id', sa.Integer(), nullable=False),
+        sa.Column('xid', sa.BigInteger(), nullable=False,
+                  server_default=sa.text(
+                      'pg_current_xact_id()::text::bigint')),
+        sa.Column('changed_at', sa.DateTime(timezone=True), nullable=False,
+                  server_default=sa.text('now()'))
+    )
+    op.create_index(
+        'ix_collection_changes_xid', 'collection_changes', ['xid'])
+    op.execute(CHANGE_TRIGGERS)
+
+
+def downgrade():
+    op.execute('''
+DROP TRIGGER collection_changes_update ON collection;
+DROP TRIGGER collection_changes_delete ON collection;
+DROP TRIGGER collection_changes_insert ON collection;
+DROP FUNCTION log_collection_changes();
+''')
+    op.drop_index('ix_collection_changes_xid', table_name='collection_changes')
+    op.drop_table('collection_changes')
@@ -0,0 +1,205 @@
+"""payloads
+
+Revision ID: d3f5b7c9e1a4
+Revises: c1e3a5b7d9f2
+Create Date: 2026-10-19 23:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3f5b7c9e1a4'
+down_revision = 'c1e3a5b7d9f2'
+branch_labels = None
+depends_on = None
+
+'''
+the tables and triggers are created first, so every later write to a set
+or collector writes its payload, then the payloads of the existing rows
+are written in batches of BATCH_IDS ids, one transaction per batch, while
+the app keeps writing
+a batch leaves the payloads written by the triggers in place, they were
+computed from newer rows than the batch read
+'''
+
+BATCH_IDS = 10000
+
+# a copy of payloads.py at this revision
+PAYLOAD_TRIGGERS = '''
+CREATE OR REPLACE FUNCTION write_set_payloads(set_ids integer[])
+RETURNS void LANGUAGE sql AS $$
+    INSERT INTO set_payloads (set_id, payload)
+    SELECT s.id, json_build_object(
+        'collectors', coalesce(
+            (SELECT json_agg(c.name ORDER BY c.id)
+             FROM collection l JOIN collectors c ON c.id = l.collector_id
+             WHERE l.set_id = s.id),
+            '[]'),
+        'name', s.name,
+        'number of collectors', s.collector_count,
+        'number of pieces', s.pieces,
+        'release year', s.year,
+        'set number', s.id)
+    FROM sets s
+    WHERE s.id = ANY(set_ids)
+    ON CONFLICT (set_id) DO UPDATE SET payload = EXCLUDED.payload;
+$$;
+
+CREATE OR REPLACE FUNCTION write_collector_payloads(collector_ids integer[])
+RETURNS void LANGUAGE sql AS $$
+    INSERT INTO collector_payloads (collector_id, payload)
+    SELECT c.id, json_build_object(
+        'id', c.id,
+        'location', c.location,
+        'name', c.name,
+        'number of sets', c.set_count,
+        'sets collected', coalesce(
+            (SELECT json_agg(l.set_id ORDER BY l.set_id)
+             FROM collection l
+             WHERE l.collector_id = c.id),
+            '[]'),
+        'total pieces', c.total_pieces)
+    FROM collectors c
+    WHERE c.id = ANY(collector_ids)
+    ON CONFLICT (collector_id) DO UPDATE SET payload = EXCLUDED.payload;
+$$;
+
+CREATE OR REPLACE FUNCTION refresh_payloads() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF current_setting('lego.payloads', true) = 'off' THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_TABLE_NAME = 'sets' THEN
+        PERFORM write_set_payloads(ARRAY(SELECT id FROM new_rows));
+        RETURN NULL;
+    END IF;
+
+    PERFORM write_collector_payloads(ARRAY(SELECT id FROM new_rows));
+
+    IF TG_OP = 'UPDATE' THEN
+        -- the payload of a set lists the names of its collectors
+        PERFORM write_set_payloads(ARRAY(
+            SELECT DISTINCT l.set_id
+            FROM new_rows n
+            JOIN old_rows o ON o.id = n.id
+            JOIN collection l ON l.collector_id = n.id
+            WHERE n.name <> o.name));
+    END IF;
+
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER sets_payloads_insert
+AFTER INSERT ON sets
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION refresh_payloads();
+
+CREATE TRIGGER sets_payloads_update
+AFTER UPDATE ON sets
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION refresh_payloads();
+
+CREATE TRIGGER collectors_payloads_insert
+AFTER INSERT ON collectors
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION refresh_payloads();
+
+CREATE TRIGGER collectors_payloads_update
+AFTER UPDATE ON collectors
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION refresh_payloads();
+'''
+
+# the SELECT of write_set_payloads() and write_collector_payloads() above
+WRITE_BATCH = {
+    'sets': '''
+INSERT INTO set_payloads (set_id, payload)
+SELECT s.id, json_build_object(
+    'collectors', coalesce(
+        (SELECT json_agg(c.name ORDER BY c.id)
+         FROM collection l JOIN collectors c ON c.id = l.collector_id
+         WHERE l.set_id = s.id),
+        '[]'),
+    'name', s.name,
+    'number of collectors', s.collector_count,
+    'number of pieces', s.pieces,
+    'release year', s.year,
+    'set number', s.id)
+FROM sets s
+WHERE s.id >= :first AND s.id < :stop
+ON CONFLICT DO NOTHING
+''',
+    'collectors': '''
+INSERT INTO collector_payloads (collector_id, payload)
+SELECT c.id, json_build_object(
+    'id', c.id,
+    'location', c.location,
+    'name', c.name,
+    'number of sets', c.set_count,
+    'sets collected', coalesce(
+        (SELECT json_agg(l.set_id ORDER BY l.set_id)
+         FROM collection l
+         WHERE l.collector_id = c.id),
+        '[]'),
+    'total pieces', c.total_pieces)
+FROM collectors c
+WHERE c.id >= :first AND c.id < :stop
+ON CONFLICT DO NOTHING
+'''
+    }
+
+DROP_TRIGGERS = '''
+DROP TRIGGER sets_payloads_insert ON sets;
+DROP TRIGGER sets_payloads_update ON sets;
+DROP TRIGGER collectors_payloads_insert ON collectors;
+DROP TRIGGER collectors_payloads_update ON collectors;
+DROP FUNCTION refresh_payloads();
+DROP FUNCTION write_set_payloads(integer[]);
+DROP FUNCTION write_collector_payloads(integer[]);
+'''
+
+
+def write_payloads(connection, table):
+    first, last = connection.execute(
+        'SELECT min(id), max(id) FROM {}'.format(table)).first()
+    if first is None:
+        return
+
+    for start in range(first, last + 1, BATCH_IDS):
+        connection.execute(
+            sa.text(WRITE_BATCH[table]), first=start, stop=start + BATCH_IDS)
+
+
+def upgrade():
+    op.create_table(
+        'set_payloads',
+        sa.Column('set_id', sa.Integer(), nullable=False),
+        sa.Column('payload', sa.JSON(), nullable=False),
+        sa.ForeignKeyConstraint(['set_id'], ['sets.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('set_id')
+    )
+    op.create_table(
+        'collector_payloads',
+        sa.Column('collector_id', sa.Integer(), nullable=False),
+        sa.Column('payload', sa.JSON(), nullable=False),
+        sa.ForeignKeyConstraint(['collector_id'], ['collectors.id'],
+                                ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('collector_id')
+    )
+    op.execute(PAYLOAD_TRIGGERS)
+
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        write_payloads(connection, 'sets')
+        write_payloads(connection, 'collectors')
+
+
+def downgrade():
+    op.execute(DROP_TRIGGERS)
+    op.drop_table('collector_payloads')
+    op.drop_table('set_payloads')
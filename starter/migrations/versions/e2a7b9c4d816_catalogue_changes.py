@@ -0,0 +1,63 @@
+"""catalogue changes
+
+Revision ID: e2a7b9c4d816
+Revises: c5d1e8f2a470
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a7b9c4d816'
+down_revision = 'c5d1e8f2a470'
+branch_labels = None
+depends_on = None
+
+# a copy of models.py at this revision
+CATALOGUE_CHANGE_TRIGGERS = '''
+CREATE OR REPLACE FUNCTION log_catalogue_changes() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO catalogue_changes DEFAULT VALUES ON CONFLICT DO NOTHING;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER sets_catalogue_changes
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON sets
+FOR EACH STATEMENT EXECUTE FUNCTION log_catalogue_changes();
+
+CREATE TRIGGER collectors_catalogue_changes
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON collectors
+FOR EACH STATEMENT EXECUTE FUNCTION log_catalogue_changes();
+
+CREATE TRIGGER collection_catalogue_changes
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON collection
+FOR EACH STATEMENT EXECUTE FUNCTION log_catalogue_changes();
+'''
+
+
+def upgrade():
+    op.create_table(
+        'catalogue_changes',
+        sa.Column('xid', sa.BigInteger(), autoincrement=False,
+                  nullable=False,
+                  server_default=sa.text(
+                      'pg_current_xact_id()::text::bigint')),
+        sa.Column('changed_at', sa.DateTime(timezone=True), nullable=False,
+                  server_default=sa.text('now()')),
+        sa.PrimaryKeyConstraint('xid')
+    )
+    op.execute(CATALOGUE_CHANGE_TRIGGERS)
+
+
+def downgrade():
+    op.execute('''
+DROP TRIGGER collection_catalogue_changes ON collection;
+DROP TRIGGER collectors_catalogue_changes ON collectors;
+DROP TRIGGER sets_catalogue_changes ON sets;
+DROP FUNCTION log_catalogue_changes();
+''')
+    op.drop_table('catalogue_changes')
@@ -0,0 +1,45 @@
+"""job file chunks
+
+Revision ID: e5a7c9b1d3f6
+Revises: d3f5b7c9e1a4
+Create Date: 2026-10-20 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a7c9b1d3f6'
+down_revision = 'd3f5b7c9e1a4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'job_file_chunks',
+        sa.Column('job_id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('seq', sa.Integer(), nullable=False),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.ForeignKeyConstraint(['job_id', 'name'],
+                                ['job_files.job_id', 'job_files.name'],
+                                ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('job_id', 'name', 'seq')
+    )
+    # the files written so far become a single chunk
+    op.execute('INSERT INTO job_file_chunks (job_id, name, seq, data) '
+               'SELECT job_id, name, 0, data FROM job_files')
+    op.drop_column('job_files', 'data')
+
+
+def downgrade():
+    op.add_column('job_files', sa.Column('data', sa.LargeBinary()))
+    op.execute("UPDATE job_files f SET data = coalesce("
+               "(SELECT string_agg(c.data, ''::bytea ORDER BY c.seq) "
+               "FROM job_file_chunks c "
+               "WHERE c.job_id = f.job_id AND c.name = f.name), "
+               "''::bytea)")
+    op.alter_column('job_files', 'data', nullable=False)
+    op.drop_table('job_file_chunks')
@@ -0,0 +1,122 @@
+"""search changes
+
+Revision ID: f4c6a8e0b2d5
+Revises: b8d2f4a6c913
+Create Date: 2026-10-19 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4c6a8e0b2d5'
+down_revision = 'b8d2f4a6c913'
+branch_labels = None
+depends_on = None
+
+# a copy of search.py at this revision
+SEARCH_CHANGE_TRIGGERS = '''
+CREATE OR REPLACE FUNCTION log_search_changes() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    -- the counter triggers update sets and collectors but never a name
+    IF pg_trigger_depth() > 1 THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO search_changes (kind, id)
+        SELECT TG_TABLE_NAME, id FROM new_rows;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO search_changes (kind, id)
+        SELECT TG_TABLE_NAME, id FROM old_rows;
+    ELSE
+        INSERT INTO search_changes (kind, id)
+        SELECT TG_TABLE_NAME, coalesce(n.id, o.id)
+        FROM new_rows n
+        FULL JOIN old_rows o ON o.id = n.id
+        WHERE n.name IS DISTINCT FROM o.name;
+    END IF;
+
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER sets_search_insert
+AFTER INSERT ON sets
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes();
+
+CREATE TRIGGER sets_search_delete
+AFTER DELETE ON sets
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes();
+
+CREATE TRIGGER sets_search_update
+AFTER UPDATE ON sets
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes();
+
+CREATE TRIGGER collectors_search_insert
+AFTER INSERT ON collectors
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes();
+
+CREATE TRIGGER collectors_search_delete
+AFTER DELETE ON collectors
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes();
+
+CREATE TRIGGER collectors_search_update
+AFTER UPDATE ON collectors
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes();
+'''
+
+TRIGRAM_INDEXES = '''
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions
+               WHERE name = 'pg_trgm') THEN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE INDEX IF NOT EXISTS ix_sets_name_trgm
+        ON sets USING gin (name gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS ix_collectors_name_trgm
+        ON collectors USING gin (name gin_trgm_ops);
+    END IF;
+END
+$$;
+'''
+
+
+def upgrade():
+    op.create_table(
+        'search_changes',
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('xid', sa.BigInteger(), nullable=False,
+                  server_default=sa.text(
+                      'pg_current_xact_id()::text::bigint')),
+        sa.Column('changed_at', sa.DateTime(timezone=True), nullable=False,
+                  server_default=sa.text('now()'))
+    )
+    op.create_index('ix_search_changes_xid', 'search_changes', ['xid'])
+    op.execute(SEARCH_CHANGE_TRIGGERS)
+    op.execute(TRIGRAM_INDEXES)
+
+
+def downgrade():
+    op.execute('''
+DROP INDEX IF EXISTS ix_collectors_name_trgm;
+DROP INDEX IF EXISTS ix_sets_name_trgm;
+DROP TRIGGER collectors_search_update ON collectors;
+DROP TRIGGER collectors_search_delete ON collectors;
+DROP TRIGGER collectors_search_insert ON collectors;
+DROP TRIGGER sets_search_update ON sets;
+DROP TRIGGER sets_search_delete ON sets;
+DROP TRIGGER sets_search_insert ON sets;
+DROP FUNCTION log_search_changes();
+''')
+    op.drop_index('ix_search_changes_xid', table_name='search_changes')
+    op.drop_table('search_changes')
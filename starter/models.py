@@ -1,24 +1,58 @@
-import os
-from sqlalchemy import Column, String, Integer, ForeignKey, create_engine
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DDL,
+    DateTime,
+    ForeignKey,
+    ForeignKeyConstraint,
+    Index,
+    Integer,
+    JSON,
+    LargeBinary,
+    REAL,
+    String,
+    Text,
+    create_engine,
+    event,
+    text
+    )
+from sqlalchemy.dialects.postgresql import ARRAY
 from flask_sqlalchemy import SQLAlchemy
+from counters import COUNTER_TRIGGERS
+from recommendations import QUEUE_TRIGGERS
+from collection_index import CHANGE_TRIGGERS
+from payloads import PAYLOAD_FUNCTIONS
+from search import SEARCH_CHANGE_TRIGGERS, TRIGRAM_INDEXES
 import json
 
-database_path = os.environ['DATABASE_URL']
-
 db = SQLAlchemy()
 
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    the schema is managed by the migrations, run `python manage.py db
+    upgrade` to create or update it
 '''
 
 
-def setup_db(app, database_path=database_path):
-    app.config["SQLALCHEMY_DATABASE_URI"] = database_path
+def setup_db(app, database_path=None):
+    if database_path is not None:
+        app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     db.app = app
     db.init_app(app)
-    db.create_all()
+
+
+'''
+dispose_engine(app)
+    drops the pooled connections inherited from the parent process
+    call it in every worker forked from a preloaded app
+'''
+
+
+def dispose_engine(app):
+    with app.app_context():
+        db.get_engine(app).dispose()
 
 
 '''
@@ -35,13 +69,188 @@ def db_drop_and_create_all():
 
 '''
 Lego Collections
-
+    hash partitioned on collector_id into COLLECTION_PARTITIONS tables, so
+    the links of a collector live in a single partition and the indexes
+    and vacuum of every partition stay small
+    the collectors of a set are read through the (set_id, collector_id)
+    index of every partition
 '''
+COLLECTION_PARTITIONS = 16
+
 collection = db.Table(
     'collection',
     Column('collector_id', Integer, ForeignKey(
         'collectors.id'), primary_key=True),
-    Column('set_id', Integer, ForeignKey('sets.id'), primary_key=True)
+    Column('set_id', Integer, ForeignKey('sets.id'), primary_key=True),
+    Index('ix_collection_set_id_collector_id', 'set_id', 'collector_id'),
+    postgresql_partition_by='HASH (collector_id)'
+    )
+
+COLLECTION_PARTITION_TABLES = ''.join(
+    'CREATE TABLE collection_p{0} PARTITION OF collection '
+    'FOR VALUES WITH (MODULUS {1}, REMAINDER {0});\n'.format(
+        remainder, COLLECTION_PARTITIONS)
+    for remainder in range(COLLECTION_PARTITIONS))
+
+# the partitions and counter triggers of the migrations, for schemas built
+# by create_all
+for ddl in (COLLECTION_PARTITION_TABLES, COUNTER_TRIGGERS):
+    event.listen(
+        collection, 'after_create',
+        DDL(ddl).execute_if(dialect='postgresql'))
+
+'''
+Recommendations
+    the top related sets of every set and the sets whose owners changed
+    since they were computed, see recommendations.py
+'''
+set_recommendations = db.Table(
+    'set_recommendations',
+    Column('set_id', Integer, ForeignKey(
+        'sets.id', ondelete='CASCADE'), primary_key=True),
+    Column('related_ids', ARRAY(Integer), nullable=False),
+    Column('scores', ARRAY(REAL), nullable=False)
+    )
+
+recommendation_queue = db.Table(
+    'recommendation_queue',
+    Column('set_id', Integer, ForeignKey(
+        'sets.id', ondelete='CASCADE'), primary_key=True)
+    )
+
+'''
+Collection Changes
+    the collectors whose links changed, by writing transaction, read by
+    the collection index of every worker, see collection_index.py
+'''
+collection_changes = db.Table(
+    'collection_changes',
+    Column('collector_id', Integer, nullable=False),
+    Column('xid', BigInteger, nullable=False, index=True,
+           server_default=text('pg_current_xact_id()::text::bigint')),
+    Column('changed_at', DateTime(timezone=True), nullable=False,
+           server_default=text('now()'))
+    )
+
+'''
+Catalogue Changes
+    the transactions that wrote to sets, collectors or collection, read by
+    the catalogue snapshot of every worker, see snapshot.py
+'''
+catalogue_changes = db.Table(
+    'catalogue_changes',
+    Column('xid', BigInteger, primary_key=True, autoincrement=False,
+           server_default=text('pg_current_xact_id()::text::bigint')),
+    Column('changed_at', DateTime(timezone=True), nullable=False,
+           server_default=text('now()'))
+    )
+
+CATALOGUE_CHANGE_TRIGGERS = '''
+CREATE OR REPLACE FUNCTION log_catalogue_changes() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO catalogue_changes DEFAULT VALUES ON CONFLICT DO NOTHING;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER sets_catalogue_changes
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON sets
+FOR EACH STATEMENT EXECUTE FUNCTION log_catalogue_changes();
+
+CREATE TRIGGER collectors_catalogue_changes
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON collectors
+FOR EACH STATEMENT EXECUTE FUNCTION log_catalogue_changes();
+
+CREATE TRIGGER collection_catalogue_changes
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON collection
+FOR EACH STATEMENT EXECUTE FUNCTION log_catalogue_changes();
+'''
+
+'''
+Search Changes
+    the sets and collectors whose name changed, by writing transaction,
+    read by the search index of every worker, see search.py
+'''
+search_changes = db.Table(
+    'search_changes',
+    Column('kind', String, nullable=False),
+    Column('id', Integer, nullable=False),
+    Column('xid', BigInteger, nullable=False, index=True,
+           server_default=text('pg_current_xact_id()::text::bigint')),
+    Column('changed_at', DateTime(timezone=True), nullable=False,
+           server_default=text('now()'))
+    )
+
+'''
+Payloads
+    the long() representation of every set and collector as JSON, kept up
+    to date by triggers, see payloads.py
+'''
+set_payloads = db.Table(
+    'set_payloads',
+    Column('set_id', Integer, ForeignKey(
+        'sets.id', ondelete='CASCADE'), primary_key=True),
+    Column('payload', JSON, nullable=False)
+    )
+
+collector_payloads = db.Table(
+    'collector_payloads',
+    Column('collector_id', Integer, ForeignKey(
+        'collectors.id', ondelete='CASCADE'), primary_key=True),
+    Column('payload', JSON, nullable=False)
+    )
+
+# after every table, the triggers refer to several of them
+# the payload triggers are left to sync_payloads(), see payloads.py
+for triggers in (QUEUE_TRIGGERS, CHANGE_TRIGGERS,
+                 CATALOGUE_CHANGE_TRIGGERS, SEARCH_CHANGE_TRIGGERS,
+                 PAYLOAD_FUNCTIONS, TRIGRAM_INDEXES):
+    event.listen(
+        db.metadata, 'after_create',
+        DDL(triggers).execute_if(dialect='postgresql'))
+
+'''
+Job Files
+    the uploaded inputs and the result of every background job, their
+    content is split in job_file_chunks rows, see jobs.py
+'''
+job_files = db.Table(
+    'job_files',
+    Column('job_id', Integer, ForeignKey(
+        'jobs.id', ondelete='CASCADE'), primary_key=True),
+    Column('name', String, primary_key=True),
+    Column('filename', String, nullable=False),
+    Column('mimetype', String, nullable=False)
+    )
+
+job_file_chunks = db.Table(
+    'job_file_chunks',
+    Column('job_id', Integer, primary_key=True),
+    Column('name', String, primary_key=True),
+    Column('seq', Integer, primary_key=True),
+    Column('data', LargeBinary, nullable=False),
+    ForeignKeyConstraint(
+        ['job_id', 'name'], ['job_files.job_id', 'job_files.name'],
+        ondelete='CASCADE')
+    )
+
+'''
+Audit Log
+    who created, updated or deleted which set or collector, written in
+    batches by a background thread of every worker, and who imported the
+    catalogue, see audit.py
+'''
+audit_log = db.Table(
+    'audit_log',
+    Column('id', BigInteger, primary_key=True),
+    Column('occurred_at', DateTime(timezone=True), nullable=False),
+    Column('subject', String, nullable=False),
+    Column('action', String, nullable=False),
+    Column('resource', String, nullable=False),
+    Column('resource_id', Integer, nullable=False),
+    Column('changes', JSON(none_as_null=True)),
+    Index('ix_audit_log_resource', 'resource', 'resource_id')
     )
 
 '''
@@ -76,10 +285,16 @@ Collectors
 
 class Collector(CommonHelperMethods):
     __tablename__ = 'collectors'
+    __table_args__ = (
+        Index('ix_collectors_popularity', 'set_count', 'id'),
+        )
 
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
     location = Column(String, nullable=False)
+    # maintained by the counter triggers, see counters.py
+    set_count = Column(Integer, nullable=False, server_default='0')
+    total_pieces = Column(BigInteger, nullable=False, server_default='0')
     legos = db.relationship(
         'Set', secondary=collection,
         backref=db.backref('collectors', lazy=True))
@@ -92,7 +307,9 @@ class Collector(CommonHelperMethods):
     def short(self):
         return {
             'name': self.name,
-            'location': self.location
+            'location': self.location,
+            'number of sets': self.set_count,
+            'total pieces': self.total_pieces
             }
 
     def long(self):
@@ -100,6 +317,8 @@ class Collector(CommonHelperMethods):
             'id': self.id,
             'name': self.name,
             'location': self.location,
+            'number of sets': self.set_count,
+            'total pieces': self.total_pieces,
             'sets collected': [lego.id for lego in self.legos]
             }
 
@@ -112,11 +331,16 @@ Lego Sets
 
 class Set(CommonHelperMethods):
     __tablename__ = 'sets'
+    __table_args__ = (
+        Index('ix_sets_popularity', 'collector_count', 'id'),
+        )
 
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
     year = Column(String, nullable=False)
     pieces = Column(Integer, nullable=False)
+    # maintained by the counter triggers, see counters.py
+    collector_count = Column(Integer, nullable=False, server_default='0')
 
     def __init__(self, id, name, year, pieces):
         self.id = id
@@ -129,7 +353,8 @@ class Set(CommonHelperMethods):
             'set number': self.id,
             'name': self.name,
             'release year': self.year,
-            'number of pieces': self.pieces
+            'number of pieces': self.pieces,
+            'number of collectors': self.collector_count
             }
 
     def long(self):
@@ -138,5 +363,56 @@ class Set(CommonHelperMethods):
             'name': self.name,
             'release year': self.year,
             'number of pieces': self.pieces,
+            'number of collectors': self.collector_count,
             'collectors': [collector.name for collector in self.collectors]
         }
+
+
+'''
+Background Jobs
+
+'''
+
+
+class Job(CommonHelperMethods):
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        Index('ix_jobs_status', 'status', 'id'),
+        )
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)
+    owner = Column(String, nullable=False)
+    params = Column(JSON, nullable=False)
+    status = Column(String, nullable=False, server_default='queued')
+    progress = Column(BigInteger, nullable=False, server_default='0')
+    attempts = Column(Integer, nullable=False, server_default='0')
+    result = Column(JSON)
+    error = Column(Text)
+    created_at = Column(DateTime(timezone=True), nullable=False,
+                        server_default=text('now()'))
+    started_at = Column(DateTime(timezone=True))
+    heartbeat_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+
+    def __init__(self, kind, owner, params):
+        self.kind = kind
+        self.owner = owner
+        self.params = params
+
+    def format(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': self.progress,
+            'result': self.result,
+            'error': self.error,
+            'created': timestamp(self.created_at),
+            'started': timestamp(self.started_at),
+            'finished': timestamp(self.finished_at)
+            }
+
+
+def timestamp(value):
+    return value.isoformat() if value is not None else None
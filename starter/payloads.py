@@ -0,0 +1,282 @@
+from time import monotonic
+from flask import Response, current_app
+from sqlalchemy import text
+
+'''
+Materialized Payloads
+    the long() representation of every set and collector serialized to
+    JSON in set_payloads and collector_payloads, so GET '/sets-detail' and
+    '/collectors-detail' read one table and join the fragments in the
+    database instead of loading the rows, their collections and the names
+    of their owners through the ORM
+    the keys are sorted, as in the responses of jsonify()
+
+    triggers on sets and collectors rewrite the payload of every changed
+    row in the same transaction, once per statement, a change to the
+    collection reaches them through the counters it updates (see
+    counters.py) and a renamed collector rewrites the sets it owns
+
+    a transaction that sets lego.payloads to 'off' (DISABLE_PAYLOADS)
+    writes no payloads, for bulk loads of many statements, and rebuilds
+    them all at the end (REBUILD_PAYLOADS)
+
+    writes pay for the payloads: linking a set rewrites the payload of the
+    set and of its collector, renaming a collector the payloads of all its
+    sets and changing the pieces of a set the payloads of all its
+    collectors, each with its full list of sets
+    the triggers follow MATERIALIZED_PAYLOADS through sync_payloads()
+    (manage.py sync_payloads, run on release), turning it off drops them
+    and empties the payload tables, so writes pay nothing, turning it on
+    creates them and rebuilds every payload
+    the listings are served from the payloads only while the flag is on and
+    the triggers are installed, every worker looks the triggers up at most
+    once per PAYLOADS_CHECK_INTERVAL, so a release that turns them on or
+    off reaches the listings within that delay
+
+    MATERIALIZED_PAYLOADS     maintains the payloads and serves the detail
+                              listings from them (True)
+    PAYLOADS_CHECK_INTERVAL   seconds between two lookups of the triggers
+                              (10)
+'''
+
+PAYLOAD_FUNCTIONS = '''
+CREATE OR REPLACE FUNCTION write_set_payloads(set_ids integer[])
+RETURNS void LANGUAGE sql AS $$
+    INSERT INTO set_payloads (set_id, payload)
+    SELECT s.id, json_build_object(
+        'collectors', coalesce(
+            (SELECT json_agg(c.name ORDER BY c.id)
+             FROM collection l JOIN collectors c ON c.id = l.collector_id
+             WHERE l.set_id = s.id),
+            '[]'),
+        'name', s.name,
+        'number of collectors', s.collector_count,
+        'number of pieces', s.pieces,
+        'release year', s.year,
+        'set number', s.id)
+    FROM sets s
+    WHERE s.id = ANY(set_ids)
+    ON CONFLICT (set_id) DO UPDATE SET payload = EXCLUDED.payload;
+$$;
+
+CREATE OR REPLACE FUNCTION write_collector_payloads(collector_ids integer[])
+RETURNS void LANGUAGE sql AS $$
+    INSERT INTO collector_payloads (collector_id, payload)
+    SELECT c.id, json_build_object(
+        'id', c.id,
+        'location', c.location,
+        'name', c.name,
+        'number of sets', c.set_count,
+        'sets collected', coalesce(
+            (SELECT json_agg(l.set_id ORDER BY l.set_id)
+             FROM collection l
+             WHERE l.collector_id = c.id),
+            '[]'),
+        'total pieces', c.total_pieces)
+    FROM collectors c
+    WHERE c.id = ANY(collector_ids)
+    ON CONFLICT (collector_id) DO UPDATE SET payload = EXCLUDED.payload;
+$$;
+
+CREATE OR REPLACE FUNCTION refresh_payloads() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF current_setting('lego.payloads', true) = 'off' THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_TABLE_NAME = 'sets' THEN
+        PERFORM write_set_payloads(ARRAY(SELECT id FROM new_rows));
+        RETURN NULL;
+    END IF;
+
+    PERFORM write_collector_payloads(ARRAY(SELECT id FROM new_rows));
+
+    IF TG_OP = 'UPDATE' THEN
+        -- the payload of a set lists the names of its collectors
+        PERFORM write_set_payloads(ARRAY(
+            SELECT DISTINCT l.set_id
+            FROM new_rows n
+            JOIN old_rows o ON o.id = n.id
+            JOIN collection l ON l.collector_id = n.id
+            WHERE n.name <> o.name));
+    END IF;
+
+    RETURN NULL;
+END
+$$;
+'''
+
+CREATE_PAYLOAD_TRIGGERS = '''
+CREATE TRIGGER sets_payloads_insert
+AFTER INSERT ON sets
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION refresh_payloads();
+
+CREATE TRIGGER sets_payloads_update
+AFTER UPDATE ON sets
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION refresh_payloads();
+
+CREATE TRIGGER collectors_payloads_insert
+AFTER INSERT ON collectors
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION refresh_payloads();
+
+CREATE TRIGGER collectors_payloads_update
+AFTER UPDATE ON collectors
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION refresh_payloads();
+'''
+
+# in the order writers take them, a collection change updates the
+# counters of sets and collectors
+LOCK_PAYLOAD_TABLES = '''
+LOCK TABLE collection, sets, collectors IN SHARE ROW EXCLUSIVE MODE
+'''
+
+DROP_PAYLOAD_TRIGGERS = '''
+DROP TRIGGER IF EXISTS sets_payloads_insert ON sets;
+DROP TRIGGER IF EXISTS sets_payloads_update ON sets;
+DROP TRIGGER IF EXISTS collectors_payloads_insert ON collectors;
+DROP TRIGGER IF EXISTS collectors_payloads_update ON collectors;
+TRUNCATE set_payloads, collector_payloads;
+'''
+
+PAYLOADS_INSTALLED = '''
+SELECT EXISTS (
+    SELECT 1 FROM pg_trigger
+    WHERE tgrelid = 'sets'::regclass AND tgname = 'sets_payloads_update')
+'''
+
+DISABLE_PAYLOADS = '''
+SET LOCAL lego.payloads = 'off'
+'''
+
+# the tables are analyzed first, rows written earlier in the same
+# transaction are missing from their statistics
+REBUILD_PAYLOADS = '''
+ANALYZE sets;
+ANALYZE collectors;
+ANALYZE collection;
+SELECT write_set_payloads(ARRAY(SELECT id FROM sets));
+SELECT write_collector_payloads(ARRAY(SELECT id FROM collectors));
+'''
+
+# the orders of sort_order() in app.py
+DETAIL_LISTINGS = {
+    ('sets', False): '''
+SELECT string_agg(payload::text, ',') FROM set_payloads
+''',
+    ('sets', True): '''
+SELECT string_agg(p.payload::text, ','
+                  ORDER BY s.collector_count DESC, s.id DESC)
+FROM sets s JOIN set_payloads p ON p.set_id = s.id
+''',
+    ('collectors', False): '''
+SELECT string_agg(payload::text, ',') FROM collector_payloads
+''',
+    ('collectors', True): '''
+SELECT string_agg(p.payload::text, ','
+                  ORDER BY c.set_count DESC, c.id DESC)
+FROM collectors c JOIN collector_payloads p ON p.collector_id = c.id
+'''
+    }
+
+
+def payloads_installed(session):
+    return session.execute(PAYLOADS_INSTALLED).scalar()
+
+
+'''
+PayloadTriggers
+    whether the payload triggers are installed, as last looked up by the
+    worker, looked up again once check_interval seconds have passed
+'''
+
+
+class PayloadTriggers:
+    def __init__(self, check_interval):
+        self.check_interval = check_interval
+        self.installed = False
+        self.checked_at = None
+
+    def check(self, session):
+        now = monotonic()
+        if self.checked_at is None or \
+                now - self.checked_at >= self.check_interval:
+            self.installed = payloads_installed(session)
+            self.checked_at = now
+        return self.installed
+
+
+'''
+rebuild_payloads(session)
+    rewrites the payload of every set and collector and returns True, or
+    returns False when the triggers are not installed, the caller commits
+'''
+
+
+def rebuild_payloads(session):
+    if not payloads_installed(session):
+        return False
+    session.execute(REBUILD_PAYLOADS)
+    return True
+
+
+'''
+sync_payloads(session, enabled)
+    creates the triggers and rebuilds every payload, or drops the triggers
+    and empties the payload tables, unless they are already in that state
+    the tables are locked until the caller commits, so no write is missed
+    returns whether anything changed
+'''
+
+
+def sync_payloads(session, enabled):
+    session.execute(LOCK_PAYLOAD_TABLES)
+    if payloads_installed(session) == enabled:
+        return False
+
+    if enabled:
+        session.execute(CREATE_PAYLOAD_TRIGGERS)
+        session.execute(REBUILD_PAYLOADS)
+    else:
+        session.execute(DROP_PAYLOAD_TRIGGERS)
+    return True
+
+
+'''
+payload_listing(session, key, popular)
+    returns the JSON detail listing of 'sets' or 'collectors' built from
+    the payloads, or None when the mode is off or the triggers are not
+    installed
+'''
+
+
+def payload_listing(session, key, popular=False):
+    if not current_app.config['MATERIALIZED_PAYLOADS']:
+        return None
+    if not current_app.extensions['payload_triggers'].check(session):
+        return None
+
+    fragments = session.execute(
+        text(DETAIL_LISTINGS[key, popular])).scalar()
+    body = ''.join([
+        '{"', key, '":[', fragments or '', '],"success":true}\n'])
+    return Response(body, status=200,
+                    mimetype=current_app.config['JSONIFY_MIMETYPE'])
+
+
+def init_payloads(app):
+    app.config.setdefault('MATERIALIZED_PAYLOADS', True)
+    app.config.setdefault('PAYLOADS_CHECK_INTERVAL', 10.0)
+
+    enabled = app.config['MATERIALIZED_PAYLOADS']
+    if isinstance(enabled, str):
+        # read from the environment
+        app.config['MATERIALIZED_PAYLOADS'] = \
+            enabled.lower() in ('1', 'true', 'on', 'yes')
+
+    app.extensions['payload_triggers'] = PayloadTriggers(
+        float(app.config['PAYLOADS_CHECK_INTERVAL']))
@@ -0,0 +1,196 @@
+import math
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+from time import monotonic
+from flask import current_app, request
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+'''
+Rate Limiting
+    token buckets keyed by the JWT `sub` for authenticated routes and by
+    client IP for anonymous ones
+
+    every key gets RATELIMIT_BURST tokens that refill at RATELIMIT_RATE
+    tokens per second, a request takes one token and is refused with 429
+    when the bucket is empty
+    a batch takes one token per operation, it only needs a token left to be
+    let in and may leave the bucket in debt, so the client waits for the
+    whole batch to be paid back before its next request
+
+    buckets live in the worker's memory by default, set
+    RATELIMIT_STORAGE_URL to a redis:// URL to share them between workers
+
+    the client IP is taken from X-Forwarded-For as written by the last
+    TRUSTED_PROXY_HOPS proxies (1, the Heroku router), addresses the client
+    added itself are ignored, set it to 0 when clients connect directly
+'''
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_seconds(self):
+        return max(1, int(math.ceil(self.retry_after)))
+
+
+'''
+MemoryStore
+    token buckets of a single process, kept as [tokens, updated at] lists
+    in least recently used order, a new key beyond max_keys evicts the
+    bucket left alone the longest
+'''
+
+
+class MemoryStore:
+    def __init__(self, max_keys=100000):
+        self.buckets = OrderedDict()
+        self.max_keys = max_keys
+        self.lock = Lock()
+
+    def consume(self, key, rate, burst, cost=1):
+        now = monotonic()
+
+        with self.lock:
+            bucket = self.buckets.get(key)
+
+            if bucket is None:
+                if len(self.buckets) >= self.max_keys:
+                    self.buckets.popitem(last=False)
+                self.buckets[key] = [burst - cost, now]
+                return 0.0
+
+            self.buckets.move_to_end(key)
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+
+            if tokens >= 1:
+                bucket[0] = tokens - cost
+                return 0.0
+
+            bucket[0] = tokens
+            return (1 - tokens) / rate
+
+
+'''
+RedisStore
+    token buckets shared by every worker, updated atomically by a Lua
+    script that uses the Redis server clock
+'''
+
+CONSUME_SCRIPT = '''
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1])
+if tokens == nil then
+    tokens = burst
+else
+    tokens = math.min(burst, tokens + (now - tonumber(bucket[2])) * rate)
+end
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - cost
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HMSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil((burst - tokens) / rate) + 1)
+return tostring(wait)
+'''
+
+
+class RedisStore:
+    def __init__(self, url, prefix='ratelimit:'):
+        if redis is None:
+            raise RuntimeError(
+                'RATELIMIT_STORAGE_URL requires the redis package.')
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(CONSUME_SCRIPT)
+        self.prefix = prefix
+
+    def consume(self, key, rate, burst, cost=1):
+        return float(self.script(keys=[self.prefix + key],
+                                 args=[rate, burst, cost]))
+
+
+class RateLimiter:
+    def __init__(self, store, rate, burst, enabled=True):
+        self.store = store
+        self.rate = rate
+        self.burst = burst
+        self.enabled = enabled
+
+    def check(self, key, cost=1):
+        if not self.enabled:
+            return
+        retry_after = self.store.consume(key, self.rate, self.burst, cost)
+        if retry_after > 0:
+            raise RateLimitExceeded(retry_after)
+
+
+def init_rate_limiter(app):
+    app.config.setdefault('RATELIMIT_ENABLED', True)
+    app.config.setdefault('RATELIMIT_RATE', 10.0)
+    app.config.setdefault('RATELIMIT_BURST', 20)
+    app.config.setdefault('RATELIMIT_STORAGE_URL', None)
+    app.config.setdefault('TRUSTED_PROXY_HOPS', 1)
+
+    enabled = app.config['RATELIMIT_ENABLED']
+    if isinstance(enabled, str):
+        # read from the environment
+        app.config['RATELIMIT_ENABLED'] = \
+            enabled.lower() in ('1', 'true', 'on', 'yes')
+
+    hops = int(app.config['TRUSTED_PROXY_HOPS'])
+    if hops > 0:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops)
+
+    if app.config['RATELIMIT_STORAGE_URL']:
+        store = RedisStore(app.config['RATELIMIT_STORAGE_URL'])
+    else:
+        store = MemoryStore()
+
+    app.extensions['rate_limiter'] = RateLimiter(
+        store,
+        float(app.config['RATELIMIT_RATE']),
+        float(app.config['RATELIMIT_BURST']),
+        app.config['RATELIMIT_ENABLED'])
+
+
+def rate_limit_key(payload=None):
+    if payload is not None and 'sub' in payload:
+        return 'sub:' + payload['sub']
+    return 'ip:' + (request.remote_addr or '')
+
+
+'''
+@rate_limit
+    takes a token before calling the route
+    place it below requires_auth so the JWT payload passed to the route
+    selects the bucket, anonymous routes fall back to the client IP
+    the wrapper is marked rate_limited so the batch endpoint, which pays
+    for its operations up front, can call the route underneath
+'''
+
+
+def rate_limit(f):
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        payload = args[0] if args and isinstance(args[0], dict) else None
+        current_app.extensions['rate_limiter'].check(
+            rate_limit_key(payload))
+        return f(*args, **kwargs)
+
+    wrapper.rate_limited = True
+    return wrapper
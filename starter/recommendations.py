@@ -0,0 +1,365 @@
+import time
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = None
+    sparse = None
+
+'''
+Recommendations
+    "collectors who own this set also own..."
+
+    set_recommendations keeps, for every set, the TOP_K sets most often
+    owned together with it as two parallel arrays (related set ids and
+    scores), so a lookup reads a single row
+    the score of sets i and j is the cosine similarity of their owners,
+    co-owners(i, j) / sqrt(owners(i) * owners(j))
+
+    collectors owning more than MAX_COLLECTION sets are left out of the
+    co-occurrence: they own nearly everything, so they add noise and a
+    quadratic number of pairs
+
+    rebuild_recommendations()   recomputes every set from the collection
+                                table with sparse matrix products, a block
+                                of sets at a time (needs numpy and scipy)
+    refresh_recommendations()   recomputes, in SQL, only the sets whose
+                                co-occurrences changed since, queued by a
+                                trigger on collection
+
+    a link of collector c to set x changes the co-occurrence of x with
+    every other set c owns, so the trigger queues x and all the sets of c
+    and a refresh rescores both sides of every changed pair
+'''
+
+TOP_K = 20
+MAX_COLLECTION = 1000
+MIN_SUPPORT = 1
+BLOCK_SIZE = 2048
+REFRESH_BATCH_SIZE = 500
+
+QUEUE_TRIGGERS = '''
+CREATE OR REPLACE FUNCTION queue_recommendations() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO recommendation_queue (set_id)
+        SELECT set_id FROM new_links
+        UNION
+        SELECT l.set_id FROM collection l
+        WHERE l.collector_id IN (SELECT collector_id FROM new_links)
+        ON CONFLICT DO NOTHING;
+    END IF;
+
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        INSERT INTO recommendation_queue (set_id)
+        SELECT set_id FROM old_links
+        UNION
+        SELECT l.set_id FROM collection l
+        WHERE l.collector_id IN (SELECT collector_id FROM old_links)
+        ON CONFLICT DO NOTHING;
+    END IF;
+
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER collection_recommendations_insert
+AFTER INSERT ON collection
+REFERENCING NEW TABLE AS new_links
+FOR EACH STATEMENT EXECUTE FUNCTION queue_recommendations();
+
+CREATE TRIGGER collection_recommendations_delete
+AFTER DELETE ON collection
+REFERENCING OLD TABLE AS old_links
+FOR EACH STATEMENT EXECUTE FUNCTION queue_recommendations();
+
+CREATE TRIGGER collection_recommendations_update
+AFTER UPDATE ON collection
+REFERENCING OLD TABLE AS old_links NEW TABLE AS new_links
+FOR EACH STATEMENT EXECUTE FUNCTION queue_recommendations();
+'''
+
+REFRESH_QUEUED = '''
+WITH queued AS (
+    DELETE FROM recommendation_queue
+    WHERE set_id IN (
+        SELECT set_id FROM recommendation_queue
+        ORDER BY set_id
+        LIMIT :batch_size
+        FOR UPDATE SKIP LOCKED)
+    RETURNING set_id
+),
+owners AS (
+    SELECT q.set_id, l.collector_id
+    FROM queued q
+    JOIN collection l ON l.set_id = q.set_id
+    JOIN collectors c ON c.id = l.collector_id
+    WHERE c.set_count <= :max_collection
+),
+pairs AS (
+    SELECT o.set_id, l.set_id AS related_id, count(*) AS co
+    FROM owners o
+    JOIN collection l ON l.collector_id = o.collector_id
+    WHERE l.set_id <> o.set_id
+    GROUP BY o.set_id, l.set_id
+    HAVING count(*) >= :min_support
+),
+scored AS (
+    SELECT p.set_id, p.related_id,
+           p.co / sqrt(a.collector_count::float8 * b.collector_count)
+               AS score
+    FROM pairs p
+    JOIN sets a ON a.id = p.set_id
+    JOIN sets b ON b.id = p.related_id
+),
+ranked AS (
+    SELECT set_id, related_id, score,
+           row_number() OVER (
+               PARTITION BY set_id
+               ORDER BY score DESC, related_id) AS rank
+    FROM scored
+)
+INSERT INTO set_recommendations (set_id, related_ids, scores)
+SELECT q.set_id,
+       coalesce(array_agg(r.related_id ORDER BY r.rank)
+                FILTER (WHERE r.related_id IS NOT NULL), '{}'),
+       coalesce(array_agg(r.score::real ORDER BY r.rank)
+                FILTER (WHERE r.related_id IS NOT NULL), '{}')
+FROM queued q
+LEFT JOIN ranked r ON r.set_id = q.set_id AND r.rank <= :top_k
+GROUP BY q.set_id
+ON CONFLICT (set_id) DO UPDATE
+SET related_ids = EXCLUDED.related_ids,
+    scores = EXCLUDED.scores
+'''
+
+SIMILAR_SETS = '''
+SELECT s.id, s.name, r.score
+FROM set_recommendations sr
+CROSS JOIN LATERAL unnest(sr.related_ids, sr.scores)
+    WITH ORDINALITY AS r(related_id, score, rank)
+JOIN sets s ON s.id = r.related_id
+WHERE sr.set_id = :set_id
+ORDER BY r.rank
+LIMIT :limit
+'''
+
+COLLECTOR_RECOMMENDATIONS = '''
+SELECT s.id, s.name, r.score
+FROM (
+    SELECT n.related_id, sum(n.score) AS score
+    FROM collection l
+    JOIN set_recommendations sr ON sr.set_id = l.set_id
+    CROSS JOIN LATERAL unnest(sr.related_ids, sr.scores)
+        AS n(related_id, score)
+    WHERE l.collector_id = :collector_id
+    AND NOT EXISTS (
+        SELECT 1 FROM collection o
+        WHERE o.collector_id = :collector_id
+        AND o.set_id = n.related_id)
+    GROUP BY n.related_id
+    ORDER BY score DESC, n.related_id
+    LIMIT :limit
+) r
+JOIN sets s ON s.id = r.related_id
+ORDER BY r.score DESC, s.id
+'''
+
+STAGING_TABLE = '''
+CREATE TEMPORARY TABLE import_recommendations (
+    set_id integer,
+    related_ids integer[],
+    scores real[]
+) ON COMMIT DROP
+'''
+
+REPLACE_RECOMMENDATIONS = '''
+DELETE FROM set_recommendations;
+INSERT INTO set_recommendations (set_id, related_ids, scores)
+SELECT i.set_id, i.related_ids, i.scores
+FROM import_recommendations i
+JOIN sets s ON s.id = i.set_id;
+'''
+
+
+def recommendation(row):
+    id, name, score = row
+    return {
+        'set number': id,
+        'name': name,
+        'score': round(score, 4)
+        }
+
+
+def similar_sets(session, set_id, limit=TOP_K):
+    return [recommendation(row) for row in session.execute(
+        SIMILAR_SETS, {'set_id': set_id, 'limit': limit})]
+
+
+def recommend_sets(session, collector_id, limit=TOP_K):
+    return [recommendation(row) for row in session.execute(
+        COLLECTOR_RECOMMENDATIONS,
+        {'collector_id': collector_id, 'limit': limit})]
+
+
+'''
+refresh_recommendations(session)
+    recomputes the queued sets, batch_size sets per transaction, and
+    returns the number of sets refreshed
+    concurrent refreshes take different batches
+'''
+
+
+def refresh_recommendations(session, top_k=TOP_K,
+                            max_collection=MAX_COLLECTION,
+                            min_support=MIN_SUPPORT,
+                            batch_size=REFRESH_BATCH_SIZE):
+    refreshed = 0
+    while True:
+        count = session.execute(REFRESH_QUEUED, {
+            'top_k': top_k,
+            'max_collection': max_collection,
+            'min_support': min_support,
+            'batch_size': batch_size
+            }).rowcount
+        session.commit()
+        refreshed += count
+        if count < batch_size:
+            return refreshed
+
+
+'''
+co_occurrence(collector_ids, set_ids, top_k, max_collection, min_support)
+    takes the collection as two parallel arrays and yields
+    (set_id, related_ids, scores) for every set with related sets
+
+    the collection becomes a sparse collectors x sets matrix A, the
+    co-occurrence counts of a block of sets are the rows of
+    A[:, block].T @ A, and the top_k of every row are picked with one
+    sort per block, so no Python code runs per pair
+'''
+
+
+def co_occurrence(collector_ids, set_ids, top_k=TOP_K,
+                  max_collection=MAX_COLLECTION, min_support=MIN_SUPPORT,
+                  block_size=BLOCK_SIZE):
+    if np is None:
+        raise RuntimeError('Rebuilding recommendations requires numpy '
+                           'and scipy.')
+
+    set_index, set_positions = np.unique(set_ids, return_inverse=True)
+    _, collector_positions = np.unique(collector_ids, return_inverse=True)
+    owners = np.bincount(set_positions).astype(np.float64)
+    sizes = np.bincount(collector_positions)
+
+    kept = sizes[collector_positions] <= max_collection
+    matrix = sparse.csr_matrix(
+        (np.ones(kept.sum(), dtype=np.float32),
+         (collector_positions[kept], set_positions[kept])),
+        shape=(len(sizes), len(set_index)))
+    transposed = matrix.T.tocsr()
+
+    for start in range(0, len(set_index), block_size):
+        block = transposed[start:start + block_size] @ matrix
+        block.sort_indices()
+        rows = np.repeat(np.arange(block.shape[0]), np.diff(block.indptr))
+        columns = block.indices.astype(np.int64)
+        counts = block.data
+
+        pairs = (rows + start != columns) & (counts >= min_support)
+        rows, columns, counts = rows[pairs], columns[pairs], counts[pairs]
+        scores = counts / np.sqrt(owners[rows + start] * owners[columns])
+
+        # scores are in (0, 1], so this key orders by row, then by score
+        # descending, and the stable sort keeps the columns ascending
+        order = np.argsort(rows * 2.0 + (1 - scores), kind='stable')
+        rows, columns, scores = rows[order], columns[order], scores[order]
+        firsts = np.cumsum(np.bincount(rows, minlength=block.shape[0]))
+        firsts = np.r_[0, firsts[:-1]]
+        top = np.arange(len(rows)) - firsts[rows] < top_k
+        rows, columns, scores = rows[top], columns[top], scores[top]
+
+        bounds = np.flatnonzero(np.diff(rows)) + 1
+        for row, related, weights in zip(
+                rows[np.r_[0, bounds]] if len(rows) else [],
+                np.split(columns, bounds), np.split(scores, bounds)):
+            yield (int(set_index[row + start]),
+                   set_index[related].tolist(),
+                   weights.tolist())
+
+
+def load_links(connection, chunk_size):
+    cursor = connection.cursor(name='recommendation_links')
+    cursor.itersize = chunk_size
+    cursor.execute('SELECT collector_id, set_id FROM collection')
+
+    chunks = []
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        chunks.append(np.array(rows, dtype=np.int64))
+    cursor.close()
+
+    links = np.concatenate(chunks) if chunks else \
+        np.empty((0, 2), dtype=np.int64)
+    return links[:, 0], links[:, 1]
+
+
+def array_literal(values, format='{}'):
+    return '{' + ','.join(format.format(value) for value in values) + '}'
+
+
+'''
+rebuild_recommendations(engine)
+    recomputes every set and replaces set_recommendations in one
+    transaction, readers keep the old lists until it commits
+    the queue is emptied first: links changed while the rebuild runs stay
+    queued for the next refresh
+'''
+
+
+def rebuild_recommendations(engine, top_k=TOP_K,
+                            max_collection=MAX_COLLECTION,
+                            min_support=MIN_SUPPORT,
+                            block_size=BLOCK_SIZE, chunk_size=50000,
+                            progress=None):
+    # catalogue imports models, which imports this module
+    from catalogue import chunked, copy_rows
+
+    started = time.perf_counter()
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute('DELETE FROM recommendation_queue')
+        connection.commit()
+
+        collector_ids, set_ids = load_links(connection, chunk_size)
+        if progress is not None:
+            progress('loaded {} links'.format(len(set_ids)))
+
+        cursor.execute(STAGING_TABLE)
+        rows = (
+            (set_id, array_literal(related), array_literal(scores, '{:.6g}'))
+            for set_id, related, scores in co_occurrence(
+                collector_ids, set_ids, top_k, max_collection, min_support,
+                block_size))
+        count = 0
+        for chunk in chunked(rows, chunk_size):
+            copy_rows(cursor, 'import_recommendations',
+                      ('set_id', 'related_ids', 'scores'), chunk)
+            count += len(chunk)
+            if progress is not None:
+                progress('computed {} sets'.format(count))
+
+        cursor.execute(REPLACE_RECOMMENDATIONS)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+    return count, time.perf_counter() - started
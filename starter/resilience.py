@@ -0,0 +1,442 @@
+import math
+import socket
+import struct
+from collections import deque
+from threading import Lock
+from time import monotonic
+import psycopg2
+from psycopg2 import errorcodes
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.orm import Session
+from auth.auth import authenticated_payload
+
+'''
+Database Resilience
+    keeps a slow or failing database from taking every worker down with it
+
+    statement timeouts
+        every transaction a request begins runs SET LOCAL statement_timeout
+        with the timeout of its endpoint from DB_STATEMENT_TIMEOUTS, or
+        DB_STATEMENT_TIMEOUT (milliseconds), jobs and commands run outside
+        requests and keep the server default
+        a pool checkout waits at most DB_POOL_TIMEOUT seconds
+
+    circuit breaker
+        requests that used the database are counted over the last
+        BREAKER_WINDOW seconds, once there are BREAKER_MIN_REQUESTS of them
+        and BREAKER_FAILURE_RATIO failed (statement timeouts, pool
+        timeouts, lost connections) the breaker opens: for BREAKER_COOLDOWN
+        seconds every transaction fails at once with 503, then a single
+        request probes the database and closes or reopens it
+        the breaker guards transactions, not routes, so listings served
+        from memory keep working while it is open
+
+    load shedding
+        the queue depth is the accept queue of the gunicorn listeners plus
+        the other requests in flight in the worker, anonymous reads are
+        refused with 503 from SHEDDING_DEPTHS['anonymous'], authenticated
+        reads from SHEDDING_DEPTHS['read'] and authenticated writes are
+        never shed
+        a request counts as authenticated once its token is verified, the
+        payload is kept for requires_auth, a missing or invalid token is
+        anonymous whatever the method
+        reads are shed too while every pooled connection is checked out
+
+    the breaker and the in flight count belong to the worker, the counters
+    are published through metrics
+'''
+
+STATEMENT_TIMEOUT = 3000
+
+STATEMENT_TIMEOUTS = {
+    'get_sets': 15000,
+    'get_sets_detail': 15000,
+    'get_collector': 15000,
+    'get_collectors_detail': 30000,
+    'create_job': 30000,
+    'get_job_result': 30000
+    }
+
+SHEDDING_DEPTHS = {
+    'anonymous': 16,
+    'read': 64
+    }
+
+WRITE_METHODS = ('POST', 'PATCH', 'PUT', 'DELETE')
+
+EXEMPT_ENDPOINTS = ('metrics', 'static')
+
+BREAKER_STATES = {'closed': 0, 'half-open': 1, 'open': 2}
+
+SET_STATEMENT_TIMEOUT = text(
+    "SELECT set_config('statement_timeout', :timeout, true)")
+
+
+class ServiceUnavailable(Exception):
+    def __init__(self, message, retry_after=1):
+        self.message = message
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_seconds(self):
+        return max(1, int(math.ceil(self.retry_after)))
+
+
+'''
+failure_kind(error)
+    returns 'timeout', 'pool' or 'connection' for the errors that mean the
+    database is overloaded or gone, None for every other error
+'''
+
+
+def failure_kind(error):
+    if isinstance(error, PoolTimeout):
+        return 'pool'
+
+    error = getattr(error, 'orig', error)
+    if not isinstance(error, psycopg2.OperationalError):
+        return None
+
+    if error.pgcode == errorcodes.QUERY_CANCELED:
+        return 'timeout'
+    # no code means the connection itself failed
+    if error.pgcode is None or error.pgcode[:2] in ('08', '57'):
+        return 'connection'
+    return None
+
+
+'''
+CircuitBreaker
+    closed, open or half-open, from the outcomes recorded in a sliding
+    window of window seconds
+'''
+
+
+class CircuitBreaker:
+    def __init__(self, window=10, min_requests=20, failure_ratio=0.5,
+                 cooldown=5, clock=monotonic):
+        self.window = window
+        self.min_requests = min_requests
+        self.failure_ratio = failure_ratio
+        self.cooldown = cooldown
+        self.clock = clock
+        self.state = 'closed'
+        self.outcomes = deque()
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = Lock()
+
+    '''
+    allow()
+        raises ServiceUnavailable while the breaker is open, returns True
+        when the caller is the probe of a half-open breaker
+    '''
+
+    def allow(self):
+        with self.lock:
+            if self.state == 'closed':
+                return False
+
+            now = self.clock()
+            if self.state == 'open':
+                remaining = self.opened_at + self.cooldown - now
+                if remaining > 0:
+                    raise ServiceUnavailable(
+                        'database unavailable', remaining)
+                self.state = 'half-open'
+
+            if self.probing:
+                raise ServiceUnavailable('database unavailable')
+            self.probing = True
+            return True
+
+    def record(self, failed, probe=False):
+        now = self.clock()
+
+        with self.lock:
+            if probe:
+                self.probing = False
+                if failed:
+                    self.open(now)
+                else:
+                    self.close()
+                return
+
+            # outcomes of requests that started before the breaker opened
+            if self.state != 'closed':
+                return
+
+            self.outcomes.append((now, failed))
+            self.failures += failed
+            while self.outcomes[0][0] <= now - self.window:
+                self.failures -= self.outcomes.popleft()[1]
+
+            if len(self.outcomes) >= self.min_requests and \
+                    self.failures >= self.failure_ratio * len(self.outcomes):
+                self.open(now)
+
+    def release(self):
+        with self.lock:
+            self.probing = False
+
+    def open(self, now):
+        self.state = 'open'
+        self.opened_at = now
+        self.outcomes.clear()
+        self.failures = 0
+
+    def close(self):
+        self.state = 'closed'
+        self.opened_at = None
+
+
+'''
+DatabaseGuard
+    sets the statement timeout of the transactions begun by a request and
+    reports whether they failed to the circuit breaker when it ends
+'''
+
+
+class DatabaseGuard:
+    def __init__(self, breaker, metrics, timeout=STATEMENT_TIMEOUT,
+                 timeouts=None, enabled=True):
+        self.breaker = breaker
+        self.metrics = metrics
+        self.timeout = timeout
+        self.timeouts = timeouts or {}
+        self.enabled = enabled
+
+    def statement_timeout(self, endpoint):
+        return self.timeouts.get(endpoint, self.timeout)
+
+    def begin(self, connection):
+        if self.enabled and 'database_used' not in g:
+            try:
+                g.breaker_probe = self.breaker.allow()
+            except ServiceUnavailable:
+                self.metrics.inc('db_breaker_rejections_total')
+                raise
+        g.database_used = True
+
+        timeout = self.statement_timeout(request.endpoint)
+        if timeout:
+            connection.execute(
+                SET_STATEMENT_TIMEOUT, timeout='{}ms'.format(timeout))
+
+    def fail(self, error):
+        kind = failure_kind(error)
+        if kind is not None and 'database_failure' not in g:
+            g.database_failure = kind
+            self.metrics.inc('db_failures_total', kind=kind)
+
+    # the flags are popped, the batch sub-requests share the app context
+    # of the batch and end before it does
+    def finish(self):
+        probe = g.pop('breaker_probe', False)
+        used = g.pop('database_used', False)
+        failed = g.pop('database_failure', None) is not None
+
+        if not used:
+            if probe:
+                self.breaker.release()
+            return
+
+        if self.enabled:
+            self.breaker.record(failed, probe)
+
+
+'''
+listen_backlog(listeners)
+    returns the connections waiting in the accept queues of the TCP
+    listeners, read from TCP_INFO where Linux reports the accept queue
+    length of a listening socket as tcpi_unacked
+'''
+
+
+def listen_backlog(listeners):
+    backlog = 0
+    for listener in listeners:
+        if listener.family not in (socket.AF_INET, socket.AF_INET6):
+            continue
+        info = listener.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 32)
+        backlog += struct.unpack_from('I', info, 24)[0]
+    return backlog
+
+
+'''
+LoadShedder
+    admits or refuses requests by priority from the queue depth of the
+    worker
+'''
+
+
+class LoadShedder:
+    def __init__(self, metrics, depths=None, enabled=True):
+        self.metrics = metrics
+        self.depths = dict(SHEDDING_DEPTHS, **(depths or {}))
+        self.enabled = enabled
+        self.listeners = []
+        self.in_flight = 0
+        self.lock = Lock()
+
+    @staticmethod
+    def priority():
+        if authenticated_payload() is None:
+            return 'anonymous'
+        if request.method in WRITE_METHODS:
+            return 'write'
+        return 'read'
+
+    def queue_depth(self):
+        return listen_backlog(self.listeners) + self.in_flight
+
+    def admit(self, pool_saturated):
+        priority = self.priority()
+        depth = self.depths.get(priority)
+
+        if self.enabled and depth is not None:
+            reason = None
+            if self.queue_depth() >= depth:
+                reason = 'queue'
+            elif pool_saturated():
+                reason = 'pool'
+            if reason is not None:
+                self.metrics.inc(
+                    'requests_shed_total', priority=priority, reason=reason)
+                raise ServiceUnavailable('server overloaded')
+
+        with self.lock:
+            self.in_flight += 1
+        g.admitted = True
+
+    def release(self):
+        if g.pop('admitted', False):
+            with self.lock:
+                self.in_flight -= 1
+
+
+def pool_saturated(db):
+    pool = db.engine.pool
+    overflow = getattr(pool, '_max_overflow', -1)
+    if overflow < 0:
+        return False
+    return pool.checkedout() >= pool.size() + overflow
+
+
+def begin_transaction(session, transaction, connection):
+    if has_request_context():
+        guard = current_app.extensions.get('database_guard')
+        if guard is not None:
+            guard.begin(connection)
+
+
+def database_error(context):
+    if has_request_context():
+        guard = current_app.extensions.get('database_guard')
+        if guard is not None:
+            guard.fail(context.sqlalchemy_exception or
+                       context.original_exception)
+
+
+'''
+database_unavailable(error)
+    reports a database error that reached the error handlers and returns
+    the ServiceUnavailable to answer with
+'''
+
+
+def database_unavailable(error):
+    guard = current_app.extensions['database_guard']
+    guard.fail(error)
+
+    retry_after = 1
+    if guard.breaker.state == 'open':
+        retry_after = guard.breaker.cooldown
+    return ServiceUnavailable('database unavailable', retry_after)
+
+
+'''
+watch_listeners(app, listeners)
+    hands the listening sockets of a gunicorn worker to the load shedder,
+    call it in post_fork
+'''
+
+
+def watch_listeners(app, listeners):
+    app.extensions['load_shedder'].listeners = list(listeners)
+
+
+def init_resilience(app, db):
+    app.config.setdefault('DB_STATEMENT_TIMEOUT', STATEMENT_TIMEOUT)
+    app.config.setdefault('DB_STATEMENT_TIMEOUTS', STATEMENT_TIMEOUTS)
+    app.config.setdefault('DB_POOL_TIMEOUT', 2)
+    app.config.setdefault('BREAKER_ENABLED', True)
+    app.config.setdefault('BREAKER_WINDOW', 10)
+    app.config.setdefault('BREAKER_MIN_REQUESTS', 20)
+    app.config.setdefault('BREAKER_FAILURE_RATIO', 0.5)
+    app.config.setdefault('BREAKER_COOLDOWN', 5)
+    app.config.setdefault('SHEDDING_ENABLED', True)
+    app.config.setdefault('SHEDDING_DEPTHS', SHEDDING_DEPTHS)
+
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {}).setdefault(
+        'pool_timeout', app.config['DB_POOL_TIMEOUT'])
+
+    metrics = app.extensions['metrics']
+    metrics.counter('db_failures_total',
+                    'Database timeouts and connection failures, by kind.')
+    metrics.counter('db_breaker_rejections_total',
+                    'Transactions refused while the breaker was open.')
+    metrics.inc('db_breaker_rejections_total', 0)
+    metrics.gauge('db_breaker_state',
+                  'Circuit breaker state, 0 closed, 1 half-open, 2 open.')
+    metrics.gauge('db_pool_checked_out',
+                  'Pooled connections checked out.')
+    metrics.counter('requests_shed_total',
+                    'Requests refused by load shedding, by priority.')
+    metrics.gauge('requests_in_flight', 'Requests being served.')
+    metrics.gauge('listen_queue_depth',
+                  'Connections waiting to be accepted.')
+
+    breaker = CircuitBreaker(
+        window=app.config['BREAKER_WINDOW'],
+        min_requests=app.config['BREAKER_MIN_REQUESTS'],
+        failure_ratio=app.config['BREAKER_FAILURE_RATIO'],
+        cooldown=app.config['BREAKER_COOLDOWN'])
+    guard = DatabaseGuard(
+        breaker, metrics,
+        timeout=app.config['DB_STATEMENT_TIMEOUT'],
+        timeouts=app.config['DB_STATEMENT_TIMEOUTS'],
+        enabled=app.config['BREAKER_ENABLED'])
+    shedder = LoadShedder(
+        metrics, depths=app.config['SHEDDING_DEPTHS'],
+        enabled=app.config['SHEDDING_ENABLED'])
+    app.extensions['database_guard'] = guard
+    app.extensions['load_shedder'] = shedder
+
+    # the listeners are global, they find the guard of the current app
+    if not event.contains(Session, 'after_begin', begin_transaction):
+        event.listen(Session, 'after_begin', begin_transaction)
+    if not event.contains(Engine, 'handle_error', database_error):
+        event.listen(Engine, 'handle_error', database_error)
+
+    @app.before_request
+    def admit_request():
+        if request.endpoint not in EXEMPT_ENDPOINTS:
+            shedder.admit(lambda: pool_saturated(db))
+
+    @app.teardown_request
+    def finish_request(error=None):
+        shedder.release()
+        guard.finish()
+
+    def collect(metrics):
+        metrics.set('db_breaker_state', BREAKER_STATES[breaker.state])
+        metrics.set('db_pool_checked_out', db.engine.pool.checkedout())
+        metrics.set('requests_in_flight', shedder.in_flight)
+        metrics.set('listen_queue_depth', listen_backlog(shedder.listeners))
+
+    metrics.collector(collect)
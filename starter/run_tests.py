@@ -0,0 +1,73 @@
+import argparse
+import glob
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+
+'''
+Parallel Test Runner
+    runs every test module in its own process, at most --workers at a
+    time, each worker slot has its own database (see testing.py) so
+    modules never share data
+
+    usage: python run_tests.py [--workers N] [test_module.py ...]
+'''
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_module(module, slots):
+    slot = slots.get()
+    try:
+        env = dict(os.environ, TEST_WORKER='w{}'.format(slot))
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-m', 'unittest', '-q', module],
+            cwd=HERE, env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        return module, result.returncode, result.stdout.decode(), \
+            time.perf_counter() - started
+    finally:
+        slots.put(slot)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run the test modules in parallel.')
+    parser.add_argument('modules', nargs='*')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    args = parser.parse_args()
+
+    modules = args.modules or sorted(
+        os.path.basename(path)
+        for path in glob.glob(os.path.join(HERE, 'test_*.py')))
+    modules = [module[:-3] if module.endswith('.py') else module
+               for module in modules]
+
+    slots = Queue()
+    for slot in range(args.workers):
+        slots.put(slot)
+
+    started = time.perf_counter()
+    failed = []
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(run_module, module, slots)
+                   for module in modules]
+        for future in futures:
+            module, returncode, output, elapsed = future.result()
+            status = 'ok' if returncode == 0 else 'FAILED'
+            print('{:<30} {:<7} {:.2f}s'.format(module, status, elapsed))
+            if returncode != 0:
+                failed.append(module)
+                print(output)
+
+    print('{} modules in {:.2f}s, {} failed'.format(
+        len(modules), time.perf_counter() - started, len(failed)))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,662 @@
+import re
+from array import array
+from math import ceil
+from threading import Lock
+from time import monotonic
+from flask import current_app
+from resilience import ServiceUnavailable
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+'''
+Name Search
+    typo tolerant search of set and collector names by trigrams, as in
+    the pg_trgm extension: every word is lower cased and padded with two
+    spaces before and one after, and a name scores the share of the query
+    trigrams it contains, so 'Medeival' finds 'Medieval Blacksmith'
+    names with the same score are ranked by their similarity to the
+    query, shorter names first
+
+    SEARCH_BACKEND = 'memory'
+        every worker keeps an inverted index from trigram to the sorted
+        positions of the names that contain it (needs numpy), loaded on
+        first use and kept in sync like the collection index: triggers on
+        sets and collectors log the ids whose name changed in
+        search_changes, and the index reloads those names
+        changed names are tombstoned in the loaded index and kept in a
+        small delta index until the next full load
+    SEARCH_BACKEND = 'postgres'
+        the <% operator and word_similarity() of pg_trgm, served by GIN
+        trigram indexes on the names, created when the extension is
+        available; word_similarity() only counts the trigrams found in
+        one stretch of the name, so it scores a little lower
+        without the extension a search answers 503, every worker looks it
+        up until it is found
+
+    SEARCH_BACKEND         'memory' when numpy is installed, 'postgres'
+                           otherwise
+    SEARCH_THRESHOLD       least score of a result (0.5)
+    SEARCH_SYNC_INTERVAL   seconds between two syncs (1)
+    SEARCH_RETENTION       seconds the changes are kept (3600), a worker
+                           that did not sync for half of it reloads the
+                           whole index
+'''
+
+KINDS = ('sets', 'collectors')
+THRESHOLD = 0.5
+MAX_LIMIT = 50
+DELTA_LIMIT = 20000
+FIRST_CANDIDATES = 1024
+DIRECT_CANDIDATES = 16384
+
+SEARCH_CHANGE_TRIGGERS = '''
+CREATE OR REPLACE FUNCTION log_search_changes() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    -- the counter triggers update sets and collectors but never a name
+    IF pg_trigger_depth() > 1 THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO search_changes (kind, id)
+        SELECT TG_TABLE_NAME, id FROM new_rows;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO search_changes (kind, id)
+        SELECT TG_TABLE_NAME, id FROM old_rows;
+    ELSE
+        INSERT INTO search_changes (kind, id)
+        SELECT TG_TABLE_NAME, coalesce(n.id, o.id)
+        FROM new_rows n
+        FULL JOIN old_rows o ON o.id = n.id
+        WHERE n.name IS DISTINCT FROM o.name;
+    END IF;
+
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER sets_search_insert
+AFTER INSERT ON sets
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes();
+
+CREATE TRIGGER sets_search_delete
+AFTER DELETE ON sets
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes();
+
+CREATE TRIGGER sets_search_update
+AFTER UPDATE ON sets
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes();
+
+CREATE TRIGGER collectors_search_insert
+AFTER INSERT ON collectors
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes();
+
+CREATE TRIGGER collectors_search_delete
+AFTER DELETE ON collectors
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes();
+
+CREATE TRIGGER collectors_search_update
+AFTER UPDATE ON collectors
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION log_search_changes();
+'''
+
+# pg_trgm is a contrib extension, servers without it use the memory backend
+TRIGRAM_INDEXES = '''
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions
+               WHERE name = 'pg_trgm') THEN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE INDEX IF NOT EXISTS ix_sets_name_trgm
+        ON sets USING gin (name gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS ix_collectors_name_trgm
+        ON collectors USING gin (name gin_trgm_ops);
+    END IF;
+END
+$$;
+'''
+
+SNAPSHOT_XMIN = '''
+SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint
+'''
+
+CHANGED_NAMES = '''
+SELECT DISTINCT kind, id FROM search_changes WHERE xid >= :xmin
+'''
+
+PRUNE_CHANGES = '''
+DELETE FROM search_changes
+WHERE changed_at < now() - make_interval(secs => :retention)
+'''
+
+ALL_NAMES = '''
+SELECT 0 AS kind, id, name FROM sets
+UNION ALL
+SELECT 1 AS kind, id, name FROM collectors
+ORDER BY kind, id
+'''
+
+NAMES = {
+    'sets': 'SELECT id, name FROM sets WHERE id = ANY(:ids)',
+    'collectors': 'SELECT id, name FROM collectors WHERE id = ANY(:ids)'
+    }
+
+TRIGRAM_EXTENSION = '''
+SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')
+'''
+
+SET_THRESHOLD = '''
+SELECT set_config('pg_trgm.word_similarity_threshold', :threshold, true)
+'''
+
+TRIGRAM_SEARCH = {
+    kind: '''
+SELECT id, name, word_similarity(:query, name) AS score
+FROM {}
+WHERE :query <% name
+ORDER BY score DESC, similarity(:query, name) DESC, id
+LIMIT :limit
+'''.format(kind) for kind in KINDS}
+
+WORD = re.compile(r'[^\W_]+')
+
+
+def words(text):
+    return WORD.findall(text.lower())
+
+
+def word_trigrams(word):
+    padded = '  ' + word + ' '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def trigrams(text):
+    grams = set()
+    for word in words(text):
+        grams |= word_trigrams(word)
+    return grams
+
+
+def result(kind, id, name, score):
+    return {
+        'type': kind,
+        'id': id,
+        'name': name,
+        'score': round(score, 4)
+        }
+
+
+'''
+Delta
+    the names changed since the index was loaded, by (kind, id), with an
+    inverted index of their own
+    it is never modified: a change builds a new Delta that shares the
+    postings of the untouched trigrams, so readers need no lock
+'''
+
+
+class Delta:
+    __slots__ = ('names', 'postings')
+
+    def __init__(self, names=None, postings=None):
+        self.names = names or {}
+        self.postings = postings or {}
+
+    def changed(self, changes):
+        names = dict(self.names)
+        postings = dict(self.postings)
+
+        for key, name in changes:
+            old = names.pop(key, None)
+            if old is not None:
+                for gram in trigrams(old):
+                    postings[gram] = postings[gram] - {key}
+            if name is not None:
+                names[key] = name
+                for gram in trigrams(name):
+                    postings[gram] = postings.get(gram, frozenset()) | {key}
+
+        return Delta(names, postings)
+
+    def search(self, kind, grams, least):
+        shared = {}
+        for gram in grams:
+            for key in self.postings.get(gram, ()):
+                if key[0] == kind:
+                    shared[key] = shared.get(key, 0) + 1
+
+        n = len(grams)
+        for key, count in shared.items():
+            if count >= least:
+                name = self.names[key]
+                yield (rank(count, n, len(trigrams(name))), key[1], name,
+                       count / n)
+
+
+'''
+count_positions(positions, start, stop)
+    returns the distinct positions, sorted, and how often each occurs
+    long lists of positions are counted in an array spanning start to
+    stop rather than sorted
+'''
+
+
+def count_positions(positions, start, stop):
+    if len(positions) * 8 < stop - start:
+        return np.unique(positions, return_counts=True)
+
+    counts = np.bincount(positions - start, minlength=stop - start)
+    found = np.flatnonzero(counts)
+    return (found + start).astype(np.int32), counts[found]
+
+
+'''
+probe(candidates, counts, lists, shared)
+    adds to the counts of trigrams the candidates contain those of the
+    postings lists, dropping every candidate the lists left to probe can
+    no longer bring up to shared
+'''
+
+
+def probe(candidates, counts, lists, shared):
+    for probed, postings in enumerate(lists):
+        kept = counts + len(lists) - probed >= shared
+        candidates, counts = candidates[kept], counts[kept]
+        if not len(candidates):
+            break
+        if len(postings):
+            found = np.searchsorted(postings, candidates)
+            found[found == len(postings)] = 0
+            counts = counts + (postings[found] == candidates)
+    return candidates, counts
+
+
+'''
+bounds(start, stop)
+    searches int32 postings for a range without turning them into int64
+'''
+
+
+def bounds(start, stop):
+    return np.array([start, stop], dtype=np.int32)
+
+
+'''
+rank(shared, n, size)
+    orders by the share of the n query trigrams found in a name, then by
+    similarity, so shorter names come first: shares are multiples of 1 / n
+    and similarity / (n + 1) is always smaller than that
+'''
+
+
+def rank(shared, n, size):
+    return shared / n + shared / (n + size - shared) / (n + 1)
+
+
+'''
+TrigramIndex(rows)
+    the inverted index of (kind, id, name) rows ordered by kind and id,
+    kind being the position in KINDS
+    the postings of all trigrams are slices of one array of name
+    positions, sorted within every slice, so the names of one kind are a
+    contiguous range of every slice
+    positions are in rank order among names sharing as many trigrams with
+    a query: by kind, then number of trigrams, then id
+    the tombstones of the changed names and the Delta holding their new
+    names are published together as state, so a search reads both from
+    one reference and never misses a renamed name
+'''
+
+
+class TrigramIndex:
+    def __init__(self, rows):
+        vocabulary = {}
+        # names share most of their words, their trigrams are found once
+        word_terms = {}
+        terms = array('i')
+        kinds, ids, sizes, names = array('b'), array('i'), array('i'), []
+
+        for kind, id, name in rows:
+            name_terms = set()
+            for word in words(name):
+                found = word_terms.get(word)
+                if found is None:
+                    found = word_terms[word] = [
+                        vocabulary.setdefault(gram, len(vocabulary))
+                        for gram in word_trigrams(word)]
+                name_terms.update(found)
+            terms.extend(name_terms)
+            kinds.append(kind)
+            ids.append(id)
+            sizes.append(len(name_terms))
+            names.append(name)
+
+        terms = np.frombuffer(terms, dtype=np.int32)
+        sizes = np.frombuffer(sizes, dtype=np.int32)
+        kinds = np.frombuffer(kinds, dtype=np.int8)
+        count = len(names)
+
+        # the rows keep their (kind, id) order for position()
+        self.row_ids = np.frombuffer(ids, dtype=np.int32)
+        order = np.lexsort((self.row_ids, sizes, kinds))
+        self.moved = np.empty(count, dtype=np.int32)
+        self.moved[order] = np.arange(count, dtype=np.int32)
+
+        # one sort of term * count + position orders the postings by term
+        # and every slice by position
+        positions = np.repeat(self.moved, sizes).astype(np.int64)
+        self.postings = (np.sort(terms * np.int64(count) + positions)
+                         % max(count, 1)).astype(np.int32)
+        self.vocabulary = vocabulary
+        self.offsets = np.r_[0, np.cumsum(
+            np.bincount(terms, minlength=len(vocabulary)))]
+        self.ids = self.row_ids[order]
+        self.sizes = sizes[order]
+        self.names = [names[row] for row in order]
+        self.bounds = [
+            (int(np.searchsorted(kinds, kind)),
+             int(np.searchsorted(kinds, kind, side='right')))
+            for kind in range(len(KINDS))]
+        self.state = (np.ones(count, dtype=bool), Delta())
+
+    @property
+    def delta(self):
+        return self.state[1]
+
+    def position(self, kind, id):
+        start, stop = self.bounds[kind]
+        row = start + int(np.searchsorted(self.row_ids[start:stop], id))
+        if row < stop and self.row_ids[row] == id:
+            return int(self.moved[row])
+        return None
+
+    '''
+    update(changes)
+        applies (kind, id, name) changes, name None for a deleted row
+    '''
+
+    def update(self, changes):
+        changes = [((kind, id), name) for kind, id, name in changes]
+        alive, delta = self.state
+        alive = alive.copy()
+        for (kind, id), _ in changes:
+            position = self.position(kind, id)
+            if position is not None:
+                alive[position] = False
+        self.state = (alive, delta.changed(changes))
+
+    def postings_of(self, gram, start, stop):
+        term = self.vocabulary.get(gram)
+        if term is None:
+            return self.postings[:0]
+        postings = self.postings[self.offsets[term]:self.offsets[term + 1]]
+        low, high = np.searchsorted(postings, bounds(start, stop))
+        return postings[low:high]
+
+    '''
+    matching(lists, shared, wanted, start, stop, alive)
+        the positions of the first wanted live names, in position order,
+        that contain exactly shared of the query trigrams, given their
+        postings from the rarest to the most common
+
+        such a name has at least shared trigrams, so the range starts at
+        the first name that long, and it misses n - shared of the n, so it
+        contains one of the n - shared + 1 rarest: only those postings are
+        merged into candidates, the others are probed
+        the range is read in windows that double in size, the first one
+        holding about FIRST_CANDIDATES of those postings, so the search
+        stops soon after the wanted names are found however long the
+        postings of common trigrams are
+    '''
+
+    def matching(self, lists, shared, wanted, start, stop, alive):
+        n = len(lists)
+        essential = lists[:n - shared + 1]
+        found = []
+        low = start + int(np.searchsorted(self.sizes[start:stop], shared))
+        width = (stop - start) * FIRST_CANDIDATES // max(
+            1, sum(map(len, essential))) + 1
+
+        while wanted > 0:
+            # skip to the next candidate
+            at = np.int32(low)
+            following = [postings[np.searchsorted(postings, at):][:1]
+                         for postings in essential]
+            low = int(np.concatenate(following).min(initial=stop))
+            if low >= stop:
+                break
+            high = min(stop, low + width)
+            window = bounds(low, high)
+            slices = [postings[slice(*np.searchsorted(postings, window))]
+                      for postings in lists]
+            candidates, counts = count_positions(
+                np.concatenate(slices[:len(essential)]), low, high)
+            candidates, counts = probe(
+                candidates, counts, slices[len(essential):], shared)
+
+            hits = candidates[(counts == shared) & alive[candidates]]
+            found.append(hits[:wanted])
+            wanted -= len(found[-1])
+            low, width = high, width * 2
+
+        return np.concatenate(found) if found else np.empty(0, np.int32)
+
+    '''
+    ranking(lists, least, limit, start, stop, alive)
+        the limit best (position, shared) of the live names containing at
+        least least of the query trigrams, given their postings from the
+        rarest to the most common
+
+        up to DIRECT_CANDIDATES postings of the n - least + 1 rarest
+        trigrams, candidates are all counted at once, otherwise, as names
+        are ranked by how many trigrams they contain and then by position,
+        the names containing all n are matched first, then those
+        containing n - 1 and so on down to least, until limit names are
+        found
+    '''
+
+    def ranking(self, lists, least, limit, start, stop, alive):
+        essential = lists[:len(lists) - least + 1]
+        if sum(map(len, essential)) <= DIRECT_CANDIDATES:
+            candidates, counts = count_positions(
+                np.concatenate(essential), start, stop)
+            candidates, counts = probe(
+                candidates, counts, lists[len(essential):], least)
+            kept = (counts >= least) & alive[candidates]
+            candidates, counts = candidates[kept], counts[kept]
+            top = np.lexsort((candidates, -counts))[:limit]
+            return zip(candidates[top].tolist(), counts[top].tolist())
+
+        # no name contains the trigrams found in none
+        found = []
+        present = sum(1 for postings in lists if len(postings))
+        for shared in range(present, least - 1, -1):
+            if len(found) >= limit:
+                break
+            found.extend((position, shared) for position in self.matching(
+                lists, shared, limit - len(found), start, stop,
+                alive).tolist())
+        return found
+
+    '''
+    search(kind, query, limit, threshold)
+        returns the limit best (id, name, score) of a kind
+
+        a name scoring at least threshold contains
+        least = ceil(threshold * n) of the n query trigrams
+    '''
+
+    def search(self, kind, query, limit=10, threshold=THRESHOLD):
+        grams = trigrams(query)
+        n = len(grams)
+        if not n:
+            return []
+
+        alive, delta = self.state
+        start, stop = self.bounds[kind]
+        lists = sorted((self.postings_of(gram, start, stop)
+                        for gram in grams), key=len)
+        least = max(1, ceil(threshold * n - 1e-9))
+
+        found = [(rank(shared, n, int(self.sizes[position])),
+                  int(self.ids[position]), self.names[position], shared / n)
+                 for position, shared in self.ranking(
+                     lists, least, limit, start, stop, alive)]
+        found.extend(delta.search(kind, grams, least))
+        found.sort(key=lambda item: (-item[0], item[1]))
+        return [(id, name, score) for _, id, name, score in found[:limit]]
+
+
+class SearchIndex:
+    def __init__(self, db, sync_interval=1.0, retention=3600.0):
+        self.db = db
+        self.sync_interval = sync_interval
+        self.retention = retention
+        self.index = None
+        self.xmin = None
+        self.synced_at = None
+        self.pruned_at = None
+        self.lock = Lock()
+
+    def reset(self):
+        with self.lock:
+            self.index = None
+
+    def load(self):
+        session = self.db.session
+        xmin = session.execute(SNAPSHOT_XMIN).scalar()
+        result = session.connection().execution_options(
+            stream_results=True).execute(self.db.text(ALL_NAMES))
+        index = TrigramIndex(result)
+
+        self.index = index
+        self.xmin = xmin
+        self.synced_at = monotonic()
+
+    def sync(self):
+        session = self.db.session
+        xmin = session.execute(SNAPSHOT_XMIN).scalar()
+        changed = {}
+        for kind, id in session.execute(CHANGED_NAMES, {'xmin': self.xmin}):
+            changed.setdefault(kind, []).append(id)
+
+        if changed:
+            changes = []
+            for kind, ids in changed.items():
+                names = dict(session.execute(
+                    NAMES[kind], {'ids': ids}).fetchall())
+                changes.extend((KINDS.index(kind), id, names.get(id))
+                               for id in ids)
+            self.index.update(changes)
+
+        self.xmin = xmin
+        self.synced_at = monotonic()
+        if len(self.index.delta.names) > DELTA_LIMIT:
+            self.load()
+
+    def prune(self):
+        with self.db.engine.begin() as connection:
+            connection.execute(
+                self.db.text(PRUNE_CHANGES), retention=self.retention)
+        self.pruned_at = monotonic()
+
+    '''
+    current()
+        returns the TrigramIndex, synced at most sync_interval seconds ago
+        only one thread syncs at a time, the others search the index of
+        the previous sync meanwhile
+    '''
+
+    def current(self):
+        now = monotonic()
+        stale = self.index is None or \
+            now - self.synced_at >= self.sync_interval
+
+        if stale and self.lock.acquire(blocking=self.index is None):
+            try:
+                if self.index is None or \
+                        now - self.synced_at >= self.retention / 2:
+                    self.load()
+                elif now - self.synced_at >= self.sync_interval:
+                    self.sync()
+
+                if self.pruned_at is None or \
+                        now - self.pruned_at >= self.retention / 2:
+                    self.prune()
+            finally:
+                self.lock.release()
+
+        return self.index
+
+
+def init_search(app, db):
+    app.config.setdefault(
+        'SEARCH_BACKEND', 'memory' if np is not None else 'postgres')
+    app.config.setdefault('SEARCH_THRESHOLD', THRESHOLD)
+    app.config.setdefault('SEARCH_SYNC_INTERVAL', 1.0)
+    app.config.setdefault('SEARCH_RETENTION', 3600.0)
+
+    if app.config['SEARCH_BACKEND'] == 'memory':
+        if np is None:
+            raise RuntimeError('SEARCH_BACKEND memory requires numpy.')
+        app.extensions['search_index'] = SearchIndex(
+            db,
+            float(app.config['SEARCH_SYNC_INTERVAL']),
+            float(app.config['SEARCH_RETENTION']))
+
+
+'''
+warm_search(app)
+    loads the index before the workers are forked from a preloaded app
+'''
+
+
+def warm_search(app):
+    index = app.extensions.get('search_index')
+    if index is not None:
+        with app.app_context():
+            index.current()
+            index.db.session.remove()
+
+
+def trigrams_installed(session):
+    if not current_app.extensions.get('pg_trgm'):
+        current_app.extensions['pg_trgm'] = \
+            session.execute(TRIGRAM_EXTENSION).scalar()
+    return current_app.extensions['pg_trgm']
+
+
+'''
+search_names(session, kind, query, limit)
+    returns the best matches of a kind ('sets' or 'collectors') with the
+    configured backend
+'''
+
+
+def search_names(session, kind, query, limit=10):
+    threshold = float(current_app.config['SEARCH_THRESHOLD'])
+    index = current_app.extensions.get('search_index')
+
+    if index is not None:
+        found = index.current().search(
+            KINDS.index(kind), query, limit, threshold)
+    else:
+        if not trigrams_installed(session):
+            raise ServiceUnavailable('name search unavailable', 60)
+        session.execute(SET_THRESHOLD, {'threshold': str(threshold)})
+        found = session.execute(TRIGRAM_SEARCH[kind], {
+            'query': query,
+            'limit': limit
+            })
+
+    return [result(kind, id, name, score) for id, name, score in found]
@@ -0,0 +1,324 @@
+import json
+import logging
+import os
+from array import array
+from threading import Lock, Thread
+from time import monotonic, sleep
+from flask import Response, current_app
+from sqlalchemy import text
+from formats import (
+    COLLECTOR_COLUMNS,
+    COLLECTOR_DETAIL_COLUMNS,
+    JSON_MIMETYPE,
+    SET_COLUMNS,
+    columnar_response
+    )
+from models import db, Collector, Set
+
+logger = logging.getLogger(__name__)
+
+'''
+Catalogue Snapshot
+    an optional mode, enabled with CATALOGUE_SNAPSHOT, in which every
+    worker keeps a read-only copy of sets, collectors and collection and
+    serves GET '/sets', '/sets-detail', '/collectors' and
+    '/collectors-detail' from it without touching the database
+
+    every row is serialized to JSON once, when the snapshot is loaded, and
+    a listing joins the fragments of its rows; columns are kept in arrays
+    for the columnar formats and the popularity order is precomputed
+
+    the snapshot is loaded in one REPEATABLE READ transaction, so it is
+    consistent, and remembers the transaction snapshot it was read in
+    a background thread in every worker polls catalogue_changes, filled by
+    triggers on the three tables, and loads a new snapshot as soon as a
+    transaction the current one did not see has committed, readers keep
+    the previous snapshot until the new one replaces it
+
+    until the first snapshot is loaded the routes read the database
+
+    CATALOGUE_SNAPSHOT                 enables the mode (False)
+    CATALOGUE_SNAPSHOT_POLL_INTERVAL   seconds between two polls (1)
+    CATALOGUE_SNAPSHOT_RETENTION       seconds catalogue_changes are kept
+                                       (3600)
+'''
+
+CURRENT_SNAPSHOT = '''
+SELECT pg_current_snapshot()::text
+'''
+
+SNAPSHOT_SETS = '''
+SELECT id, name, year, pieces, collector_count FROM sets ORDER BY id
+'''
+
+SNAPSHOT_COLLECTORS = '''
+SELECT id, name, location, set_count, total_pieces
+FROM collectors ORDER BY id
+'''
+
+SNAPSHOT_COLLECTION = '''
+SELECT collector_id, set_id FROM collection ORDER BY collector_id, set_id
+'''
+
+UNSEEN_CHANGES = '''
+SELECT EXISTS (
+    SELECT 1
+    FROM catalogue_changes,
+         CAST(:snapshot AS pg_snapshot) AS snapshot
+    WHERE xid >= pg_snapshot_xmin(snapshot)::text::bigint
+    AND NOT pg_visible_in_snapshot(xid::text::xid8, snapshot)
+    AND pg_xact_status(xid::text::xid8) = 'committed')
+'''
+
+PRUNE_CHANGES = '''
+DELETE FROM catalogue_changes
+WHERE changed_at < now() - make_interval(secs => :retention)
+'''
+
+
+def fragment(data):
+    return json.dumps(data, sort_keys=True, separators=(',', ':')).encode()
+
+
+def popularity(ids, counts):
+    return array('i', sorted(range(len(ids)),
+                             key=lambda index: (-counts[index], -ids[index])))
+
+
+'''
+Listing
+    the rows of one table: parallel column arrays, the short and long JSON
+    fragment of every row and the row positions in popularity order
+'''
+
+
+class Listing:
+    __slots__ = ('columns', 'short', 'long', 'popular')
+
+    def __init__(self, columns, short, long, popular):
+        self.columns = columns
+        self.short = short
+        self.long = long
+        self.popular = popular
+
+    def json(self, key, detail, popular):
+        fragments = self.long if detail else self.short
+        if popular:
+            fragments = [fragments[index] for index in self.popular]
+        return b''.join([
+            b'{"', key.encode(), b'":[', b','.join(fragments),
+            b'],"success":true}\n'])
+
+    def values(self, names, popular):
+        values = [self.columns[name] for name in names]
+        if popular:
+            return [[column[index] for index in self.popular]
+                    for column in values]
+        return [list(column) for column in values]
+
+
+class CatalogueSnapshot:
+    __slots__ = ('snapshot', 'loaded_at', 'sets', 'collectors')
+
+    def __init__(self, snapshot, sets, collectors):
+        self.snapshot = snapshot
+        self.loaded_at = monotonic()
+        self.sets = sets
+        self.collectors = collectors
+
+    '''
+    load(connection)
+        reads the three tables in the transaction of the connection, which
+        should be REPEATABLE READ
+    '''
+
+    @classmethod
+    def load(cls, connection):
+        snapshot = connection.execute(text(CURRENT_SNAPSHOT)).scalar()
+        sets = connection.execute(text(SNAPSHOT_SETS)).fetchall()
+        collectors = connection.execute(text(SNAPSHOT_COLLECTORS)).fetchall()
+
+        set_positions = {row.id: index for index, row in enumerate(sets)}
+        collector_positions = {
+            row.id: index for index, row in enumerate(collectors)}
+        owners = [[] for _ in sets]
+        legos = [[] for _ in collectors]
+        for collector_id, set_id in connection.execute(
+                text(SNAPSHOT_COLLECTION)):
+            owners[set_positions[set_id]].append(
+                collectors[collector_positions[collector_id]].name)
+            legos[collector_positions[collector_id]].append(set_id)
+
+        return cls(snapshot, cls.sets_listing(sets, owners),
+                   cls.collectors_listing(collectors, legos))
+
+    @staticmethod
+    def sets_listing(rows, owners):
+        short, long = [], []
+        for row, names in zip(rows, owners):
+            data = Set.short(row)
+            short.append(fragment(data))
+            data['collectors'] = names
+            long.append(fragment(data))
+
+        ids = array('i', (row.id for row in rows))
+        counts = array('i', (row.collector_count for row in rows))
+        columns = {
+            'set number': ids,
+            'name': [row.name for row in rows],
+            'release year': [row.year for row in rows],
+            'number of pieces': array('i', (row.pieces for row in rows)),
+            'number of collectors': counts,
+            'collectors': owners
+            }
+        return Listing(columns, short, long, popularity(ids, counts))
+
+    @staticmethod
+    def collectors_listing(rows, legos):
+        short, long = [], []
+        for row, set_ids in zip(rows, legos):
+            data = Collector.short(row)
+            short.append(fragment(data))
+            data['id'] = row.id
+            data['sets collected'] = set_ids
+            long.append(fragment(data))
+
+        ids = array('i', (row.id for row in rows))
+        counts = array('i', (row.set_count for row in rows))
+        columns = {
+            'id': ids,
+            'name': [row.name for row in rows],
+            'location': [row.location for row in rows],
+            'number of sets': counts,
+            'total pieces': array('q', (row.total_pieces for row in rows)),
+            'sets collected': legos
+            }
+        return Listing(columns, short, long, popularity(ids, counts))
+
+
+class SnapshotPoller:
+    def __init__(self, app, poll_interval=1.0, retention=3600.0):
+        self.app = app
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.current = None
+        self.thread = None
+        self.pid = None
+        self.pruned_at = None
+        self.lock = Lock()
+
+    '''
+    start()
+        starts the polling thread of this process, threads do not survive
+        a fork so every worker starts its own on first use
+    '''
+
+    def start(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid != os.getpid():
+                self.thread = Thread(
+                    target=self.run, name='catalogue-snapshot', daemon=True)
+                self.thread.start()
+                self.pid = os.getpid()
+
+    def run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception:
+                logger.exception('Polling the catalogue snapshot failed.')
+            sleep(self.poll_interval)
+
+    def poll(self):
+        with self.app.app_context():
+            engine = db.get_engine(self.app)
+            if self.stale(engine):
+                self.reload(engine)
+            if self.pruned_at is None or \
+                    monotonic() - self.pruned_at >= self.retention / 2:
+                with engine.begin() as connection:
+                    connection.execute(
+                        text(PRUNE_CHANGES), retention=self.retention)
+                self.pruned_at = monotonic()
+
+    def stale(self, engine):
+        current = self.current
+        if current is None or \
+                monotonic() - current.loaded_at >= self.retention / 2:
+            return True
+        with engine.connect() as connection:
+            return connection.execute(
+                text(UNSEEN_CHANGES), snapshot=current.snapshot).scalar()
+
+    def reload(self, engine):
+        started = monotonic()
+        with engine.connect() as connection:
+            connection = connection.execution_options(
+                isolation_level='REPEATABLE READ')
+            with connection.begin():
+                self.current = CatalogueSnapshot.load(connection)
+        logger.info('Loaded the catalogue snapshot in %.2fs.',
+                    monotonic() - started)
+
+
+def init_snapshot(app):
+    app.config.setdefault('CATALOGUE_SNAPSHOT', False)
+    app.config.setdefault('CATALOGUE_SNAPSHOT_POLL_INTERVAL', 1.0)
+    app.config.setdefault('CATALOGUE_SNAPSHOT_RETENTION', 3600.0)
+
+    if app.config['CATALOGUE_SNAPSHOT']:
+        app.extensions['catalogue_snapshot'] = SnapshotPoller(
+            app,
+            float(app.config['CATALOGUE_SNAPSHOT_POLL_INTERVAL']),
+            float(app.config['CATALOGUE_SNAPSHOT_RETENTION']))
+
+
+'''
+warm_snapshot(app)
+    loads the snapshot before the workers are forked from a preloaded app
+'''
+
+
+def warm_snapshot(app):
+    poller = app.extensions.get('catalogue_snapshot')
+    if poller is not None:
+        with app.app_context():
+            poller.reload(db.get_engine(app))
+
+
+'''
+snapshot_listing(key, mimetype, detail, popular)
+    returns the listing of 'sets' or 'collectors' from the snapshot, or
+    None when the mode is off or no snapshot has been loaded yet
+'''
+
+
+def snapshot_listing(key, mimetype, detail=False, popular=False):
+    poller = current_app.extensions.get('catalogue_snapshot')
+    if poller is None:
+        return None
+
+    poller.start()
+    current = poller.current
+    if current is None:
+        return None
+
+    listing = getattr(current, key)
+    if mimetype == JSON_MIMETYPE:
+        return Response(listing.json(key, detail, popular),
+                        status=200, mimetype=JSON_MIMETYPE)
+
+    if key == 'sets':
+        names = [name for name, _ in SET_COLUMNS]
+        if detail:
+            names.append('collectors')
+    elif detail:
+        names = [name for name, _ in COLLECTOR_DETAIL_COLUMNS]
+        names.append('sets collected')
+    else:
+        names = [name for name, _ in COLLECTOR_COLUMNS]
+
+    return columnar_response(
+        mimetype, key, names, listing.values(names, popular))
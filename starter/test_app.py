@@ -1,36 +1,19 @@
-import os
+import gzip
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
+from unittest import mock
 
-from app import create_app
-from models import setup_db, Collector, Set
+from models import Collector, Set
+from ratelimit import MemoryStore, RateLimiter
+from testing import TransactionalTestCase
 
 
-class LegoTestCase(unittest.TestCase):
+class LegoTestCase(TransactionalTestCase):
     """This class represents the lego test case"""
 
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
-        self.client = self.app.test_client
-        self.user_name = "postgres"
-        self.database_name = "lego"
-        self.password = "psql133"
-        self.database_path = "postgresql://{}:{}@{}/{}".format(
-            self.user_name, self.password,
-            'localhost:5432', self.database_name)
-        setup_db(self.app, self.database_path)
-
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
-
-        self.manager_token = os.environ['MANAGER_TOKEN']
-        self.director_token = os.environ['DIRECTOR_TOKEN']
+        super().setUp()
 
         self.new_set = {
             'id': '21325',
@@ -80,22 +63,27 @@ class LegoTestCase(unittest.TestCase):
             'legos': []
         }
 
-        self.client().post(
-            '/sets', json=self.set_to_be_updated,
-            headers={'Authorization': self.manager_token})
-        self.client().post(
-            '/sets', json=self.set_to_be_deleted,
-            headers={'Authorization': self.manager_token})
-        self.client().post(
-            '/collectors', json=self.collector_to_be_updated,
-            headers={'Authorization': self.director_token})
-        self.client().post(
-            '/collectors', json=self.collector_to_be_deleted,
-            headers={'Authorization': self.director_token})
-
-    def tearDown(self):
-        """Executed after reach test"""
-        pass
+        for data in (self.set_to_be_updated, self.set_to_be_deleted):
+            Set(
+                id=data['id'],
+                name=data['name'],
+                year=data['year'],
+                pieces=data['pieces']
+                ).insert()
+
+        collectors = []
+        for data in (self.collector_to_be_updated,
+                     self.collector_to_be_deleted):
+            collector = Collector(
+                name=data['name'],
+                location=data['location'],
+                legos=[]
+                )
+            collector.insert()
+            collectors.append(collector.id)
+
+        self.collector_to_be_updated_id, self.collector_to_be_deleted_id = \
+            collectors
 
     #  Tests for sets
     #  ----------------------------------------------------------------
@@ -108,6 +96,55 @@ class LegoTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(len(data['sets']))
 
+    def test_get_sets_gzip(self):
+        res = self.client().get(
+            '/sets', headers={'Accept-Encoding': 'gzip'})
+        data = json.loads(
+            gzip.decompress(res.data) if res.content_encoding else res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        self.assertTrue(res.headers['ETag'])
+        self.assertEqual(res.headers['Cache-Control'], 'no-cache')
+        self.assertNotIn('Last-Modified', res.headers)
+
+    def test_get_sets_not_modified(self):
+        res = self.client().get('/sets')
+        etag = res.headers['ETag']
+
+        res = self.client().get('/sets', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
+    def test_get_sets_columnar(self):
+        res = self.client().get(
+            '/sets', headers={'Accept': 'application/vnd.lego.columnar+json'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(
+            data['sets']['columns'],
+            ['set number', 'name', 'release year', 'number of pieces',
+             'number of collectors'])
+        self.assertEqual(
+            len(data['sets']['values'][0]), data['sets']['count'])
+
+    def test_get_sets_429(self):
+        limiter = RateLimiter(MemoryStore(), rate=0.1, burst=1)
+
+        with mock.patch.dict(self.app.extensions,
+                             {'rate_limiter': limiter}):
+            self.client().get('/sets')
+            res = self.client().get('/sets')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(data['success'], False)
+        self.assertTrue(int(res.headers['Retry-After']) > 0)
+
     def test_get_sets_405(self):
         res = self.client().get('/sets/1')
         data = json.loads(res.data)
@@ -212,6 +249,20 @@ class LegoTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(len(data['collectors']))
 
+    def test_get_collectors_detail_columnar(self):
+        res = self.client().get(
+            '/collectors-detail',
+            headers={'Authorization': self.director_token,
+                     'Accept': 'application/vnd.lego.columnar+json'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(
+            data['collectors']['columns'],
+            ['id', 'name', 'location', 'number of sets', 'total pieces',
+             'sets collected'])
+
     def test_get_collectors_405(self):
         res = self.client().get('/collectors/1')
         data = json.loads(res.data)
@@ -282,19 +333,19 @@ class LegoTestCase(unittest.TestCase):
 
     def test_update_collector(self):
         res = self.client().patch(
-            '/collectors/1', json=self.update_collector,
+            '/collectors/{}'.format(self.collector_to_be_updated_id),
+            json=self.update_collector,
             headers={'Authorization': self.director_token})
         data = json.loads(res.data)
 
-        set = Set.query.filter(Set.id == 1).one_or_none()
-
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
         self.assertTrue(data['updated'])
 
     def test_update_collector_manager_401(self):
         res = self.client().patch(
-            '/collectors/1', json=self.update_collector,
+            '/collectors/{}'.format(self.collector_to_be_updated_id),
+            json=self.update_collector,
             headers={'Authorization': self.manager_token})
         data = json.loads(res.data)
 
@@ -314,18 +365,18 @@ class LegoTestCase(unittest.TestCase):
 
     def test_delete_collector(self):
         res = self.client().delete(
-            '/collectors/2', headers={'Authorization': self.director_token})
+            '/collectors/{}'.format(self.collector_to_be_deleted_id),
+            headers={'Authorization': self.director_token})
         data = json.loads(res.data)
 
-        set = Set.query.filter(Set.id == 1).one_or_none()
-
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
         self.assertTrue(data['deleted'])
 
     def test_delete_collector_manager_401(self):
         res = self.client().delete(
-            '/collectors/2', headers={'Authorization': self.manager_token})
+            '/collectors/{}'.format(self.collector_to_be_deleted_id),
+            headers={'Authorization': self.manager_token})
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 401)
@@ -341,6 +392,84 @@ class LegoTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertTrue(data['message'], 'resource not found')
 
+    #  Tests for batch requests
+    #  ----------------------------------------------------------------
+
+    def test_batch(self):
+        res = self.client().post(
+            '/batch', json={'requests': [
+                {'method': 'GET', 'path': '/sets'},
+                {'method': 'PATCH', 'path': '/sets/10295',
+                 'body': self.update_set}
+            ]},
+            headers={'Authorization': self.manager_token})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['committed'], True)
+        self.assertEqual(
+            [result['status'] for result in data['results']], [200, 200])
+
+    def test_batch_checks_each_permission(self):
+        res = self.client().post(
+            '/batch', json={'requests': [
+                {'method': 'POST', 'path': '/collectors',
+                 'body': self.new_collector}
+            ]},
+            headers={'Authorization': self.manager_token})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['results'][0]['status'], 401)
+
+    def test_batch_atomic_rollback(self):
+        res = self.client().post(
+            '/batch', json={'atomic': True, 'requests': [
+                {'method': 'POST', 'path': '/sets', 'body': self.new_set},
+                {'method': 'PATCH', 'path': '/sets/1000',
+                 'body': self.update_set}
+            ]},
+            headers={'Authorization': self.manager_token})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['committed'], False)
+        self.assertEqual(data['results'][1]['status'], 404)
+        self.assertIsNone(Set.query.get(21325))
+
+    def test_batch_takes_one_token_per_operation(self):
+        limiter = RateLimiter(MemoryStore(), rate=0.1, burst=20)
+        operations = [{'method': 'GET', 'path': '/sets'}] * 25 + [
+            {'method': 'PATCH', 'path': '/sets/10295',
+             'body': self.update_set}]
+
+        with mock.patch.dict(self.app.extensions,
+                             {'rate_limiter': limiter}):
+            res = self.client().post(
+                '/batch', json={'atomic': True, 'requests': operations},
+                headers={'Authorization': self.manager_token})
+            data = json.loads(res.data)
+            after = self.client().get(
+                '/sets-detail', headers={'Authorization': self.manager_token})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['committed'], True)
+        self.assertEqual(
+            {result['status'] for result in data['results']}, {200})
+        self.assertEqual(after.status_code, 429)
+
+    def test_batch_401(self):
+        res = self.client().post(
+            '/batch', json={'requests': [{'method': 'GET', 'path': '/sets'}]})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(data['success'], False)
+        self.assertTrue(data['message'], 'unauthorized')
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
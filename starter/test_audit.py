@@ -0,0 +1,143 @@
+import unittest
+from unittest import mock
+
+from audit import AuditLog
+from metrics import Metrics
+from models import Set
+from testing import TransactionalTestCase
+
+
+def audit_metrics():
+    metrics = Metrics()
+    metrics.counter('audit_events_total', 'Audit events.')
+    metrics.counter('audit_flushes_total', 'Audit batches.')
+    return metrics
+
+
+def events(count):
+    return [{'action': 'update', 'resource': 'sets', 'resource_id': id}
+            for id in range(count)]
+
+
+class AuditLogTestCase(unittest.TestCase):
+    """This class represents the audit queue test case"""
+
+    def setUp(self):
+        """Define an audit log whose writes are recorded."""
+        self.metrics = audit_metrics()
+        self.log = AuditLog(None, self.metrics, batch_size=3, max_pending=5,
+                            put_timeout=0.01, flush_interval=0.01)
+        self.written = []
+        self.log.write = lambda batch: self.written.append(list(batch))
+        self.addCleanup(self.log.close)
+
+    def test_writes_in_batches(self):
+        for event in events(5):
+            self.log.queue.put(event)
+
+        while not self.log.queue.empty():
+            self.log.flush(self.log.take())
+
+        self.assertEqual(self.written, [events(5)[:3], events(5)[3:]])
+        self.assertEqual(self.metrics.value('audit_flushes_total'), 2)
+
+    def test_full_queue_writes_directly(self):
+        with mock.patch.object(self.log, 'start'):
+            self.log.publish(events(7))
+
+        self.assertEqual(self.log.queue.qsize(), 5)
+        self.assertEqual(self.written, [events(7)[5:]])
+        self.assertEqual(self.metrics.value(
+            'audit_events_total', outcome='queued'), 5)
+        self.assertEqual(self.metrics.value(
+            'audit_events_total', outcome='direct'), 2)
+
+    def test_close_writes_pending_events(self):
+        self.log.start()
+        with mock.patch.object(self.log, 'write', side_effect=Exception):
+            self.log.stopped.set()
+            self.log.thread.join()
+        for event in events(4):
+            self.log.queue.put(event)
+
+        self.log.close()
+
+        self.assertEqual(self.written, [events(4)[:3], events(4)[3:]])
+        self.assertIsNone(self.log.pid)
+
+    def test_failed_batch_is_retried(self):
+        self.log.write = mock.Mock(side_effect=[Exception, None])
+
+        self.log.flush(events(2))
+
+        self.assertEqual(self.log.write.call_count, 2)
+        self.assertEqual(self.metrics.value('audit_flushes_total'), 1)
+
+
+class AuditTestCase(TransactionalTestCase):
+    """This class represents the audited routes test case"""
+
+    def setUp(self):
+        """Define test variables and initialize app."""
+        super().setUp()
+        patcher = mock.patch.object(
+            self.app.extensions['audit_log'], 'publish')
+        self.publish = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        Set(id=10295, name='Porsche', year='2020', pieces=1458).insert()
+
+    def published(self):
+        return [event for call in self.publish.call_args_list
+                for event in call[0][0]]
+
+    def test_write_is_audited(self):
+        res = self.client().patch(
+            '/sets/10295', headers={'Authorization': self.manager_token},
+            json={'year': '2021', 'pieces': 3000})
+        self.assertEqual(res.status_code, 200)
+
+        [event] = self.published()
+        self.assertEqual(event['subject'], 'auth0|lego-manager')
+        self.assertEqual(
+            (event['action'], event['resource'], event['resource_id']),
+            ('update', 'sets', 10295))
+        self.assertEqual(event['changes'], {'year': '2021', 'pieces': 3000})
+
+    def test_failed_write_is_not_audited(self):
+        res = self.client().delete(
+            '/sets/999999', headers={'Authorization': self.manager_token})
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(self.published(), [])
+
+    def test_batch_publishes_once(self):
+        res = self.client().post(
+            '/batch', headers={'Authorization': self.manager_token},
+            json={'requests': [
+                {'method': 'PATCH', 'path': '/sets/10295',
+                 'body': {'year': '2021'}},
+                {'method': 'DELETE', 'path': '/sets/10295'}
+                ]})
+        self.assertEqual(res.status_code, 200)
+
+        self.assertEqual(self.publish.call_count, 1)
+        self.assertEqual([event['action'] for event in self.published()],
+                         ['update', 'delete'])
+
+    def test_rolled_back_batch_is_not_audited(self):
+        res = self.client().post(
+            '/batch', headers={'Authorization': self.manager_token},
+            json={'atomic': True, 'requests': [
+                {'method': 'PATCH', 'path': '/sets/10295',
+                 'body': {'year': '2021'}},
+                {'method': 'DELETE', 'path': '/sets/999999'}
+                ]})
+        self.assertEqual(res.status_code, 200)
+
+        self.assertEqual(self.published(), [])
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
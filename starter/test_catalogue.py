@@ -0,0 +1,143 @@
+import csv
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from catalogue import (
+    ImportReport,
+    chunked,
+    import_catalogue,
+    parse_collection,
+    parse_set,
+    read_records,
+    stage
+    )
+from models import db, Collector, Set
+from testing import TransactionalTestCase
+
+
+def write_file(directory, name, text):
+    path = os.path.join(directory, name)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return path
+
+
+class CatalogueTestCase(unittest.TestCase):
+    """This class represents the catalogue import test case"""
+
+    def setUp(self):
+        """Define test variables."""
+        self.report = ImportReport()
+
+    def test_parse_set(self):
+        row = parse_set(
+            {'id': '21325', 'name': 'Medieval Blacksmith',
+             'year': '2021', 'pieces': '2164'})
+
+        self.assertEqual(row, (21325, 'Medieval Blacksmith', '2021', 2164))
+
+    def test_parse_collection_without_set(self):
+        row = parse_collection(
+            {'collector_id': 1, 'name': 'Paul', 'location': 'Liverpool',
+             'set_id': ''})
+
+        self.assertEqual(row, (1, 'Paul', 'Liverpool', None))
+
+    def test_stage_rejects_invalid_rows(self):
+        buffer = io.StringIO()
+        records = [
+            {'id': '40469', 'name': 'Tuk Tuk', 'year': '2021',
+             'pieces': '155'},
+            {'id': 'bad', 'name': 'Broken', 'year': '2021', 'pieces': '1'},
+            {'id': '10295', 'name': '', 'year': '2020', 'pieces': '1458'}
+        ]
+
+        rows = list(stage(records, parse_set, self.report,
+                          csv.writer(buffer), 'sets.csv'))
+
+        self.assertEqual(rows, [(1, 40469, 'Tuk Tuk', '2021', 155)])
+        self.assertEqual(self.report.read, 3)
+        self.assertEqual(self.report.staged, 1)
+        self.assertEqual(self.report.rejected, 2)
+        self.assertEqual(len(buffer.getvalue().splitlines()), 2)
+
+    def test_stage_rejects_malformed_ndjson(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = write_file(directory, 'collections.ndjson', (
+            '{"collector_id": 1, "name": "Paul", "location": "Liverpool"}\n'
+            '{"collector_id": 2, "name": "John",\n'
+            '[2, "John", "Liverpool"]\n'
+            '{"collector_id": 3, "name": "Ringo", "location": "Liverpool"}\n'
+            ))
+        buffer = io.StringIO()
+
+        rows = list(stage(read_records(path), parse_collection, self.report,
+                          csv.writer(buffer), 'collections.ndjson'))
+
+        self.assertEqual([row[:2] for row in rows], [(1, 1), (4, 3)])
+        self.assertEqual(self.report.rejected, 2)
+        rejects = list(csv.reader(io.StringIO(buffer.getvalue())))
+        self.assertEqual([reject[:2] for reject in rejects],
+                         [['collections.ndjson', '2'],
+                          ['collections.ndjson', '3']])
+        self.assertEqual(rejects[0][3], '{"collector_id": 2, "name": "John",')
+
+    def test_chunked(self):
+        chunks = list(chunked(iter(range(5)), 2))
+
+        self.assertEqual(chunks, [[0, 1], [2, 3], [4]])
+
+
+class ImportCatalogueTestCase(TransactionalTestCase):
+    """This class represents the catalogue merge test case"""
+
+    def setUp(self):
+        """Define the files of an import."""
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        Set(id=94001, name='Old Name', year='2020', pieces=10).insert()
+
+    def test_import_merges_into_the_tables(self):
+        sets = write_file(self.directory, 'sets.csv', (
+            'id,name,year,pieces\n'
+            '94001,Lighthouse,2021,500\n'
+            '94002,Tuk Tuk,2021,155\n'
+            '94001,Lighthouse Island,2021,510\n'))
+        collections = write_file(self.directory, 'collections.ndjson', (
+            '{"collector_id": 94101, "name": "Paul", '
+            '"location": "Liverpool", "set_id": 94001}\n'
+            '{"collector_id": 94101, "name": "Paul", '
+            '"location": "Liverpool", "set_id": 94002}\n'
+            '{"collector_id": 94102, "name": "John", '
+            '"location": "Liverpool", "set_id": 94999}\n'
+            'not json\n'))
+        rejects = os.path.join(self.directory, 'rejects.csv')
+
+        report = import_catalogue(sets, collections, chunk_size=2,
+                                  rejects_path=rejects, session=db.session)
+
+        self.assertEqual((report.read, report.rejected), (7, 2))
+        self.assertEqual(report.merged,
+                         {'sets': 2, 'collectors': 2, 'collection': 2})
+        self.assertEqual(Set.query.get(94001).name, 'Lighthouse Island')
+        self.assertEqual(
+            sorted(set.id for set in Collector.query.get(94101).legos),
+            [94001, 94002])
+        self.assertEqual(Collector.query.get(94102).legos, [])
+        with open(rejects, newline='', encoding='utf-8') as f:
+            self.assertEqual(
+                [(row['file'], row['line'], row['reason'])
+                 for row in csv.DictReader(f)],
+                [(collections, '4', 'Expecting value: line 1 column 1 '
+                  '(char 0)'),
+                 (collections, '3', 'unknown set 94999')])
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
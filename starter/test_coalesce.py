@@ -0,0 +1,127 @@
+import time
+import unittest
+from threading import Event, Thread
+from flask import Flask, jsonify, request
+
+from coalesce import SingleFlight, coalesce, init_coalescing
+
+
+class SingleFlightTestCase(unittest.TestCase):
+    """This class represents the request coalescing test case"""
+
+    def setUp(self):
+        """Define a single flight group."""
+        self.flight = SingleFlight()
+
+    def test_concurrent_calls_share_result(self):
+        started = Event()
+        release = Event()
+        calls = []
+        results = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return b'payload'
+
+        def leader():
+            results.append(self.flight.do('/sets', compute))
+
+        def follower():
+            results.append(self.flight.do('/sets', compute))
+
+        threads = [Thread(target=leader)]
+        threads[0].start()
+        started.wait()
+        threads += [Thread(target=follower) for _ in range(4)]
+        for thread in threads[1:]:
+            thread.start()
+        # give the followers time to join the call in flight
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(result == b'payload' for result, _ in results))
+        self.assertEqual(sum(shared for _, shared in results), 4)
+
+    def test_sequential_calls_are_not_shared(self):
+        self.assertEqual(self.flight.do('/sets', lambda: 1), (1, False))
+        self.assertEqual(self.flight.do('/sets', lambda: 2), (2, False))
+        self.assertEqual(self.flight.calls, {})
+
+    def test_error_is_raised(self):
+        def fail():
+            raise ValueError('boom')
+
+        with self.assertRaises(ValueError):
+            self.flight.do('/sets', fail)
+
+        self.assertEqual(self.flight.calls, {})
+
+
+class CoalesceRouteTestCase(unittest.TestCase):
+    """This class represents the coalesced route test case"""
+
+    def setUp(self):
+        """Define an app with a coalesced route that blocks."""
+        self.app = Flask(__name__)
+        init_coalescing(self.app)
+        self.started = Event()
+        self.release = Event()
+        self.queries = []
+
+        @self.app.route('/items')
+        @coalesce
+        def items():
+            self.queries.append(request.full_path)
+            self.started.set()
+            self.release.wait()
+            return jsonify({'queries': len(self.queries),
+                            'accept': request.headers.get('Accept', '')})
+
+    def get_all(self, requests):
+        responses = [None] * len(requests)
+
+        def get(index, path, accept):
+            responses[index] = self.app.test_client().get(
+                path, headers={'Accept': accept})
+
+        threads = [Thread(target=get, args=(index, path, accept))
+                   for index, (path, accept) in enumerate(requests)]
+        threads[0].start()
+        self.started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        # give the other requests time to join the query in flight
+        time.sleep(0.2)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return responses
+
+    def test_identical_requests_share_one_query(self):
+        responses = self.get_all([('/items', 'application/json')] * 5)
+
+        self.assertEqual(len(self.queries), 1)
+        self.assertEqual({res.status_code for res in responses}, {200})
+        self.assertEqual({res.data for res in responses},
+                         {responses[0].data})
+
+    def test_path_and_accept_are_part_of_the_key(self):
+        responses = self.get_all([('/items', 'application/json'),
+                                  ('/items?page=2', 'application/json'),
+                                  ('/items', 'text/csv'),
+                                  ('/items', 'application/json')])
+
+        self.assertEqual(len(self.queries), 3)
+        self.assertEqual(responses[0].data, responses[3].data)
+        self.assertEqual(responses[2].get_json()['accept'], 'text/csv')
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+import unittest
+import json
+
+from bitmap import Bitmap
+from models import Collector, Set
+from testing import TransactionalTestCase
+
+
+class BitmapTestCase(unittest.TestCase):
+    """This class represents the bitmap test case"""
+
+    def setUp(self):
+        """Define one sparse and one dense bitmap."""
+        self.sparse = set(range(0, 200000, 7))
+        self.dense = set(range(60000, 140000))
+
+    def test_bitmap_round_trip(self):
+        bitmap = Bitmap(self.dense)
+
+        self.assertEqual(list(bitmap), sorted(self.dense))
+        self.assertEqual(len(bitmap), len(self.dense))
+        self.assertIn(70000, bitmap)
+        self.assertNotIn(140000, bitmap)
+
+    def test_bitmap_operations(self):
+        a, b = Bitmap(self.sparse), Bitmap(self.dense)
+
+        self.assertEqual(list(a & b), sorted(self.sparse & self.dense))
+        self.assertEqual(list(a | b), sorted(self.sparse | self.dense))
+        self.assertEqual(list(a - b), sorted(self.sparse - self.dense))
+        self.assertEqual(list(b - a), sorted(self.dense - self.sparse))
+
+    def test_bitmap_is_compact(self):
+        self.assertTrue(Bitmap(self.dense).nbytes <= 3 * 8192)
+        self.assertEqual(Bitmap([1, 2, 3]).nbytes, 6)
+
+
+class CollectionIndexTestCase(TransactionalTestCase):
+    """This class represents the collection set algebra test case"""
+
+    def setUp(self):
+        """Define test variables and initialize app."""
+        super().setUp()
+        self.app.extensions['collection_index'].reset()
+
+        sets = {}
+        for id in range(80001, 80005):
+            sets[id] = Set(
+                id=id, name='Set {}'.format(id), year='2021', pieces=100)
+            sets[id].insert()
+
+        self.collectors = []
+        for name, location, owned in (
+                ('Paul', 'Liverpool', [80001, 80002, 80003]),
+                ('John', 'Liverpool', [80002, 80003, 80004]),
+                ('Murat', 'Fremont', [80003])):
+            collector = Collector(
+                name=name, location=location,
+                legos=[sets[id] for id in owned])
+            collector.insert()
+            self.collectors.append(collector.id)
+
+    def get(self, path):
+        res = self.client().get(
+            path, headers={'Authorization': self.manager_token})
+        return res, json.loads(res.data)
+
+    def test_intersection_by_location(self):
+        res, data = self.get('/collections/intersection?location=Liverpool')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['collectors'], self.collectors[:2])
+        self.assertEqual(data['sets'], [80002, 80003])
+
+    def test_union(self):
+        res, data = self.get('/collections/union?collectors={},{}'.format(
+            self.collectors[0], self.collectors[2]))
+
+        self.assertEqual(data['sets'], [80001, 80002, 80003])
+        self.assertEqual(data['count'], 3)
+
+    def test_difference(self):
+        res, data = self.get(
+            '/collections/difference?collectors={},{}'.format(
+                self.collectors[0], self.collectors[1]))
+
+        self.assertEqual(data['sets'], [80001])
+
+    def test_overlap(self):
+        res, data = self.get('/collections/overlap?collectors={},{},{}'.format(
+            *self.collectors))
+
+        self.assertEqual(
+            [pair['count'] for pair in data['overlap']], [2, 1, 1])
+
+    def test_index_follows_writes(self):
+        self.get('/collections/union?collectors={}'.format(
+            self.collectors[2]))
+
+        collector = Collector.query.get(self.collectors[2])
+        collector.legos = []
+        collector.update()
+
+        self.app.extensions['collection_index'].sync_interval = 0
+        try:
+            res, data = self.get('/collections/union?collectors={}'.format(
+                self.collectors[2]))
+        finally:
+            self.app.extensions['collection_index'].sync_interval = 1.0
+
+        self.assertEqual(data['sets'], [])
+
+    def test_collection_algebra_404(self):
+        res, data = self.get(
+            '/collections/union?collectors=999999998,999999999')
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_collection_algebra_422(self):
+        res, data = self.get('/collections/union?collectors=a')
+
+        self.assertEqual(res.status_code, 422)
+
+    def test_collection_algebra_401(self):
+        res = self.client().get('/collections/union?collectors=1')
+
+        self.assertEqual(res.status_code, 401)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+import json
+
+from counters import repair_counters
+from models import db, collection, Collector, Set
+from testing import TransactionalTestCase
+
+
+class CountersTestCase(TransactionalTestCase):
+    """This class represents the collection counters test case"""
+
+    def setUp(self):
+        """Define test variables and initialize app."""
+        super().setUp()
+
+        self.sets = []
+        for id, pieces in ((60001, 100), (60002, 250), (60003, 1000)):
+            set = Set(id=id, name='Set {}'.format(id), year='2021',
+                      pieces=pieces)
+            set.insert()
+            self.sets.append(set)
+
+        self.collector = Collector(
+            name='Paul', location='Liverpool', legos=self.sets[:2])
+        self.collector.insert()
+        Collector(
+            name='John', location='Liverpool', legos=self.sets[1:2]).insert()
+
+    def test_counters_follow_inserts(self):
+        self.assertEqual(
+            [set.collector_count for set in self.sets], [1, 2, 0])
+        self.assertEqual(self.collector.set_count, 2)
+        self.assertEqual(self.collector.total_pieces, 350)
+
+    def test_counters_follow_deletes(self):
+        self.collector.legos = self.sets[2:]
+        self.collector.update()
+
+        self.assertEqual(
+            [set.collector_count for set in self.sets], [0, 1, 1])
+        self.assertEqual(self.collector.set_count, 1)
+        self.assertEqual(self.collector.total_pieces, 1000)
+
+    def test_total_pieces_follow_set_updates(self):
+        self.sets[0].pieces = 150
+        self.sets[0].update()
+
+        self.assertEqual(self.collector.total_pieces, 400)
+
+    def test_repair_counters(self):
+        db.session.execute(
+            'ALTER TABLE collection DISABLE TRIGGER USER')
+        db.session.execute(collection.delete().where(
+            collection.c.collector_id == self.collector.id))
+        db.session.execute(
+            'ALTER TABLE collection ENABLE TRIGGER USER')
+
+        repaired = repair_counters(db.session)
+        db.session.commit()
+
+        self.assertEqual(repaired, {'sets': 2, 'collectors': 1})
+        self.assertEqual(self.collector.set_count, 0)
+        self.assertEqual(self.collector.total_pieces, 0)
+        self.assertEqual(
+            [set.collector_count for set in self.sets], [0, 1, 0])
+
+    def test_sort_by_popularity(self):
+        res = self.client().get('/sets?sort=popularity')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['sets'][0]['set number'], 60002)
+        self.assertEqual(data['sets'][0]['number of collectors'], 2)
+
+    def test_sort_422(self):
+        res = self.client().get('/collectors?sort=name')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
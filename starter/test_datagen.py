@@ -0,0 +1,42 @@
+import unittest
+
+from datagen import Generator
+
+
+class GeneratorTestCase(unittest.TestCase):
+    """This class represents the synthetic data test case"""
+
+    def setUp(self):
+        """Define a seeded generator."""
+        self.generator = Generator(seed=7)
+
+    def test_same_seed_same_data(self):
+        other = Generator(seed=7)
+
+        self.assertEqual(
+            list(self.generator.sets(1, 50)), list(other.sets(1, 50)))
+        self.assertEqual(
+            list(self.generator.collection(range(1, 50), range(1, 200))),
+            list(other.collection(range(1, 50), range(1, 200))))
+
+    def test_collection_links_are_unique_and_in_range(self):
+        links = list(self.generator.collection(range(1, 200), range(10, 60)))
+
+        self.assertEqual(len(links), len(set(links)))
+        self.assertTrue(all(1 <= collector_id < 200 and 10 <= set_id < 60
+                            for collector_id, set_id in links))
+
+    def test_collection_sizes_are_skewed(self):
+        sizes = {}
+        for collector_id, _ in self.generator.collection(
+                range(2000), range(100000)):
+            sizes[collector_id] = sizes.get(collector_id, 0) + 1
+
+        ordered = sorted(sizes.values())
+        self.assertEqual(ordered[len(ordered) // 2], 1)
+        self.assertTrue(ordered[-1] > 100)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
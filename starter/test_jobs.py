@@ -0,0 +1,188 @@
+import csv
+import io
+import json
+import unittest
+from unittest import mock
+from urllib.parse import urlparse
+
+from models import db, audit_log, Collector, Job, Set
+from testing import MANAGER_PERMISSIONS, TransactionalTestCase, mint_token
+
+
+class JobsTestCase(TransactionalTestCase):
+    """This class represents the background jobs test case"""
+
+    def setUp(self):
+        """Define test variables and initialize app."""
+        super().setUp()
+
+        self.queue = self.app.extensions['job_queue']
+        self.sets = [Set(id=id, name='Set {}'.format(id), year='2021',
+                         pieces=100)
+                     for id in (91001, 91002)]
+        for set in self.sets:
+            set.insert()
+        Collector(name='Paul', location='Liverpool', legos=self.sets).insert()
+        Collector(name='Ringo', location='Liverpool', legos=[]).insert()
+
+    def submit(self, token, **body):
+        return self.client().post(
+            '/jobs', json=body, headers={'Authorization': token})
+
+    def get(self, path, token):
+        return self.client().get(path, headers={'Authorization': token})
+
+    def test_export_sets(self):
+        res = self.submit(self.manager_token, kind='export-sets')
+        data = json.loads(res.data)
+        job_id = data['job']['id']
+
+        self.assertEqual(res.status_code, 202)
+        self.assertEqual(data['job']['status'], 'queued')
+        self.assertEqual(urlparse(res.headers['Location']).path,
+                         '/jobs/{}'.format(job_id))
+
+        self.assertEqual(self.queue.run_next(), job_id)
+        self.assertIsNone(self.queue.run_next())
+
+        res = self.get('/jobs/{}'.format(job_id), self.manager_token)
+        job = json.loads(res.data)['job']
+
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertEqual(job['progress'], Set.query.count())
+        self.assertEqual(job['result'], {'rows': Set.query.count()})
+
+        res = self.get('/jobs/{}/result'.format(job_id), self.manager_token)
+        rows = list(csv.DictReader(io.StringIO(res.data.decode())))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'text/csv')
+        self.assertIn({'id': '91001', 'name': 'Set 91001', 'year': '2021',
+                       'pieces': '100'}, rows)
+
+    def test_export_collections_ndjson(self):
+        res = self.submit(self.manager_token, kind='export-collections',
+                          format='ndjson')
+        job_id = json.loads(res.data)['job']['id']
+        self.queue.run_next()
+
+        res = self.get('/jobs/{}/result'.format(job_id), self.manager_token)
+        rows = [json.loads(line) for line in res.data.splitlines()]
+        owned = {(row['name'], row['set_id']) for row in rows}
+
+        self.assertTrue({('Paul', 91001), ('Paul', 91002), ('Ringo', None)}
+                        <= owned)
+
+    def test_files_are_stored_in_chunks(self):
+        res = self.submit(self.manager_token, kind='export-sets')
+        job_id = json.loads(res.data)['job']['id']
+        with mock.patch('jobs.FILE_CHUNK_SIZE', 16):
+            self.queue.run_next()
+
+        chunks = db.session.execute(
+            'SELECT count(*) FROM job_file_chunks WHERE job_id = :id',
+            {'id': job_id}).scalar()
+        res = self.get('/jobs/{}/result'.format(job_id), self.manager_token)
+
+        self.assertGreater(chunks, 1)
+        self.assertTrue(res.is_streamed)
+        self.assertEqual(int(res.headers['Content-Length']), len(res.data))
+        self.assertIn(b'91001,Set 91001,2021,100', res.data)
+
+    def test_submit_requires_permissions(self):
+        res = self.client().post(
+            '/jobs', headers={'Authorization': self.manager_token},
+            data={'kind': 'import-catalogue',
+                  'sets': (io.BytesIO(b'id,name,year,pieces\n'), 'sets.csv')})
+
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(Job.query.count(), 0)
+
+    def test_submit_import(self):
+        res = self.client().post(
+            '/jobs', headers={'Authorization': self.director_token},
+            data={'kind': 'import-catalogue',
+                  'sets': (io.BytesIO(b'{"id": 1}\n'), 'sets.ndjson')})
+        data = json.loads(res.data)
+        job = Job.query.get(data['job']['id'])
+
+        self.assertEqual(res.status_code, 202)
+        self.assertEqual(job.params, {'files': {'sets': '.ndjson'}})
+        self.assertEqual(job.owner, 'auth0|lego-director')
+
+    def test_run_import(self):
+        sets = (b'id,name,year,pieces\n'
+                b'91003,Tuk Tuk,2021,155\n'
+                b'bad,Broken,2021,1\n')
+        collections = (b'{"collector_id": 93001, "name": "John", '
+                       b'"location": "Liverpool", "set_id": 91003}\n')
+        res = self.client().post(
+            '/jobs', headers={'Authorization': self.director_token},
+            data={'kind': 'import-catalogue',
+                  'sets': (io.BytesIO(sets), 'new-sets.csv'),
+                  'collections': (io.BytesIO(collections), 'owners.ndjson')})
+        job_id = json.loads(res.data)['job']['id']
+
+        self.assertEqual(self.queue.run_next(), job_id)
+
+        res = self.get('/jobs/{}'.format(job_id), self.director_token)
+        job = json.loads(res.data)['job']
+
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertEqual(job['result'], {
+            'read': 3, 'rejected': 1,
+            'merged': {'sets': 1, 'collectors': 1, 'collection': 1}})
+        self.assertEqual(Set.query.get(91003).name, 'Tuk Tuk')
+        self.assertEqual([set.id for set in Collector.query.get(93001).legos],
+                         [91003])
+
+        res = self.get('/jobs/{}/result'.format(job_id), self.director_token)
+        rejects = list(csv.DictReader(io.StringIO(res.data.decode())))
+
+        self.assertEqual([(row['file'], row['line']) for row in rejects],
+                         [('new-sets.csv', '2')])
+
+        event = db.session.execute(
+            audit_log.select().where(audit_log.c.resource == 'jobs')
+            .where(audit_log.c.resource_id == job_id)).fetchone()
+        self.assertEqual(
+            (event.subject, event.action, event.changes),
+            ('auth0|lego-director', 'import',
+             {'sets': 1, 'collectors': 1, 'collection': 1}))
+
+    def test_submit_unprocessable(self):
+        res = self.submit(self.manager_token, kind='export-everything')
+        self.assertEqual(res.status_code, 422)
+
+        res = self.submit(self.manager_token, kind='export-sets',
+                          format='xml')
+        self.assertEqual(res.status_code, 422)
+
+    def test_jobs_of_other_subjects_are_hidden(self):
+        res = self.submit(self.manager_token, kind='export-sets')
+        job_id = json.loads(res.data)['job']['id']
+        other = mint_token(MANAGER_PERMISSIONS, sub='auth0|lego-other')
+
+        res = self.get('/jobs/{}'.format(job_id), other)
+        self.assertEqual(res.status_code, 404)
+
+        res = self.get('/jobs/{}/result'.format(job_id), self.manager_token)
+        self.assertEqual(res.status_code, 404)
+
+    def test_lost_jobs_are_retried(self):
+        res = self.submit(self.manager_token, kind='export-sets')
+        job_id = json.loads(res.data)['job']['id']
+        lost = "UPDATE jobs SET status = 'running', attempts = :attempts, " \
+            "heartbeat_at = now() - interval '1 hour' WHERE id = :id"
+
+        db.session.execute(lost, {'attempts': 1, 'id': job_id})
+        self.assertEqual(self.queue.claim().id, job_id)
+
+        db.session.execute(lost, {'attempts': 3, 'id': job_id})
+        self.assertIsNone(self.queue.claim())
+        self.assertEqual(Job.query.get(job_id).status, 'failed')
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import multiprocessing
+import shutil
+import tempfile
+import unittest
+
+from metrics import Metrics
+from testing import METRICS_TOKEN, TransactionalTestCase
+
+
+def worker_metrics():
+    metrics = Metrics()
+    metrics.counter('jobs_total', 'Jobs.')
+    metrics.histogram('job_seconds', 'Job time.', buckets=(0.1, 1.0))
+    return metrics
+
+
+def run_jobs(metrics):
+    metrics.inc('jobs_total', 2, queue='slow')
+    metrics.observe('job_seconds', 0.5, queue='slow')
+    metrics.observe('job_seconds', 3.0, queue='slow')
+
+
+class MetricsTestCase(unittest.TestCase):
+    """This class represents the metrics registry test case"""
+
+    def setUp(self):
+        """Define a registry with a counter and a histogram."""
+        self.metrics = worker_metrics()
+
+    def test_histogram_buckets_are_cumulative(self):
+        run_jobs(self.metrics)
+        self.metrics.observe('job_seconds', 0.1, queue='slow')
+
+        lines = self.metrics.render().splitlines()
+
+        for line in ('job_seconds_bucket{queue="slow",le="0.1"} 1',
+                     'job_seconds_bucket{queue="slow",le="1.0"} 2',
+                     'job_seconds_bucket{queue="slow",le="+Inf"} 3',
+                     'job_seconds_sum{queue="slow"} 3.6',
+                     'job_seconds_count{queue="slow"} 3',
+                     'jobs_total{queue="slow"} 2'):
+            self.assertIn(line, lines)
+
+    def test_forked_workers_are_merged(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.metrics.share(directory)
+
+        context = multiprocessing.get_context('fork')
+        for _ in range(2):
+            worker = context.Process(target=run_jobs, args=(self.metrics,))
+            worker.start()
+            worker.join()
+            self.assertEqual(worker.exitcode, 0)
+        self.metrics.inc('jobs_total', queue='slow')
+
+        lines = self.metrics.render().splitlines()
+
+        self.assertIn('jobs_total{queue="slow"} 5', lines)
+        self.assertIn('job_seconds_bucket{queue="slow",le="1.0"} 2', lines)
+        self.assertIn('job_seconds_count{queue="slow"} 4', lines)
+        self.assertEqual(self.metrics.value('jobs_total', queue='slow'), 1)
+
+
+class RequestMetricsTestCase(TransactionalTestCase):
+    """This class represents the request metrics test case"""
+
+    def test_requests_are_timed(self):
+        metrics = self.app.extensions['metrics']
+        labels = {'endpoint': 'get_sets', 'method': 'GET'}
+        before = metrics.value('http_request_duration_seconds_count',
+                               **labels)
+
+        res = self.client().get('/sets')
+        self.assertEqual(res.status_code, 200)
+
+        self.assertEqual(
+            metrics.value('http_request_duration_seconds_count', **labels),
+            before + 1)
+        res = self.client().get(
+            '/metrics', headers={'Authorization': 'Bearer ' + METRICS_TOKEN})
+        self.assertIn(
+            'http_request_duration_seconds_bucket{endpoint="get_sets",'
+            'method="GET",le="+Inf"}', res.get_data(as_text=True))
+
+    def test_metrics_require_the_token(self):
+        for headers in ({}, {'Authorization': 'Bearer wrong'},
+                        {'Authorization': self.director_token}):
+            res = self.client().get('/metrics', headers=headers)
+            self.assertEqual(res.status_code, 401)
+
+        self.app.config['METRICS_TOKEN'] = None
+        self.addCleanup(self.app.config.update, METRICS_TOKEN=METRICS_TOKEN)
+        res = self.client().get(
+            '/metrics', headers={'Authorization': 'Bearer ' + METRICS_TOKEN})
+        self.assertEqual(res.status_code, 401)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+import json
+import unittest
+from unittest import mock
+
+from models import db, Collector, Set
+from payloads import (
+    DISABLE_PAYLOADS,
+    PayloadTriggers,
+    payloads_installed,
+    rebuild_payloads,
+    sync_payloads
+    )
+from testing import TransactionalTestCase
+
+
+class PayloadsTestCase(TransactionalTestCase):
+    """This class represents the materialized payloads test case"""
+
+    def setUp(self):
+        """Define test variables and initialize app."""
+        super().setUp()
+        sync_payloads(db.session, True)
+
+        self.sets = [Set(id=id, name='Set {}'.format(id), year='2021',
+                         pieces=100 * index)
+                     for index, id in enumerate(range(91001, 91004), start=1)]
+        for set in self.sets:
+            set.insert()
+
+        self.collectors = [
+            Collector(name=name, location='Liverpool', legos=owned)
+            for name, owned in (('Paul', self.sets[:2]),
+                                ('John', self.sets[1:2]))]
+        for collector in self.collectors:
+            collector.insert()
+
+    def get(self, path, materialized):
+        with mock.patch.dict(
+                self.app.config, {'MATERIALIZED_PAYLOADS': materialized}):
+            res = self.client().get(
+                path, headers={'Authorization': self.manager_token})
+        self.assertEqual(res.status_code, 200)
+        return json.loads(res.data)
+
+    def assertSameListing(self, path, key, ordered=False):
+        def rows(data):
+            # the ORM loads the names and sets of a row in no set order
+            for row in data[key]:
+                for field in ('collectors', 'sets collected'):
+                    if field in row:
+                        row[field] = sorted(row[field])
+            return data[key] if ordered else sorted(data[key], key=repr)
+
+        self.assertEqual(rows(self.get(path, True)),
+                         rows(self.get(path, False)))
+
+    def assertSamePayloads(self):
+        self.assertSameListing('/sets-detail', 'sets')
+        self.assertSameListing('/collectors-detail', 'collectors')
+        self.assertSameListing(
+            '/sets-detail?sort=popularity', 'sets', ordered=True)
+        self.assertSameListing(
+            '/collectors-detail?sort=popularity', 'collectors', ordered=True)
+
+    def test_payloads_match_database(self):
+        self.assertSamePayloads()
+
+        data = self.get('/sets-detail?sort=popularity', True)
+        self.assertEqual(data['sets'][0]['set number'], 91002)
+        self.assertEqual(data['sets'][0]['collectors'], ['Paul', 'John'])
+
+    def test_payloads_follow_writes(self):
+        paul, john = self.collectors
+        paul.name = 'Ringo'
+        paul.legos = self.sets[1:]
+        paul.update()
+        self.sets[1].pieces = 5000
+        self.sets[1].update()
+        john.delete()
+
+        self.assertSamePayloads()
+
+        data = self.get('/sets-detail?sort=popularity', True)
+        self.assertEqual(data['sets'][0]['collectors'], ['Ringo'])
+
+    def test_triggers_are_looked_up_once_per_interval(self):
+        triggers = PayloadTriggers(check_interval=60)
+
+        with mock.patch.dict(self.app.extensions,
+                             {'payload_triggers': triggers}), \
+                mock.patch('payloads.payloads_installed',
+                           wraps=payloads_installed) as lookup:
+            self.get('/sets-detail', True)
+            self.get('/collectors-detail', True)
+
+        self.assertEqual(lookup.call_count, 1)
+        self.assertTrue(triggers.installed)
+
+    def test_rebuild_payloads(self):
+        db.session.execute(DISABLE_PAYLOADS)
+        self.collectors[0].name = 'Ringo'
+        self.collectors[0].update()
+
+        data = self.get('/collectors-detail', True)
+        self.assertIn('Paul', [row['name'] for row in data['collectors']])
+
+        rebuild_payloads(db.session)
+
+        self.assertSamePayloads()
+
+    def test_turned_off_payloads_are_not_written(self):
+        self.assertTrue(sync_payloads(db.session, False))
+        self.assertFalse(payloads_installed(db.session))
+        self.assertFalse(rebuild_payloads(db.session))
+
+        self.sets[0].pieces = 5000
+        self.sets[0].update()
+        count = db.session.execute(
+            'SELECT count(*) FROM set_payloads').scalar()
+        self.assertEqual(count, 0)
+
+        # the ORM answers while the triggers are missing
+        data = self.get('/sets-detail', True)
+        self.assertIn(5000, [row['number of pieces'] for row in data['sets']])
+
+        self.assertFalse(sync_payloads(db.session, False))
+        self.assertTrue(sync_payloads(db.session, True))
+        self.assertTrue(payloads_installed(db.session))
+        self.assertSamePayloads()
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+import unittest
+from unittest import mock
+from flask import Flask
+
+from ratelimit import (
+    MemoryStore,
+    RateLimiter,
+    RateLimitExceeded,
+    init_rate_limiter,
+    rate_limit,
+    rate_limit_key
+    )
+
+
+class RateLimitTestCase(unittest.TestCase):
+    """This class represents the token bucket test case"""
+
+    def setUp(self):
+        """Define a limiter with a small bucket."""
+        self.clock = mock.patch('ratelimit.monotonic', return_value=100.0)
+        self.now = self.clock.start()
+        self.limiter = RateLimiter(MemoryStore(), rate=1.0, burst=2)
+
+    def tearDown(self):
+        """Executed after each test"""
+        self.clock.stop()
+
+    def test_allows_burst(self):
+        self.limiter.check('sub:a')
+        self.limiter.check('sub:a')
+
+        with self.assertRaises(RateLimitExceeded) as raised:
+            self.limiter.check('sub:a')
+
+        self.assertEqual(raised.exception.retry_after_seconds, 1)
+
+    def test_refills_over_time(self):
+        self.limiter.check('sub:a')
+        self.limiter.check('sub:a')
+
+        self.now.return_value = 101.0
+
+        self.limiter.check('sub:a')
+
+    def test_batch_leaves_the_bucket_in_debt(self):
+        self.limiter.check('sub:a', cost=5)
+
+        self.now.return_value = 103.0
+
+        with self.assertRaises(RateLimitExceeded) as raised:
+            self.limiter.check('sub:a')
+
+        self.assertEqual(raised.exception.retry_after_seconds, 1)
+
+    def test_keys_are_independent(self):
+        self.limiter.check('sub:a')
+        self.limiter.check('sub:a')
+
+        self.limiter.check('ip:127.0.0.1')
+
+    def test_evicts_least_recently_used_bucket(self):
+        store = MemoryStore(max_keys=2)
+        store.consume('a', 1.0, 2)
+        store.consume('b', 1.0, 2)
+        store.consume('a', 1.0, 2)
+
+        store.consume('c', 1.0, 2)
+
+        self.assertEqual(list(store.buckets), ['a', 'c'])
+
+    def test_disabled(self):
+        limiter = RateLimiter(MemoryStore(), rate=1.0, burst=1, enabled=False)
+
+        for _ in range(5):
+            limiter.check('sub:a')
+
+
+class ClientAddressTestCase(unittest.TestCase):
+    """This class represents the client address test case"""
+
+    def create_app(self, hops):
+        app = Flask(__name__)
+        app.config.update(RATELIMIT_RATE=0.001, RATELIMIT_BURST=1,
+                          TRUSTED_PROXY_HOPS=hops)
+        init_rate_limiter(app)
+
+        @app.route('/')
+        @rate_limit
+        def index():
+            return rate_limit_key()
+
+        @app.errorhandler(RateLimitExceeded)
+        def rate_limited(error):
+            return 'rate limited', 429
+
+        return app.test_client()
+
+    def get(self, client, forwarded_for):
+        return client.get('/', headers={'X-Forwarded-For': forwarded_for})
+
+    def test_clients_behind_the_router_have_their_own_bucket(self):
+        client = self.create_app(hops=1)
+
+        res = self.get(client, '203.0.113.7')
+        self.assertEqual(res.data, b'ip:203.0.113.7')
+        self.assertEqual(self.get(client, '198.51.100.4').status_code, 200)
+        self.assertEqual(self.get(client, '203.0.113.7').status_code, 429)
+
+    def test_addresses_added_by_the_client_are_ignored(self):
+        client = self.create_app(hops=1)
+
+        res = self.get(client, '192.0.2.1, 203.0.113.7')
+
+        self.assertEqual(res.data, b'ip:203.0.113.7')
+
+    def test_settings_from_the_environment(self):
+        app = Flask(__name__)
+        app.config.update(RATELIMIT_ENABLED='false', RATELIMIT_RATE='5',
+                          RATELIMIT_BURST='50')
+        init_rate_limiter(app)
+
+        limiter = app.extensions['rate_limiter']
+        self.assertEqual(
+            (limiter.enabled, limiter.rate, limiter.burst),
+            (False, 5.0, 50.0))
+
+    def test_no_trusted_proxies(self):
+        client = self.create_app(hops=0)
+
+        res = self.get(client, '203.0.113.7')
+
+        self.assertEqual(res.data, b'ip:127.0.0.1')
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+import unittest
+import json
+
+from models import db, collection, Collector, Set
+from recommendations import (
+    co_occurrence,
+    np,
+    refresh_recommendations
+    )
+from testing import TransactionalTestCase
+
+
+class RecommendationsTestCase(TransactionalTestCase):
+    """This class represents the recommendations test case"""
+
+    def setUp(self):
+        """Define test variables and initialize app."""
+        super().setUp()
+
+        self.sets = {}
+        for id in range(70001, 70006):
+            self.sets[id] = Set(
+                id=id, name='Set {}'.format(id), year='2021', pieces=100)
+            self.sets[id].insert()
+
+        # 70001 and 70002 are owned together most often
+        self.collectors = []
+        for name, owned in (('Paul', [70001, 70002, 70003]),
+                            ('John', [70001, 70002]),
+                            ('George', [70001, 70004]),
+                            ('Ringo', [70002])):
+            collector = Collector(
+                name=name, location='Liverpool',
+                legos=[self.sets[id] for id in owned])
+            collector.insert()
+            self.collectors.append(collector.id)
+
+        self.refreshed = refresh_recommendations(db.session)
+
+    def test_refresh_recommendations(self):
+        self.assertEqual(self.refreshed, 4)
+
+        res = self.client().get('/sets/70001/recommendations')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(
+            [set['set number'] for set in data['recommendations']],
+            [70002, 70003, 70004])
+
+    def test_refresh_rescores_co_owned_sets(self):
+        ringo = Collector.query.get(self.collectors[3])
+        ringo.legos.append(self.sets[70005])
+        ringo.update()
+
+        self.assertEqual(refresh_recommendations(db.session), 2)
+
+        res = self.client().get('/sets/70002/recommendations')
+        data = json.loads(res.data)
+
+        self.assertIn(
+            70005,
+            [set['set number'] for set in data['recommendations']])
+
+    def test_recommendations_limit(self):
+        res = self.client().get('/sets/70001/recommendations?limit=1')
+        data = json.loads(res.data)
+
+        self.assertEqual(len(data['recommendations']), 1)
+
+    def test_recommendations_limit_422(self):
+        res = self.client().get('/sets/70001/recommendations?limit=1000')
+
+        self.assertEqual(res.status_code, 422)
+
+    def test_set_recommendations_404(self):
+        res = self.client().get('/sets/1/recommendations')
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_collector_recommendations(self):
+        res = self.client().get(
+            '/collectors/{}/recommendations'.format(self.collectors[1]),
+            headers={'Authorization': self.manager_token})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            [set['set number'] for set in data['recommendations']],
+            [70003, 70004])
+
+    def test_collector_recommendations_401(self):
+        res = self.client().get(
+            '/collectors/{}/recommendations'.format(self.collectors[1]))
+
+        self.assertEqual(res.status_code, 401)
+
+    @unittest.skipIf(np is None, 'needs numpy and scipy')
+    def test_rebuild_matches_refresh(self):
+        links = db.session.execute(
+            collection.select().where(collection.c.set_id >= 70001)
+            ).fetchall()
+        collector_ids = np.array([link[0] for link in links])
+        set_ids = np.array([link[1] for link in links])
+
+        rebuilt = {
+            set_id: (related, [round(score, 4) for score in scores])
+            for set_id, related, scores in co_occurrence(
+                collector_ids, set_ids, block_size=2)}
+        refreshed = {
+            set_id: (related, [round(score, 4) for score in scores])
+            for set_id, related, scores in db.session.execute(
+                'SELECT set_id, related_ids, scores '
+                'FROM set_recommendations WHERE set_id >= 70001')}
+
+        self.assertEqual(rebuilt, refreshed)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,176 @@
+import json
+import unittest
+from unittest import mock
+
+from models import db, Set
+from resilience import CircuitBreaker, ServiceUnavailable
+from testing import METRICS_TOKEN, TransactionalTestCase
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTestCase(unittest.TestCase):
+    """This class represents the circuit breaker test case"""
+
+    def setUp(self):
+        """Define a breaker with a controlled clock."""
+        self.clock = Clock()
+        self.breaker = CircuitBreaker(
+            window=10, min_requests=4, failure_ratio=0.5, cooldown=5,
+            clock=self.clock)
+
+    def test_opens_when_failures_spike(self):
+        for failed in (False, False, True):
+            self.breaker.record(failed)
+        self.assertEqual(self.breaker.state, 'closed')
+
+        self.breaker.record(True)
+
+        self.assertEqual(self.breaker.state, 'open')
+        with self.assertRaises(ServiceUnavailable) as raised:
+            self.breaker.allow()
+        self.assertEqual(raised.exception.retry_after_seconds, 5)
+
+    def test_old_outcomes_leave_the_window(self):
+        for failed in (True, True, True):
+            self.breaker.record(failed)
+        self.clock.now += 11
+        self.breaker.record(True)
+
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_half_open_lets_one_probe_through(self):
+        self.breaker.open(self.clock())
+        self.clock.now += 5
+
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, 'half-open')
+        with self.assertRaises(ServiceUnavailable):
+            self.breaker.allow()
+
+        self.breaker.record(False, probe=True)
+
+        self.assertEqual(self.breaker.state, 'closed')
+        self.assertFalse(self.breaker.allow())
+
+    def test_failed_probe_reopens(self):
+        self.breaker.open(self.clock())
+        self.clock.now += 5
+
+        self.breaker.record(True, probe=self.breaker.allow())
+
+        self.assertEqual(self.breaker.state, 'open')
+
+
+class ResilienceTestCase(TransactionalTestCase):
+    """This class represents the timeouts and load shedding test case"""
+
+    def setUp(self):
+        """Define test variables and initialize app."""
+        super().setUp()
+        self.guard = self.app.extensions['database_guard']
+        self.shedder = self.app.extensions['load_shedder']
+        self.metrics = self.app.extensions['metrics']
+        self.addCleanup(self.guard.breaker.close)
+
+    def test_statement_timeout_per_endpoint(self):
+        for path, timeout in (('/sets-detail', '15s'),
+                              ('/sets/1/recommendations', '3s')):
+            with self.app.test_request_context(path):
+                db.session.begin_nested()
+                self.assertEqual(db.session.execute(
+                    'SHOW statement_timeout').scalar(), timeout)
+                db.session.rollback()
+
+    def test_statement_timeout_answers_503(self):
+        def slow_search(session, kind, query, limit):
+            session.begin_nested()
+            session.execute('SELECT pg_sleep(1)')
+
+        failures = self.metrics.value('db_failures_total', kind='timeout')
+        with mock.patch.dict(self.guard.timeouts, {'search': 10}), \
+                mock.patch('app.search_names', side_effect=slow_search):
+            res = self.client().get('/search?q=Porsche')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(data['message'], 'database unavailable')
+        self.assertEqual(res.headers['Retry-After'], '1')
+        self.assertEqual(
+            self.metrics.value('db_failures_total', kind='timeout'),
+            failures + 1)
+
+    def test_open_breaker_fails_fast(self):
+        self.guard.breaker.open(self.guard.breaker.clock())
+
+        res = self.client().get('/collectors')
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.headers['Retry-After'], '5')
+
+        res = self.client().get(
+            '/metrics',
+            headers={'Authorization': 'Bearer ' + METRICS_TOKEN})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('db_breaker_state 2', res.data.decode())
+
+    def test_anonymous_reads_are_shed_first(self):
+        shed = self.metrics.value(
+            'requests_shed_total', priority='anonymous', reason='queue')
+        with mock.patch.object(self.shedder, 'queue_depth', return_value=20):
+            res = self.client().get('/sets')
+            self.assertEqual(res.status_code, 503)
+            self.assertEqual(json.loads(res.data)['message'],
+                             'server overloaded')
+
+            res = self.client().get(
+                '/sets-detail', headers={'Authorization': self.manager_token})
+            self.assertEqual(res.status_code, 200)
+
+        self.assertEqual(self.metrics.value(
+            'requests_shed_total', priority='anonymous', reason='queue'),
+            shed + 1)
+
+    def test_invalid_token_is_shed_as_anonymous(self):
+        shed = self.metrics.value(
+            'requests_shed_total', priority='anonymous', reason='queue')
+        with mock.patch.object(self.shedder, 'queue_depth', return_value=20):
+            res = self.client().get('/sets', headers={'Authorization': 'x'})
+            self.assertEqual(res.status_code, 503)
+
+            res = self.client().post(
+                '/sets', headers={'Authorization': 'Bearer x'},
+                json={'id': 87002, 'name': 'Shed Test', 'year': '2021',
+                      'pieces': 10})
+            self.assertEqual(res.status_code, 503)
+
+        self.assertEqual(self.metrics.value(
+            'requests_shed_total', priority='anonymous', reason='queue'),
+            shed + 2)
+
+    def test_writes_pass_a_saturated_pool(self):
+        with mock.patch('resilience.pool_saturated', return_value=True):
+            res = self.client().get(
+                '/sets-detail', headers={'Authorization': self.manager_token})
+            self.assertEqual(res.status_code, 503)
+
+            res = self.client().post(
+                '/sets', headers={'Authorization': self.manager_token},
+                json={'id': 87001, 'name': 'Shed Test', 'year': '2021',
+                      'pieces': 10})
+            self.assertEqual(res.status_code, 200)
+
+        self.assertIsNotNone(Set.query.get(87001))
+        self.assertEqual(self.shedder.in_flight, 0)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
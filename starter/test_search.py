@@ -0,0 +1,197 @@
+import unittest
+import json
+from unittest import mock
+
+from models import db, Collector, Set
+from search import TrigramIndex, np, trigrams
+from testing import TransactionalTestCase
+
+
+class TrigramTestCase(unittest.TestCase):
+    """This class represents the trigram index test case"""
+
+    def setUp(self):
+        """Define a small index."""
+        if np is None:
+            self.skipTest('numpy is not installed')
+
+        self.index = TrigramIndex([
+            (0, 10295, 'Porsche 911'),
+            (0, 21325, 'Medieval Blacksmith'),
+            (0, 21326, 'Medieval Blacksmith'),
+            (0, 40469, 'Tuk Tuk'),
+            (1, 1, 'Porsche Fan')
+            ])
+
+    def test_trigrams_like_pg_trgm(self):
+        self.assertEqual(trigrams('Medieval'), {
+            '  m', ' me', 'med', 'edi', 'die', 'iev', 'eva', 'val', 'al '})
+        self.assertEqual(trigrams('Tuk-Tuk'), {'  t', ' tu', 'tuk', 'uk '})
+
+    def test_search_tolerates_typos(self):
+        self.assertEqual(
+            [id for id, _, _ in self.index.search(0, 'Porshe 911')],
+            [10295])
+        self.assertEqual(
+            [id for id, _, _ in self.index.search(0, 'Medeival')],
+            [21325, 21326])
+
+    def test_search_by_kind(self):
+        found = self.index.search(1, 'Porsche')
+
+        self.assertEqual([id for id, _, _ in found], [1])
+        self.assertEqual(found[0][2], 1.0)
+
+    def test_search_limit(self):
+        found = self.index.search(0, 'Medieval Blacksmith', limit=1)
+
+        self.assertEqual([id for id, _, _ in found], [21325])
+
+    def test_search_level_by_level(self):
+        queries = [('Porshe 911', 10), ('Medeival', 10),
+                   ('Medieval Blacksmith', 1), ('Porsche', 10)]
+        direct = [self.index.search(0, query, limit)
+                  for query, limit in queries]
+
+        with mock.patch('search.DIRECT_CANDIDATES', 0), \
+                mock.patch('search.FIRST_CANDIDATES', 1):
+            self.assertEqual([self.index.search(0, query, limit)
+                              for query, limit in queries], direct)
+            self.index.update([(0, 21325, None)])
+            self.assertEqual(
+                [id for id, _, _ in self.index.search(0, 'Medeival')],
+                [21326])
+
+    def test_update(self):
+        self.index.update([
+            (0, 10295, 'Porsche 911 GT3 RS'),
+            (0, 40469, None),
+            (0, 42115, 'Lamborghini Sian')
+            ])
+
+        self.assertEqual(self.index.search(0, 'Tuk Tuk'), [])
+        self.assertEqual(
+            [name for _, name, _ in self.index.search(0, 'Porsche')],
+            ['Porsche 911 GT3 RS'])
+        self.assertEqual(
+            [id for id, _, _ in self.index.search(0, 'Lamborgini')],
+            [42115])
+
+    def test_update_publishes_a_new_state(self):
+        alive, delta = self.index.state
+
+        self.index.update([(0, 10295, 'Porsche 911 GT3 RS')])
+
+        # a search that took the state before the update still finds it
+        self.assertTrue(alive.all())
+        self.assertEqual(delta.names, {})
+        self.assertFalse(self.index.state[0].all())
+
+
+class SearchTestCase(TransactionalTestCase):
+    """This class represents the name search test case"""
+
+    def setUp(self):
+        """Define test variables and initialize app."""
+        super().setUp()
+        if 'search_index' not in self.app.extensions:
+            self.skipTest('the memory backend is not configured')
+        self.app.extensions['search_index'].reset()
+
+        for id, name in ((85001, 'Porsche 911'),
+                         (85002, 'Medieval Blacksmith'),
+                         (85003, 'Lighthouse')):
+            Set(id=id, name=name, year='2021', pieces=100).insert()
+        self.collector = Collector(
+            name='Margaret Hamilton', location='Boston', legos=[])
+        self.collector.insert()
+
+    def test_search_sets(self):
+        res = self.client().get('/search?q=Medeival')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['query'], 'Medeival')
+        self.assertEqual(data['results'][0]['id'], 85002)
+        self.assertEqual(data['results'][0]['type'], 'sets')
+        self.assertEqual(data['results'][0]['name'], 'Medieval Blacksmith')
+
+    def test_search_collectors_requires_permission(self):
+        res = self.client().get('/search?type=collectors&q=Margret')
+
+        self.assertEqual(res.status_code, 401)
+
+        res = self.client().get(
+            '/search?type=collectors&q=Margret',
+            headers={'Authorization': self.manager_token})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['results'][0]['id'], self.collector.id)
+
+    def test_search_follows_writes(self):
+        self.client().get('/search?q=Lighthouse')
+
+        set = Set.query.get(85003)
+        set.name = 'Lunar Research Base'
+        set.update()
+
+        with mock.patch.object(
+                self.app.extensions['search_index'], 'sync_interval', 0):
+            res = self.client().get('/search?q=Lunar Reserch')
+        data = json.loads(res.data)
+
+        self.assertEqual([result['id'] for result in data['results']],
+                         [85003])
+
+    def test_search_422(self):
+        for path in ('/search', '/search?q=Porsche&type=themes',
+                     '/search?q=Porsche&limit=500'):
+            res = self.client().get(path)
+            self.assertEqual(res.status_code, 422)
+
+
+class TrigramBackendTestCase(TransactionalTestCase):
+    """This class represents the pg_trgm search backend test case"""
+
+    def test_search_503_without_pg_trgm(self):
+        with mock.patch.dict(self.app.extensions), \
+                mock.patch('search.trigrams_installed', return_value=False):
+            self.app.extensions.pop('search_index', None)
+            res = self.client().get('/search?q=Medeival')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'name search unavailable')
+
+
+class TrigramSearchTestCase(TransactionalTestCase):
+    """This class represents the pg_trgm search backend test case"""
+
+    def setUp(self):
+        """Define test variables and initialize app."""
+        super().setUp()
+        available = db.session.execute(
+            "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'").scalar()
+        if not available:
+            self.skipTest('pg_trgm is not installed')
+
+        Set(id=85101, name='Medieval Blacksmith', year='2021',
+            pieces=2164).insert()
+
+    def test_search_sets(self):
+        with mock.patch.dict(self.app.extensions), \
+                mock.patch.dict(self.app.config, {'SEARCH_THRESHOLD': 0.4}):
+            self.app.extensions.pop('search_index', None)
+            res = self.client().get('/search?q=Medeival')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(85101, [result['id'] for result in data['results']])
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import unittest
+import json
+from unittest import mock
+
+from models import db, Collector, Set
+from snapshot import CatalogueSnapshot, SnapshotPoller
+from testing import TransactionalTestCase
+
+
+class SnapshotTestCase(TransactionalTestCase):
+    """This class represents the catalogue snapshot test case"""
+
+    def setUp(self):
+        """Define test variables and initialize app."""
+        super().setUp()
+
+        sets = [Set(id=id, name='Set {}'.format(id), year='2021',
+                    pieces=100 * index)
+                for index, id in enumerate(range(90001, 90004), start=1)]
+        for set in sets:
+            set.insert()
+
+        for name, owned in (('Paul', sets[:2]), ('John', sets[1:2])):
+            Collector(name=name, location='Liverpool', legos=owned).insert()
+
+        # a poller that is never started, loaded from the test transaction
+        self.poller = SnapshotPoller(self.app)
+        self.poller.pid = os.getpid()
+
+    def get(self, path, snapshot, **kwargs):
+        if snapshot:
+            self.poller.current = CatalogueSnapshot.load(
+                db.session.connection())
+            extensions = {'catalogue_snapshot': self.poller}
+        else:
+            extensions = {}
+
+        with mock.patch.dict(self.app.extensions, extensions):
+            res = self.client().get(path, **kwargs)
+        return res
+
+    def assertSameListing(self, path, key, **kwargs):
+        database = json.loads(self.get(path, False, **kwargs).data)
+        snapshot = json.loads(self.get(path, True, **kwargs).data)
+
+        def rows(data):
+            if 'columns' in data[key]:
+                return data[key]['columns'], sorted(
+                    zip(*data[key]['values']), key=repr)
+            return sorted(data[key], key=repr)
+
+        self.assertEqual(rows(snapshot), rows(database))
+
+    def test_snapshot_matches_database(self):
+        self.assertSameListing('/sets', 'sets')
+        self.assertSameListing(
+            '/sets-detail', 'sets',
+            headers={'Authorization': self.manager_token})
+        self.assertSameListing('/collectors', 'collectors')
+        self.assertSameListing(
+            '/collectors-detail', 'collectors',
+            headers={'Authorization': self.manager_token})
+
+    def test_snapshot_columnar(self):
+        accept = {'Accept': 'application/vnd.lego.columnar+json'}
+        self.assertSameListing('/sets', 'sets', headers=accept)
+        self.assertSameListing(
+            '/collectors-detail', 'collectors',
+            headers=dict(accept, Authorization=self.manager_token))
+
+    def test_snapshot_popularity(self):
+        res = self.get('/sets?sort=popularity', True)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['sets'][0]['set number'], 90002)
+        self.assertEqual(data['sets'][0]['number of collectors'], 2)
+
+    def test_snapshot_serves_without_database(self):
+        self.poller.current = CatalogueSnapshot.load(db.session.connection())
+
+        with mock.patch.dict(self.app.extensions,
+                             {'catalogue_snapshot': self.poller}), \
+                mock.patch.object(Set, 'query') as query:
+            res = self.client().get('/sets')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertFalse(query.mock_calls)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,227 @@
+import base64
+import json
+import os
+import tempfile
+import time
+import unittest
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
+from Crypto.PublicKey import RSA
+from jose import jwt
+
+from app import create_app
+from models import db
+
+'''
+Test Harness
+    everything the test modules share:
+
+    - a database per test worker, named after TEST_WORKER (set by
+      run_tests.py) or PYTEST_XDIST_WORKER, whose schema is built once per
+      process
+    - one app per process, configured for the test database
+    - a local signing key published as a JWKS file, so tokens are minted
+      for the test instead of taken from Auth0
+    - TransactionalTestCase, which runs every test inside a transaction
+      that is rolled back afterwards
+
+    TEST_DATABASE_URL points to the server and base database name
+    (postgresql://postgres@localhost:5432/lego_test by default)
+'''
+
+DEFAULT_TEST_DATABASE_URL = 'postgresql://postgres@localhost:5432/lego_test'
+
+AUTH0_DOMAIN = 'lego-test.local'
+API_AUDIENCE = 'lego'
+KEY_ID = 'lego-test-key'
+METRICS_TOKEN = 'lego-test-metrics'
+
+MANAGER_PERMISSIONS = [
+    'get:sets-detail',
+    'post:sets',
+    'patch:sets',
+    'delete:sets',
+    'get:collectors-detail'
+    ]
+
+DIRECTOR_PERMISSIONS = MANAGER_PERMISSIONS + [
+    'post:collectors',
+    'patch:collectors',
+    'delete:collectors'
+    ]
+
+_state = {}
+
+
+def worker_name():
+    return os.environ.get('TEST_WORKER') or \
+        os.environ.get('PYTEST_XDIST_WORKER') or 'main'
+
+
+def database_url():
+    url = make_url(
+        os.environ.get('TEST_DATABASE_URL', DEFAULT_TEST_DATABASE_URL))
+    url.database = '{}_{}'.format(url.database, worker_name())
+    return url
+
+
+'''
+create_database(url)
+    creates the worker database if it does not exist yet
+'''
+
+
+def create_database(url):
+    server = make_url(str(url))
+    server.database = 'postgres'
+    engine = create_engine(server, isolation_level='AUTOCOMMIT')
+    try:
+        with engine.connect() as connection:
+            exists = connection.execute(
+                'SELECT 1 FROM pg_database WHERE datname = %s',
+                url.database).scalar()
+            if not exists:
+                connection.execute('CREATE DATABASE "{}"'.format(url.database))
+    finally:
+        engine.dispose()
+
+
+def b64(number):
+    data = number.to_bytes((number.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+'''
+signing_key()
+    creates the RSA key of this process and publishes its public half as a
+    JWKS document in a temporary file, read by auth through a file:// URL
+'''
+
+
+def signing_key():
+    if 'key' not in _state:
+        key = RSA.generate(2048)
+        jwks = {'keys': [{
+            'kty': 'RSA',
+            'kid': KEY_ID,
+            'use': 'sig',
+            'alg': 'RS256',
+            'n': b64(key.n),
+            'e': b64(key.e)
+            }]}
+
+        handle, path = tempfile.mkstemp(prefix='jwks-', suffix='.json')
+        with os.fdopen(handle, 'w') as f:
+            json.dump(jwks, f)
+
+        _state['key'] = key.exportKey('PEM').decode('ascii')
+        _state['jwks_url'] = 'file://' + path
+
+    return _state['key'], _state['jwks_url']
+
+
+def mint_token(permissions, sub='auth0|lego-test', expires_in=3600):
+    key, _ = signing_key()
+    now = int(time.time())
+    claims = {
+        'iss': 'https://{}/'.format(AUTH0_DOMAIN),
+        'sub': sub,
+        'aud': API_AUDIENCE,
+        'iat': now,
+        'exp': now + expires_in,
+        'permissions': permissions
+        }
+    token = jwt.encode(
+        claims, key, algorithm='RS256', headers={'kid': KEY_ID})
+    return 'Bearer ' + token
+
+
+def app_config(overrides=None):
+    _, jwks_url = signing_key()
+    config = {
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': str(database_url()),
+        'AUTH0_DOMAIN': AUTH0_DOMAIN,
+        'API_AUDIENCE': API_AUDIENCE,
+        'ALGORITHMS': ['RS256'],
+        'AUTH0_JWKS_URL': jwks_url,
+        'METRICS_TOKEN': METRICS_TOKEN,
+        'RATELIMIT_ENABLED': False,
+        # the tests install the payload triggers in their own transaction
+        'PAYLOADS_CHECK_INTERVAL': 0
+        }
+    config.update(overrides or {})
+    return config
+
+
+'''
+get_app()
+    returns the app shared by the tests of this process, the first call
+    creates the worker database and builds its schema from the models
+'''
+
+
+def get_app():
+    if 'app' not in _state:
+        create_database(database_url())
+        app = create_app(app_config())
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+        _state['app'] = app
+
+    return _state['app']
+
+
+'''
+TransactionalTestCase
+    binds the sessions to a connection with an open transaction and runs
+    the test in a savepoint of that connection, a commit in a route
+    releases the savepoint and a rollback rolls it back, and a new one is
+    started right away
+    the listener is kept on the session factory, so the session Flask-
+    SQLAlchemy creates after removing one at the end of an app context
+    joins the same transaction
+    everything is rolled back in tearDown, so tests never see each other's
+    data and never clean up
+'''
+
+
+class TransactionalTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = get_app()
+        self.client = self.app.test_client
+        self.context = self.app.app_context()
+        self.context.push()
+
+        self.connection = db.engine.connect()
+        self.transaction = self.connection.begin()
+        self.savepoint = self.connection.begin_nested()
+        self.original_session = db.session
+        db.session = db.create_scoped_session(
+            options={'bind': self.connection, 'binds': {}})
+
+        def restart_savepoint(session, transaction):
+            if transaction.parent is None:
+                if self.savepoint.is_active:
+                    self.savepoint.commit()
+                self.savepoint = self.connection.begin_nested()
+
+        self.restart_savepoint = restart_savepoint
+        event.listen(db.session.session_factory, 'after_transaction_end',
+                     restart_savepoint)
+
+        self.manager_token = mint_token(
+            MANAGER_PERMISSIONS, sub='auth0|lego-manager')
+        self.director_token = mint_token(
+            DIRECTOR_PERMISSIONS, sub='auth0|lego-director')
+
+    def tearDown(self):
+        event.remove(db.session.session_factory, 'after_transaction_end',
+                     self.restart_savepoint)
+        db.session.remove()
+        db.session = self.original_session
+        self.transaction.rollback()
+        self.connection.close()
+        self.context.pop()